@@ -0,0 +1,71 @@
+"""Answer checking throughput on one core.
+
+Run from the backend folder:
+
+    python benchmarks/answers.py
+
+Checks a mix of exact, reworded and misspelled guesses against normalized
+answers and reports answers per second, with and without a warm
+normalization cache.
+"""
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from textutils import check_answer, normalize_answer
+
+ANSWERS = [
+  'Maya Angelou', 'Muhammad Ali', 'Apollo 13', 'Tom Cruise', 'Edward Scissorhands',
+  'Brazil', 'Uruguay', 'George Washington Carver', 'Lake Victoria', 'The Palace of Versailles',
+  'Agra', 'Escher', 'Mona Lisa', 'One', 'Jackson Pollock', 'The Liver', 'Alexander Fleming',
+  'Blood', 'Scarab',
+]
+CHECKS = 200000
+
+
+def misspell(text, rng):
+  chars = list(text)
+  position = rng.randrange(len(chars))
+  chars[position] = rng.choice('abcdefghijklmnopqrstuvwxyz')
+  return ''.join(chars)
+
+
+def make_guesses(rng):
+  guesses = []
+  for _ in range(CHECKS):
+    answer = rng.choice(ANSWERS)
+    kind = rng.random()
+    if kind < 0.4:
+      guess = answer.upper()
+    elif kind < 0.8:
+      guess = misspell(answer, rng)
+    else:
+      guess = rng.choice(ANSWERS)
+    guesses.append((guess, normalize_answer(answer)))
+  return guesses
+
+
+def run(guesses):
+  start = time.perf_counter()
+  correct = sum(check_answer(guess, answer) for guess, answer in guesses)
+  return correct, time.perf_counter() - start
+
+
+def main():
+  rng = random.Random(42)
+  guesses = make_guesses(rng)
+
+  normalize_answer.cache_clear()
+  correct, cold = run(guesses)
+  _, warm = run(guesses)
+
+  print('%d checks, %d accepted' % (CHECKS, correct))
+  print('cold cache: %10.0f answers/sec' % (CHECKS / cold))
+  print('warm cache: %10.0f answers/sec' % (CHECKS / warm))
+
+
+if __name__ == '__main__':
+  main()
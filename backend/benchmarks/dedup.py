@@ -0,0 +1,70 @@
+"""Near-duplicate check speed at question create time.
+
+Run from the backend folder:
+
+    python benchmarks/dedup.py
+
+Fills an LSH index with made-up questions the size of a large question
+bank, then times the check POST /questions runs before an insert: the
+MinHash signature of the new text plus the LSH lookup. Half the checks
+are reworded copies of banked questions. Fails if the median check
+leaves the sub-millisecond budget.
+"""
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flaskr.dedup import LshIndex, shingle_hash, signature
+
+BANK = 50000
+CHECKS = 2000
+THRESHOLD = 0.8
+BUDGET_MS = 0.5
+
+VOCABULARY = 5000
+
+
+def make_word(rng):
+  return ''.join(rng.choice('etaoinshrdlcumwfgypbvk') for _ in range(rng.randint(3, 11)))
+
+
+def make_question(words, rng):
+  return ' '.join(rng.choice(words) for _ in range(rng.randint(6, 14))).capitalize() + '?'
+
+
+def reword(text, words, rng):
+  # a reworded copy: one word swapped and the case changed
+  parts = text.rstrip('?').split()
+  parts[rng.randrange(len(parts))] = rng.choice(words)
+  return ' '.join(parts).upper() + '?'
+
+
+def main():
+  rng = random.Random(7)
+  words = [make_word(rng) for _ in range(VOCABULARY)]
+  questions = [make_question(words, rng) for _ in range(BANK)]
+  index = LshIndex()
+  for question_id, text in enumerate(questions):
+    index.add(question_id, signature(text))
+
+  checks = [reword(rng.choice(questions), words, rng) if rng.random() < 0.5 else make_question(words, rng) for _ in range(CHECKS)]
+  shingle_hash.cache_clear()
+  timings = []
+  for text in checks:
+    start = time.perf_counter()
+    index.query(signature(text), THRESHOLD)
+    timings.append((time.perf_counter() - start) * 1000)
+
+  print('%d questions indexed, %d checks' % (BANK, CHECKS))
+  print('duplicate check: median %.3f ms, p99 %.3f ms' % (statistics.median(timings), sorted(timings)[int(CHECKS * 0.99)]))
+  if statistics.median(timings) > BUDGET_MS:
+    print('duplicate check exceeds the %.1f ms budget' % BUDGET_MS)
+    sys.exit(1)
+
+
+if __name__ == '__main__':
+  main()
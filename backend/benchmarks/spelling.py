@@ -0,0 +1,85 @@
+"""Typo correction speed, SymSpell deletion index against plain Levenshtein.
+
+Run from the backend folder:
+
+    python benchmarks/spelling.py
+
+Builds a vocabulary of made-up words the size of a large question bank,
+misspells some of them, and corrects each misspelling twice: through the
+deletion dictionary of the search subsystem, and by checking the edit
+distance to every word of the vocabulary. Reports corrections per second
+and how often the two agree.
+"""
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flaskr.search import MIN_TOKEN_LENGTH, SpellIndex, allowed_edits
+from textutils import within_edit_distance
+
+VOCABULARY = 30000
+QUERIES = 2000
+
+
+def make_word(rng):
+  return ''.join(rng.choice('etaoinshrdlcumwfgypbvk') for _ in range(rng.randint(3, 11)))
+
+
+def misspell(word, rng):
+  position = rng.randrange(len(word))
+  kind = rng.random()
+  if kind < 0.4:
+    return word[:position] + rng.choice('abcdefghijklmnopqrstuvwxyz') + word[position + 1:]
+  if kind < 0.7:
+    return word[:position] + word[position + 1:]
+  return word[:position] + rng.choice('abcdefghijklmnopqrstuvwxyz') + word[position:]
+
+
+def naive_correct(word, counts):
+  # what a search without an index has to do: a distance check against every word
+  if word in counts or len(word) < MIN_TOKEN_LENGTH:
+    return word
+  best = None
+  for candidate, count in counts.items():
+    for distance in range(1, allowed_edits(word) + 1):
+      if within_edit_distance(word, candidate, distance):
+        key = (distance, -count, candidate)
+        if best is None or key < best:
+          best = key
+        break
+  return best[2] if best is not None else word
+
+
+def main():
+  rng = random.Random(7)
+  words = [make_word(rng) for _ in range(VOCABULARY)]
+  index = SpellIndex()
+  start = time.perf_counter()
+  for word in words:
+    index._add(word)
+  index._loaded = True
+  build = time.perf_counter() - start
+
+  queries = [misspell(rng.choice(words), rng) for _ in range(QUERIES)]
+
+  start = time.perf_counter()
+  indexed = [index.correct(query) for query in queries]
+  indexed_time = time.perf_counter() - start
+
+  naive_queries = queries[:QUERIES // 20]
+  start = time.perf_counter()
+  naive = [naive_correct(query, index._counts) for query in naive_queries]
+  naive_time = time.perf_counter() - start
+
+  agree = sum(1 for one, other in zip(indexed, naive) if one == other)
+  print('%d words, %d deletion entries, built in %.2fs' % (len(index._counts), len(index._deletes), build))
+  print('deletion index:  %10.0f corrections/sec' % (len(queries) / indexed_time))
+  print('naive distance:  %10.0f corrections/sec' % (len(naive_queries) / naive_time))
+  print('same correction for %d of %d queries' % (agree, len(naive)))
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,62 @@
+"""Search suggestion speed on a large term array.
+
+Run from the backend folder:
+
+    python benchmarks/suggest.py
+
+Fills a suggestion index with made-up terms the size of a large question
+bank, then times suggestions for one to four letter prefixes while
+question writes and searches keep changing popularity in between, so the
+top lists of short prefixes are kept current rather than served from a
+warm cache. Fails if the median suggestion leaves the sub-millisecond
+budget.
+"""
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flaskr.search import SuggestIndex
+
+TERMS = 200000
+QUERIES = 5000
+LIMIT = 8
+BUDGET_MS = 1.0
+
+
+def make_word(rng):
+  return ''.join(rng.choice('etaoinshrdlcumwfgypbvk') for _ in range(rng.randint(3, 11)))
+
+
+def main():
+  rng = random.Random(7)
+  words = [make_word(rng) for _ in range(TERMS * 2)]
+  index = SuggestIndex(TERMS)
+  index._questions = {word: rng.randint(1, 50) for word in words[:TERMS]}
+  index._terms = sorted(index._questions)
+  index._loaded = True
+
+  timings = []
+  for _ in range(QUERIES):
+    word = rng.choice(words)
+    if rng.random() < 0.5:
+      index._add(word)
+    else:
+      index.record_search(word)
+    prefix = word[:rng.randint(1, 4)]
+    start = time.perf_counter()
+    index.suggest(prefix, LIMIT)
+    timings.append((time.perf_counter() - start) * 1000)
+
+  print('%d terms, %d suggestions between writes' % (len(index._terms), QUERIES))
+  print('suggestion: median %.3f ms, p99 %.3f ms' % (statistics.median(timings), sorted(timings)[int(QUERIES * 0.99)]))
+  if statistics.median(timings) > BUDGET_MS:
+    print('suggestion exceeds the %.1f ms budget' % BUDGET_MS)
+    sys.exit(1)
+
+
+if __name__ == '__main__':
+  main()
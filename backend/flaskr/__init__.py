@@ -1,12 +1,41 @@
 import os
-from flask import Flask, request, abort, jsonify
+import atexit
+import functools
+import json
+import secrets
+from datetime import datetime
+from flask import Flask, Response, request, abort, jsonify, g, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
-import random
+from sqlalchemy import func, tuple_
 
-from models import setup_db, Question, Category
+from models import db, setup_db, ANONYMOUS_PLAYER, on_categories_changed, on_categories_commit, on_questions_changed, on_questions_commit, format_stats, Answer, Question, QuestionNeighbour, QuestionStats, Category, Score
+from settings import INGEST_QUEUE_SIZE, INGEST_BATCH_SIZE, INGEST_FLUSH_SECONDS, INGEST_PUT_TIMEOUT
+from settings import STATS_FLUSH_SECONDS, DEDUP_THRESHOLD, SUGGEST_MAX_TERMS, TAG_BATCH_SIZE, BULK_BATCH_SIZE
+from settings import ANALYTICS_SKETCH_WIDTH, ANALYTICS_SKETCH_DEPTH, ANALYTICS_TOP_K, ANALYTICS_HLL_PRECISION
+from settings import ANALYTICS_WINDOW_SECONDS
+from settings import ROOM_QUEUE_SIZE, ROOM_KEEPALIVE_SECONDS, ROOM_IDLE_SECONDS
+from settings import API_KEYS, RATE_LIMITS, RATE_LIMIT_DEFAULT, REDIS_URL, MAX_CONCURRENT_REQUESTS, RETRY_AFTER_SECONDS
+from settings import INVALIDATION_BUS
+from settings import RESPONSE_CACHE_BACKEND, RESPONSE_CACHE_ENTRIES, RESPONSE_CACHE_BYTES, RESPONSE_CACHE_TTL
+from settings import RESPONSE_CACHE_MAX_STALE
+from settings import ADAPTIVE_K, RATING_INDEX_MAX_AGE
+from textutils import check_answer, normalize_answer
+from .commands import register_commands
+from .ingestion import EventBuffer
+from .lazy import LazyExtension
+from .leaderboard import Leaderboard
+from .rooms import RoomRegistry
+from .tags import ensure_tags, normalize_tags, tag_questions
+from .coalescing import coalesce, create_single_flight
+from .invalidation import InvalidationBus
+from .response_cache import DATABASE_UNAVAILABLE, ResponseCache, create_cache_backend
+from .throttling import RateLimiter, ConcurrencyLimiter, create_bucket_store, init_throttling
 
 QUESTIONS_PER_PAGE = 10
+QUIZ_BATCH_LIMIT = 20
+# scores.score is a 4-byte integer
+MAX_SCORE = 2 ** 31 - 1
 
 
 def paginate_questions(request, selection):
@@ -20,12 +49,218 @@ def paginate_questions(request, selection):
   return current_questions
 
 
+def format_quiz_question(question):
+  # answers stay on the server, guesses are checked by /quizzes/answer
+  formatted = question.format()
+  formatted.pop('answer')
+  return formatted
+
+
+def select_questions_by_id(ids):
+  # one query for the whole set, returned in the order the ids were drawn
+  questions = {question.id: question for question in Question.query.filter(Question.id.in_(ids), Question.deleted_at.is_(None)).all()}
+  return [questions[question_id] for question_id in ids if question_id in questions]
+
+
+def with_stats(questions):
+  # one primary key lookup for the whole page, questions never played get zeros
+  rows = {row.question_id: row for row in QuestionStats.query.filter(QuestionStats.question_id.in_([question['id'] for question in questions]))} if questions else {}
+  for question in questions:
+    row = rows.get(question['id'])
+    question['stats'] = row.format() if row is not None else format_stats(0, 0, 0)
+  return questions
+
+
+def page_of_questions(request, bitmaps, filters):
+  # the page's ids come from the bitmap index, only those rows are read
+  page = request.args.get("page", 1, type=int)
+  start = (page - 1) * QUESTIONS_PER_PAGE
+  if start < 0:
+    return [], bitmaps.count(filters)
+  ids, total = bitmaps.page(filters, start, start + QUESTIONS_PER_PAGE)
+  return with_stats([question.format() for question in select_questions_by_id(ids)]), total
+
+
+def filter_values(request, name):
+  # "?difficulty=1,2" accepts either value, a missing argument accepts any
+  value = request.args.get(name, None)
+  if value is None:
+    return None
+  return [item.strip() for item in value.split(",") if item.strip()]
+
+
+def search_facets(condition):
+  # one pass over the matches: counts per category, per difficulty and in total
+  rows = db.session.query(
+    Question.category,
+    Question.difficulty,
+    func.grouping(Question.category, Question.difficulty),
+    func.count(Question.id)
+  ).filter(condition).group_by(
+    func.grouping_sets(tuple_(Question.category), tuple_(Question.difficulty), tuple_())
+  ).all()
+
+  facets = {'categories': {}, 'difficulties': {}}
+  total = 0
+  for category, difficulty, grouping, count in rows:
+    if grouping == 1:
+      facets['categories'][str(category)] = count
+    elif grouping == 2:
+      facets['difficulties'][str(difficulty)] = count
+    else:
+      total = count
+  return facets, total
+
+
 def create_app(test_config=None):
   # create and configure the app
+  # nothing here may touch the database, the engine connects on first request
   app = Flask(__name__)
   setup_db(app)
+  if test_config is not None:
+    app.config.from_mapping(test_config)
+  register_commands(app)
   CORS(app)
 
+  # turn away abusive clients and overload before any database work
+  init_throttling(
+    app,
+    RateLimiter(create_bucket_store(REDIS_URL), RATE_LIMITS, RATE_LIMIT_DEFAULT),
+    ConcurrencyLimiter(MAX_CONCURRENT_REQUESTS),
+    RETRY_AFTER_SECONDS,
+    API_KEYS
+  )
+
+  # answers and scores are written behind the request, in batches
+  def event_buffer(table):
+    events = EventBuffer(app, table, INGEST_QUEUE_SIZE, INGEST_BATCH_SIZE, INGEST_FLUSH_SECONDS, INGEST_PUT_TIMEOUT)
+    atexit.register(events.close)
+    return events
+
+  answer_events = event_buffer(Answer.__table__)
+  score_events = event_buffer(Score.__table__)
+  app.extensions['answer_events'] = answer_events
+  app.extensions['score_events'] = score_events
+
+  leaderboard = Leaderboard(score_events)
+  app.extensions['leaderboard'] = leaderboard
+
+  # the subsystems below are built, and their modules imported, by the first request that uses them
+
+  # times served and answered per question, added to question_stats periodically
+  def build_stats():
+    from .stats import StatsCounters
+    counters = StatsCounters(app, STATS_FLUSH_SECONDS)
+    atexit.register(counters.close)
+    return counters
+
+  stats = LazyExtension(build_stats)
+  app.extensions['question_stats'] = stats
+  # every answer counts, so the first batch written builds the counters
+  answer_events.on_written(lambda rows: stats.record_answers(rows))
+
+  # what is hot right now, in fixed memory however busy it gets
+  def build_analytics():
+    from .analytics import create_stream_analytics
+    return create_stream_analytics(
+      REDIS_URL, ANALYTICS_SKETCH_WIDTH, ANALYTICS_SKETCH_DEPTH, ANALYTICS_TOP_K, ANALYTICS_HLL_PRECISION,
+      ANALYTICS_WINDOW_SECONDS
+    )
+
+  analytics = LazyExtension(build_analytics)
+  app.extensions['analytics'] = analytics
+
+  # identical concurrent reads share one query and one serialized response
+  flights = create_single_flight(REDIS_URL)
+
+  # rendered list pages, dropped by tag when a question in them is written
+  # kept past their TTL so pages can be served stale through a database outage
+  cache = ResponseCache(create_cache_backend(
+    RESPONSE_CACHE_BACKEND, REDIS_URL, RESPONSE_CACHE_ENTRIES, RESPONSE_CACHE_BYTES, RESPONSE_CACHE_MAX_STALE
+  ), RESPONSE_CACHE_TTL, RESPONSE_CACHE_MAX_STALE)
+  app.extensions['response_cache'] = cache
+  on_questions_changed(app, cache.on_questions_changed)
+
+  # the in-memory indexes load from the database when first used,
+  # so until then there is nothing for a change to update
+  def build_bitmaps():
+    from .bitmaps import BitmapIndex
+    return BitmapIndex()
+
+  def build_tree():
+    from .categories import CategoryTree
+    return CategoryTree()
+
+  def build_ratings():
+    from .adaptive import RatingIndex
+    return RatingIndex(RATING_INDEX_MAX_AGE)
+
+  def build_duplicates():
+    from .dedup import DuplicateIndex
+    return DuplicateIndex(DEDUP_THRESHOLD)
+
+  def build_suggestions():
+    from .search import SuggestIndex
+    return SuggestIndex(SUGGEST_MAX_TERMS)
+
+  def build_spelling():
+    from .search import SpellIndex
+    return SpellIndex()
+
+  # a bitmap of question ids per category and per difficulty, for filtered lists, counts and quizzes
+  bitmaps = LazyExtension(build_bitmaps)
+  app.extensions['bitmap_index'] = bitmaps
+  on_questions_changed(app, bitmaps.if_built('on_questions_changed'))
+
+  # the category tree, so a category filter takes in every subcategory without a query
+  tree = LazyExtension(build_tree)
+  app.extensions['category_tree'] = tree
+  on_categories_changed(app, tree.if_built('reset'))
+  on_categories_changed(app, cache.on_categories_changed)
+
+  # questions sorted by rating for adaptive quizzes
+  ratings = LazyExtension(build_ratings)
+  app.extensions['rating_index'] = ratings
+  on_questions_changed(app, ratings.if_built('on_questions_changed'))
+
+  # MinHash signatures of every question to catch near-duplicates on insert
+  duplicates = LazyExtension(build_duplicates)
+  app.extensions['duplicate_index'] = duplicates
+  on_questions_changed(app, duplicates.if_built('on_questions_changed'))
+
+  # sorted terms of every question for search-as-you-type
+  suggestions = LazyExtension(build_suggestions)
+  app.extensions['suggest_index'] = suggestions
+  on_questions_changed(app, suggestions.if_built('on_questions_changed'))
+
+  # every known word, indexed by its deletions for typo-tolerant search
+  spelling = LazyExtension(build_spelling)
+  app.extensions['spell_index'] = spelling
+  on_questions_changed(app, spelling.if_built('on_questions_changed'))
+
+  # replay other workers' writes here, the listener connects with the first request
+  if app.config.get('INVALIDATION_BUS', INVALIDATION_BUS):
+    bus = InvalidationBus(app)
+    bus.on_reset(cache.clear)
+    bus.on_reset(tree.if_built('reset'))
+    bus.on_reset(bitmaps.if_built('reset'))
+    bus.on_reset(ratings.if_built('reset'))
+    bus.on_reset(duplicates.if_built('reset'))
+    bus.on_reset(suggestions.if_built('reset'))
+    bus.on_reset(spelling.if_built('reset'))
+    bus.on_reset(leaderboard.reset)
+    # every worker ranks every score, not only the ones posted to it
+    leaderboard.on_score(functools.partial(bus.send, 'score'))
+    bus.on_message('score', leaderboard.record)
+    # announced from inside each write's transaction, so a committed change is never left unannounced
+    on_questions_commit(app, bus.publish)
+    on_categories_commit(app, bus.publish_categories)
+    app.extensions['invalidation_bus'] = bus
+    app.before_first_request(bus.start)
+
+  rooms = RoomRegistry(ROOM_QUEUE_SIZE, ROOM_KEEPALIVE_SECONDS, ROOM_IDLE_SECONDS)
+  app.extensions['rooms'] = rooms
+
 
   #@TODO: Set up CORS. 
   CORS(app, resources={"/": {"origins": "*"}})
@@ -37,7 +272,7 @@ def create_app(test_config=None):
       "Access-Control-Allow-Headers", "Content-Type,Authorization,true"
     )
     response.headers.add(
-      "Access-Control-Allow-Methods", "GET,PUT,POST,DELETE,OPTIONS"
+      "Access-Control-Allow-Methods", "GET,PUT,POST,PATCH,DELETE,OPTIONS"
     )
     return response
     
@@ -45,11 +280,10 @@ def create_app(test_config=None):
 
   #Create an endpoint to handle GET requests for all available categories.
   @app.route("/categories", methods=['GET'])
+  @cache.cached(lambda: ['categories'])
+  @coalesce(flights)
   def retrieve_categories():
-    categories = Category.query.all()
-    categories_dict = {}
-    for category in categories:
-      categories_dict[category.id] = category.type
+    categories_dict = tree.types()
 
     # abort 404 if no categories found
     if (len(categories_dict) == 0):
@@ -59,22 +293,76 @@ def create_app(test_config=None):
     return jsonify({
       'success': True,
       # 'categories': categories_dict
-      "categories": {category.id: category.type for category in categories}
+      "categories": categories_dict,
       # 'total_categories': len(Category.query.all())
+      "parents": tree.parents()
+    })
+
+
+
+  #Create an endpoint to POST a new category, optionally below a "parent_id".
+  @app.route("/categories", methods=['POST'])
+  def create_new_category():
+    from .categories import create_category
+    body = request.get_json() or {}
+    new_type = body.get("type", None)
+    parent_id = body.get("parent_id", None)
+
+    if not isinstance(new_type, str) or not new_type.strip():
+      abort(400)
+    if parent_id is not None and (not isinstance(parent_id, int) or tree.get(parent_id) is None):
+      abort(422)
+
+    category = create_category(new_type.strip(), parent_id)
+
+    return jsonify({
+      "success": True,
+      "created": category.id,
+      "parent_id": parent_id
+    })
+
+
+
+  #Create an endpoint to PATCH a category's parent, moving it with its subcategories. A null "parent_id" makes it top level.
+  @app.route("/categories/<int:category_id>", methods=['PATCH'])
+  def move_existing_category(category_id):
+    from .categories import move_category
+    body = request.get_json() or {}
+    category = Category.query.filter(Category.id == category_id).one_or_none()
+    if category is None:
+      abort(404)
+    if "parent_id" not in body:
+      abort(400)
+
+    parent_id = body["parent_id"]
+    # a category cannot go below itself or one of its own subcategories
+    if parent_id is not None and (not isinstance(parent_id, int) or tree.get(parent_id) is None or parent_id in tree.subtree(category_id)):
+      abort(422)
+
+    move_category(category, parent_id)
+
+    return jsonify({
+      "success": True,
+      "id": category_id,
+      "parent_id": parent_id
     })
 
 
   #Create an endpoint to handle GET requests for questions, 
   @app.route("/questions")
+  @cache.cached(lambda: ['questions:all', 'categories'])
+  @coalesce(flights)
   def retrieve_questions():
-    selection = Question.query.order_by(Question.id).all()
-    current_questions = paginate_questions(request, selection)
+    tags = filter_values(request, "tags")
+    filters = {
+      "category": tree.expand(filter_values(request, "category")),
+      "difficulty": filter_values(request, "difficulty"),
+      "tags": [tag.lower() for tag in tags] if tags is not None else None
+    }
+    current_questions, total_questions = page_of_questions(request, bitmaps, filters)
 
     # categories = Category.query.order_by(Category.type).all()
-    categories = Category.query.all()
-    categories_dict = {}
-    for category in categories:
-      categories_dict[category.id] = category.type
+    categories_dict = tree.types()
 
     # abort 404 if no questions
     if len(current_questions) == 0:
@@ -84,32 +372,48 @@ def create_app(test_config=None):
       "success": True,
       "questions": current_questions,
       #MENTOR SUGGESTED, DID NOT WORK -  "total_questions": len(selection)
-      "total_questions": len(Question.query.all()),
+      "total_questions": total_questions,
       #DID NOT WORK -  'categories': categories_dict
-      "categories": {category.id: category.type for category in categories},
+      "categories": categories_dict,
       "current_category": None
     })
 
 
 
+  #Create an endpoint to GET search suggestions for a prefix, as the user types.
+  @app.route("/questions/suggest")
+  def suggest_questions():
+    prefix = request.args.get("q", "")
+    limit = min(request.args.get("limit", 8, type=int), 20)
+    if not prefix.strip():
+      abort(400)
+
+    return jsonify({
+      "success": True,
+      "suggestions": suggestions.suggest(prefix, limit)
+    })
+
+
+
   #Create an endpoint to DELETE question using a question ID. 
   @app.route("/questions/<int:question_id>", methods=["DELETE"])
   def delete_question(question_id):
     try:
-      question = Question.query.filter(Question.id == question_id).one_or_none()
+      # a single-row update, the purge job removes the row later
+      question = Question.query.filter(Question.id == question_id, Question.deleted_at.is_(None)).one_or_none()
 
       if question is None:
         abort(404)
 
       question.delete()
-      selection = Question.query.order_by(Question.id).all()
-      current_questions = paginate_questions(request, selection)
+      # the requested page from the bitmap index, not every live question
+      current_questions, total_questions = page_of_questions(request, bitmaps, {})
 
       return jsonify({
         "success": True,
         "deleted": question_id,
         "questions": current_questions,
-        "total_questions": len(Question.query.all()),
+        "total_questions": total_questions,
       })
 
     except:
@@ -128,28 +432,55 @@ def create_app(test_config=None):
     new_category = body.get("category", None)
     new_difficulty = body.get("difficulty", None)
     search = body.get('searchTerm', None)
+    allow_duplicate = body.get('allow_duplicate', False)
+    new_tags = normalize_tags(body.get('tags', []))
     
     try:
       if search:
-        selection = Question.query.order_by(Question.id).filter(
-                    Question.question.ilike("%{}%".format(search))
-        )
+        analytics.record('searches', [search.strip().lower()])
+        suggestions.record_search(search)
+        condition = Question.deleted_at.is_(None) & Question.question.ilike("%{}%".format(search))
+        facets, total = search_facets(condition)
+        # nothing matched: correct misspelled words and search again
+        corrected = None
+        if total == 0:
+          corrected = spelling.correct(search)
+          if corrected == search:
+            corrected = None
+          else:
+            condition = Question.deleted_at.is_(None) & Question.question.ilike("%{}%".format(corrected))
+            facets, total = search_facets(condition)
+        selection = Question.query.order_by(Question.id).filter(condition)
         current_questions = paginate_questions(request, selection)
 
         return jsonify(
           {
             "success": True,
             "questions": current_questions,
-            # "total_questions": len(selection.all())
-            "total_questions": len(Question.query.all())
+            "corrected_search_term": corrected,
+            "total_questions": total,
+            "facets": facets
           }
         )
 
       else:
+        # near-duplicates need an explicit allow_duplicate
+        matches = [] if allow_duplicate else duplicates.find(new_question or '')
+        if matches:
+          return jsonify({
+            "success": False,
+            "error": 409,
+            "message": "duplicate question",
+            "duplicates": [{"id": question_id, "similarity": round(score, 2)} for question_id, score in matches]
+          }), 409
+
+        if new_tags is None:
+          abort(422)
         question = Question(question=new_question, answer=new_answer, category=new_category, difficulty=new_difficulty)
+        question.tags = ensure_tags(new_tags)
         question.insert()
 
-        selection = Question.query.order_by(Question.id).all()
+        selection = Question.query.filter(Question.deleted_at.is_(None)).order_by(Question.id).all()
         current_questions = paginate_questions(request, selection)
 
         return jsonify(
@@ -157,7 +488,7 @@ def create_app(test_config=None):
             "success": True,
             "created": question.id,
             "questions": current_questions,
-            "total_questions": len(Question.query.all()),
+            "total_questions": len(selection),
           }
         )
 
@@ -166,70 +497,474 @@ def create_app(test_config=None):
 
 
 
-  #Create a GET endpoint to get questions based on category.
+  #Create an endpoint to POST tags onto many questions at once, or take them off with "remove".
+  @app.route("/questions/tags", methods=["POST"])
+  def tag_many_questions():
+    body = request.get_json() or {}
+    question_ids = body.get("question_ids", None)
+    tags = normalize_tags(body.get("tags", None))
+    remove = bool(body.get("remove", False))
+
+    if not isinstance(question_ids, list) or not all(isinstance(question_id, int) for question_id in question_ids):
+      abort(400)
+    if not tags:
+      abort(400)
+
+    changed = tag_questions(question_ids, tags, remove=remove, batch_size=TAG_BATCH_SIZE)
+
+    return jsonify({
+      "success": True,
+      "tags": tags,
+      "changed": changed
+    })
+
+
+
+  def bulk_targets(body):
+    # either "question_ids", or a "filter" as in the listing: {"category": [...], "difficulty": [...], "tags": [...]}
+    question_ids = body.get("question_ids", None)
+    filters = body.get("filter", None)
+    if (question_ids is None) == (filters is None):
+      abort(400)
+    if question_ids is not None:
+      if not isinstance(question_ids, list) or not all(isinstance(question_id, int) for question_id in question_ids):
+        abort(400)
+      return question_ids
+
+    # an empty filter would match the whole bank, that has to be asked for by id
+    if not isinstance(filters, dict) or not filters or set(filters) - {"category", "difficulty", "tags"}:
+      abort(400)
+    if not all(isinstance(values, list) and values for values in filters.values()):
+      abort(400)
+    tags = normalize_tags(filters["tags"]) if "tags" in filters else None
+    if "tags" in filters and not tags:
+      abort(400)
+    return bitmaps.ids({
+      "category": tree.expand(filters.get("category")),
+      "difficulty": filters.get("difficulty"),
+      "tags": tags
+    })
+
+  def bulk_response(question_ids, steps, progress):
+    # with "progress", one JSON line per committed batch, then the summary line
+    def run():
+      processed = changed = 0
+      try:
+        for processed, changed in steps:
+          if progress:
+            yield {"processed": processed, "changed": changed, "total": len(question_ids)}
+      except Exception:
+        db.session.rollback()
+        yield {"success": False, "error": 500, "message": "bulk operation stopped", "processed": processed, "changed": changed, "total": len(question_ids)}
+        return
+      yield {"success": True, "processed": processed, "changed": changed, "total": len(question_ids)}
+
+    if progress:
+      lines = (json.dumps(line) + "\n" for line in run())
+      return Response(stream_with_context(lines), mimetype="application/x-ndjson", headers={"X-Accel-Buffering": "no"})
+    summary = list(run())[-1]
+    return jsonify(summary), 200 if summary["success"] else 500
+
+
+
+  #Create an endpoint to POST one change to many questions, e.g. move every question of a category somewhere else.
+  @app.route("/questions/bulk-update", methods=["POST"])
+  def bulk_update_questions():
+    from .bulk import BULK_FIELDS, bulk_update
+    body = request.get_json() or {}
+    values = body.get("set", None)
+    if not isinstance(values, dict) or not values or set(values) - set(BULK_FIELDS):
+      abort(400)
+    if not all(isinstance(value, int) for value in values.values()):
+      abort(400)
+    if "category" in values and tree.get(values["category"]) is None:
+      abort(422)
+
+    question_ids = bulk_targets(body)
+    return bulk_response(question_ids, bulk_update(question_ids, values, BULK_BATCH_SIZE), bool(body.get("progress", False)))
+
+
+
+  #Create an endpoint to POST a delete of many questions at once, by id or by filter.
+  @app.route("/questions/bulk-delete", methods=["POST"])
+  def bulk_delete_questions():
+    from .bulk import bulk_delete
+    body = request.get_json() or {}
+    question_ids = bulk_targets(body)
+    return bulk_response(question_ids, bulk_delete(question_ids, BULK_BATCH_SIZE), bool(body.get("progress", False)))
+
+
+
+  #Create a GET endpoint to get questions based on category, subcategories included.
   @app.route('/categories/<int:id>/questions')
+  @cache.cached(lambda id: ['category:{}'.format(category_id) for category_id in tree.subtree(id) or [id]] + ['categories'])
+  @coalesce(flights)
   def get_question_by_category(id):
     # Get category by id, try get questions from matching category
-    category = Category.query.filter_by(id=id).one_or_none()
+    category_type = tree.get(id)
 
     try:
-      selection = Question.query.filter_by(category=category.id).all()
+      if category_type is None:
+        abort(422)
+
       # paginate selected questions and return results
-      current_questions = paginate_questions(request, selection)
+      current_questions, total_questions = page_of_questions(request, bitmaps, {"category": tree.subtree(id)})
 
       return jsonify({
         "success": True,
         "questions": current_questions,
-        "total_questions": len(Question.query.all()),
+        "total_questions": total_questions,
         # "current_category": category_id
-        "current_category": category.type
+        "current_category": category_type
         # "categories": {category.id: category.type for category in categories}
       })
 
+    # an unreachable database is not the client's fault, let the cache serve stale
+    except DATABASE_UNAVAILABLE:
+      raise
     except:
       abort(422)
 
 
     # Create a POST endpoint to get questions to play the quiz.
+    # Pass "count" to receive that many distinct questions in one round trip.
+    # "difficulty" ({"min", "max"}), "difficulty_curve" (one level per question)
+    # "categories" (several ids) and "tags" (all required) narrow the draw from the bitmap index.
+    # A category always takes in its subcategories.
+    # "adaptive" with the player's "skill" picks the question rated closest to it.
   @app.route('/quizzes', methods=['POST'])
   def get_quizzes():
     body = request.get_json()
     previous_questions = body.get('previous_questions', None)
     quiz_category = body.get('quiz_category', None)
-    category_id = quiz_category['id']
+    count = body.get('count', None)
+    difficulty = body.get('difficulty', None)
+    difficulty_curve = body.get('difficulty_curve', None)
+    categories = body.get('categories', None)
+    adaptive = body.get('adaptive', False)
+    skill = body.get('skill', 0.0)
+    tags = body.get('tags', None)
 
     if ((quiz_category is None) or (previous_questions is None)):
       abort(404)
 
-    try:
-      if category_id == 0:
-        questions_query = Question.query.filter(Question.id.notin_(previous_questions)).all()
+    if count is not None and (not isinstance(count, int) or not 0 < count <= QUIZ_BATCH_LIMIT):
+      abort(400)
+    if difficulty_curve is not None and (not isinstance(difficulty_curve, list) or not 0 < len(difficulty_curve) <= QUIZ_BATCH_LIMIT):
+      abort(400)
+    if difficulty is not None and not isinstance(difficulty, dict):
+      abort(400)
+    if categories is not None and not isinstance(categories, list):
+      abort(400)
+    if adaptive and not isinstance(skill, (int, float)):
+      abort(400)
+    if tags is not None:
+      tags = normalize_tags(tags)
+      if tags is None:
+        abort(400)
+
+    category_id = quiz_category['id']
 
+    try:
+      if adaptive:
+        question_id = ratings.nearest(float(skill), tree.subtree(category_id) if category_id else None, [int(question_id) for question_id in previous_questions])
+        selection = select_questions_by_id([question_id] if question_id is not None else [])
       else:
-        questions_query = Question.query.filter(
-          Question.id.notin_(previous_questions),
-          Question.category == category_id).all()
+        if categories is None:
+          categories = [category_id] if category_id != 0 else None
+        categories = tree.expand(categories)
+        if difficulty_curve is not None:
+          steps = [[int(level)] for level in difficulty_curve]
+        elif difficulty is not None:
+          steps = [list(range(int(difficulty.get('min', 1)), int(difficulty.get('max', 5)) + 1))] * (count or 1)
+        else:
+          steps = [None] * (count or 1)
+        ids = bitmaps.sample(
+          categories, steps, [int(question_id) for question_id in previous_questions],
+          widen=difficulty_curve is not None, tags=tags, served=stats.served_totals()
+        )
+        selection = select_questions_by_id(ids)
 
-      questions = [question.format() for question in questions_query]
+      questions = [format_quiz_question(question) for question in selection]
+      stats.record_served([question.id for question in selection])
+      analytics.record('questions', [str(question.id) for question in selection])
+      if adaptive:
+        for question, selected in zip(questions, selection):
+          question['rating'] = selected.effective_rating()
 
-      if len(questions) == 0:
+      if count is not None or difficulty_curve is not None:
         return jsonify({
           'success': True,
-          'question': None
+          'questions': questions
         }), 200
 
-      random_question = random.choice(questions)
-
-      if random_question:
-        return jsonify({
-          'success': True,
-          'question': random_question
-        }), 200
+      return jsonify({
+        'success': True,
+        'question': questions[0] if questions else None
+      }), 200
 
     except:
       abort(422)
 
 
+  # Create a POST endpoint to check a quiz guess against the stored answer.
+  @app.route('/quizzes/answer', methods=['POST'])
+  def check_quiz_answer():
+    body = request.get_json()
+    question_id = body.get('question_id', None)
+    guess = body.get('answer', None)
+    player = body.get('player', None)
+    skill = body.get('skill', None)
+
+    if not isinstance(question_id, int) or not isinstance(guess, str):
+      abort(400)
+
+    question = Question.query.filter(Question.id == question_id).one_or_none()
+    if question is None:
+      abort(404)
+
+    normalized = question.normalized_answer or normalize_answer(question.answer or '')
+    correct = check_answer(guess, normalized)
+
+    # every answer is logged, those from identified players also feed rating calibration
+    if isinstance(player, str) and player:
+      analytics.record_player(player)
+    else:
+      player = ANONYMOUS_PLAYER
+    if not answer_events.publish({'question_id': question_id, 'player': player, 'correct': correct, 'created_at': datetime.utcnow()}):
+      abort(503)
+
+    result = {
+      'success': True,
+      'question_id': question_id,
+      'correct': correct,
+      'answer': question.answer
+    }
+    if isinstance(skill, (int, float)):
+      from .adaptive import update_skill
+      result['skill'] = update_skill(float(skill), question.effective_rating(), correct, ADAPTIVE_K)
+
+    return jsonify(result)
+
+
+
+  # Create a GET endpoint for the precomputed questions most similar to one question.
+  @app.route('/questions/<int:question_id>/similar')
+  def get_similar_questions(question_id):
+    limit = min(request.args.get('limit', 10, type=int), 100)
+    question = Question.query.filter(Question.id == question_id, Question.deleted_at.is_(None)).one_or_none()
+    if question is None:
+      abort(404)
+
+    # one index range scan, deleted neighbours drop out of the join
+    rows = db.session.query(QuestionNeighbour.score, Question).join(
+      Question, Question.id == QuestionNeighbour.neighbour_id
+    ).filter(QuestionNeighbour.question_id == question_id, Question.deleted_at.is_(None)).order_by(QuestionNeighbour.rank).limit(limit).all()
+
+    return jsonify({
+      'success': True,
+      'question_id': question_id,
+      'questions': [dict(neighbour.format(), similarity=round(score, 3)) for score, neighbour in rows]
+    })
+
+
+
+  # Create GET endpoints for how often questions are served and answered correctly.
+  @app.route('/questions/<int:question_id>/stats')
+  def get_question_stats(question_id):
+    question = Question.query.filter(Question.id == question_id).one_or_none()
+    if question is None:
+      abort(404)
+
+    row = QuestionStats.query.get(question_id)
+    return jsonify(dict(
+      row.format() if row is not None else format_stats(0, 0, 0),
+      success=True,
+      question_id=question_id
+    ))
+
+  @app.route('/categories/<int:category_id>/stats')
+  def get_category_stats(category_id):
+    from .categories import questions_under
+    category = Category.query.filter(Category.id == category_id).one_or_none()
+    if category is None:
+      abort(404)
+
+    # one row per question in the category and its subcategories, never the raw answers
+    totals = db.session.query(
+      func.coalesce(func.sum(QuestionStats.served), 0),
+      func.coalesce(func.sum(QuestionStats.answered), 0),
+      func.coalesce(func.sum(QuestionStats.correct), 0)
+    ).join(Question, Question.id == QuestionStats.question_id)
+    served, answered, correct = questions_under(totals, Question.category, category_id).one()
+
+    return jsonify(dict(
+      format_stats(int(served), int(answered), int(correct)),
+      success=True,
+      category_id=category_id
+    ))
+
+
+
+  # Create a POST endpoint to record the score of a finished quiz.
+  @app.route('/scores', methods=['POST'])
+  def create_score():
+    body = request.get_json()
+    player = body.get('player', None)
+    score = body.get('score', None)
+    category = body.get('category', None) or None
+
+    if not isinstance(player, str) or not player.strip():
+      abort(400)
+    # bools are ints to Python, and a score the column cannot hold would be refused by the write-behind insert
+    if not isinstance(score, int) or isinstance(score, bool) or not 0 <= score <= MAX_SCORE:
+      abort(400)
+    if category is not None and (not isinstance(category, int) or isinstance(category, bool)):
+      abort(400)
+
+    player = player.strip()
+    analytics.record_player(player)
+    ranks = leaderboard.submit(player, score, category)
+    if ranks is None:
+      abort(503)
+    rank, category_rank = ranks
+
+    return jsonify({
+      'success': True,
+      'player': player,
+      'score': score,
+      'rank': rank + 1,
+      'category_rank': category_rank + 1 if category_rank is not None else None
+    })
+
+
+  # Create a GET endpoint for the leaderboard, optionally centred on a player.
+  @app.route('/leaderboard')
+  def get_leaderboard():
+    player = request.args.get('around', None)
+    category = request.args.get('category', None, type=int) or None
+    limit = min(request.args.get('limit', 10, type=int), 100)
+
+    if player is not None:
+      entries, total = leaderboard.around(player, category, radius=limit // 2)
+      if entries is None:
+        abort(404)
+    else:
+      entries, total = leaderboard.top(category, limit)
+
+    return jsonify({
+      'success': True,
+      'leaderboard': entries,
+      'total_players': total
+    })
+
+
+
+  # Live quiz rooms: a host drives the questions, players follow over server-sent events.
+  def find_room(code, host=False):
+    room = rooms.get(code)
+    if room is None:
+      abort(404)
+    if host and not secrets.compare_digest(request.headers.get('X-Host-Token', ''), room.host_token):
+      abort(403)
+    return room
+
+  @app.route('/rooms', methods=['POST'])
+  def create_room():
+    body = request.get_json() or {}
+    quiz_category = body.get('quiz_category', None) or {'id': 0}
+    room = rooms.create(quiz_category['id'])
+
+    return jsonify({
+      'success': True,
+      'code': room.code,
+      'host_token': room.host_token
+    })
+
+  @app.route('/rooms/<code>')
+  def get_room(code):
+    room = find_room(code)
+    return jsonify(dict(room.snapshot(), success=True))
+
+  @app.route('/rooms/<code>/next', methods=['POST'])
+  def next_room_question(code):
+    room = find_room(code, host=True)
+    if room.finished:
+      abort(422)
+
+    if room.question is not None:
+      rooms.publish(room, 'results', room.results())
+
+    selection = select_questions_by_id(bitmaps.sample(
+      tree.subtree(room.category_id) if room.category_id else None, [None], room.previous_questions
+    ))
+    if not selection:
+      rooms.finish(room)
+      return jsonify({'success': True, 'finished': True, 'question': None})
+
+    question = format_quiz_question(selection[0])
+    room.ask(question, selection[0].answer, selection[0].normalized_answer or normalize_answer(selection[0].answer or ''))
+    rooms.publish(room, 'question', question)
+
+    return jsonify({'success': True, 'finished': False, 'question': question})
+
+  @app.route('/rooms/<code>/events')
+  def room_events(code):
+    room = find_room(code)
+    player = request.args.get('player', None)
+    if not player:
+      abort(400)
+
+    return Response(rooms.subscribe(room, player), mimetype='text/event-stream', headers={
+      'Cache-Control': 'no-cache',
+      'X-Accel-Buffering': 'no'
+    })
+
+  @app.route('/rooms/<code>/answers', methods=['POST'])
+  def answer_room_question(code):
+    room = find_room(code)
+    body = request.get_json() or {}
+    player = body.get('player', None)
+    guess = body.get('answer', None)
+    if not isinstance(player, str) or not player or not isinstance(guess, str):
+      abort(400)
+
+    correct = room.answer(player, guess)
+    if correct is None:
+      abort(422)
+
+    return jsonify({'success': True, 'correct': correct})
+
+
+
+  # Create a GET endpoint for response cache hit and miss counts.
+  @app.route('/cache/stats')
+  def get_cache_stats():
+    return jsonify(dict(cache.stats(), success=True))
+
+
+
+  # Create a GET endpoint for the hottest questions and search terms.
+  @app.route('/analytics/hot')
+  def get_hot():
+    limit = request.args.get('limit', 10, type=int)
+    if not 0 < limit <= ANALYTICS_TOP_K:
+      abort(400)
+
+    return jsonify(dict(analytics.report(limit), success=True))
+
+
+
+  # Create a GET endpoint for the write-behind buffers' counters.
+  @app.route('/metrics/ingestion')
+  def get_ingestion_metrics():
+    return jsonify({
+      'success': True,
+      'answers': answer_events.metrics(),
+      'scores': score_events.metrics()
+    })
+
+
 
   # Create error handlers for all expected errors including 404 and 422. 
   # Error code 404 handler 
@@ -256,6 +991,14 @@ def create_app(test_config=None):
       400,
     )
 
+  # Error code 403 handler 
+  @app.errorhandler(403)
+  def forbidden(error):
+    return (
+      jsonify({"success": False, "error": 403, "message": "forbidden"}),
+      403,
+    )
+
   # Error code 405 handler 
   @app.errorhandler(405)
   def not_allowed(error):
@@ -264,6 +1007,28 @@ def create_app(test_config=None):
       405,
     )
 
+  # Error code 500 handler 
+  @app.errorhandler(500)
+  def server_error(error):
+    return (
+      jsonify({"success": False, "error": 500, "message": "internal server error"}),
+      500,
+    )
+
+  # Error code 429 handler 
+  @app.errorhandler(429)
+  def too_many_requests(error):
+    response = jsonify({"success": False, "error": 429, "message": "too many requests"})
+    response.headers["Retry-After"] = str(g.get("retry_after", RETRY_AFTER_SECONDS))
+    return response, 429
+
+  # Error code 503 handler 
+  @app.errorhandler(503)
+  def service_unavailable(error):
+    response = jsonify({"success": False, "error": 503, "message": "service unavailable"})
+    response.headers["Retry-After"] = str(g.get("retry_after", RETRY_AFTER_SECONDS))
+    return response, 503
+
 
   return app
 
@@ -0,0 +1,123 @@
+import bisect
+import math
+import threading
+import time
+
+from models import db, rating_prior, Question
+
+
+def expected_score(skill, rating):
+  # Rasch model: chance a player of this skill answers a question of this rating
+  return 1.0 / (1.0 + math.exp(rating - skill))
+
+
+def update_skill(skill, rating, correct, k):
+  return skill + k * ((1.0 if correct else 0.0) - expected_score(skill, rating))
+
+
+class SortedRatings(object):
+  '''Parallel sorted arrays of ratings and question ids.'''
+
+  def __init__(self):
+    self.ratings = []
+    self.ids = []
+
+  def add(self, rating, question_id):
+    position = bisect.bisect_left(self.ratings, rating)
+    self.ratings.insert(position, rating)
+    self.ids.insert(position, question_id)
+
+  def remove(self, rating, question_id):
+    position = bisect.bisect_left(self.ratings, rating)
+    while position < len(self.ids) and self.ids[position] != question_id:
+      position += 1
+    if position < len(self.ids):
+      del self.ratings[position]
+      del self.ids[position]
+
+  def nearest(self, target, exclude):
+    # bisect to the target, then step outwards past excluded ids
+    high = bisect.bisect_left(self.ratings, target)
+    low = high - 1
+    while low >= 0 or high < len(self.ids):
+      if high >= len(self.ids) or (low >= 0 and target - self.ratings[low] <= self.ratings[high] - target):
+        question_id, low = self.ids[low], low - 1
+      else:
+        question_id, high = self.ids[high], high + 1
+      if question_id not in exclude:
+        return question_id
+    return None
+
+
+class RatingIndex(object):
+  '''Questions sorted by rating, globally and per category.
+
+  Finding the question whose rating is closest to a player's skill is a
+  bisect plus a short walk. Calibration rewrites ratings in bulk from
+  another process, so the index reloads itself once it is max_age old.
+  '''
+
+  def __init__(self, max_age):
+    self._max_age = max_age
+    self._loaded_at = None
+    self._indexes = {}
+    self._entries = {}
+    self._lock = threading.Lock()
+
+  def _add(self, question_id, category, rating):
+    self._entries[question_id] = (str(category), rating)
+    for key in (None, str(category)):
+      if key not in self._indexes:
+        self._indexes[key] = SortedRatings()
+      self._indexes[key].add(rating, question_id)
+
+  def _remove(self, question_id):
+    entry = self._entries.pop(question_id, None)
+    if entry is None:
+      return
+    category, rating = entry
+    for key in (None, category):
+      self._indexes[key].remove(rating, question_id)
+
+  def _load(self):
+    if self._loaded_at is not None and time.monotonic() - self._loaded_at < self._max_age:
+      return
+    self._indexes, self._entries = {}, {}
+    rows = db.session.query(Question.id, Question.category, Question.difficulty, Question.rating).filter(Question.deleted_at.is_(None)).yield_per(5000)
+    for question_id, category, difficulty, rating in rows:
+      self._add(question_id, category, rating if rating is not None else rating_prior(difficulty))
+    self._loaded_at = time.monotonic()
+
+  def reset(self):
+    with self._lock:
+      self._loaded_at = None
+
+  def on_questions_changed(self, action, questions):
+    with self._lock:
+      if self._loaded_at is None:
+        return
+      for question in questions:
+        previous = self._entries.get(question['id'])
+        self._remove(question['id'])
+        if action != 'delete':
+          if previous is not None and 'difficulty' not in question.get('previous', {}):
+            rating = previous[1]
+          else:
+            rating = rating_prior(question['difficulty'])
+          self._add(question['id'], question['category'], rating)
+
+  def nearest(self, skill, category_ids, exclude):
+    # category_ids is a category with its subcategories, or None for all of them
+    with self._lock:
+      self._load()
+      keys = [str(category_id) for category_id in category_ids] if category_ids is not None else [None]
+      exclude = set(exclude)
+      best = None
+      for key in keys:
+        index = self._indexes.get(key)
+        question_id = index.nearest(skill, exclude) if index is not None else None
+        if question_id is not None:
+          distance = abs(self._entries[question_id][1] - skill)
+          if best is None or distance < best[0]:
+            best = (distance, question_id)
+      return best[1] if best is not None else None
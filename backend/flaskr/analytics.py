@@ -0,0 +1,320 @@
+import base64
+import hashlib
+import json
+import math
+import os
+import socket
+import threading
+import time
+from array import array
+
+
+def hash_pair(item):
+  # two stable 64 bit hashes, the same in every worker unlike hash()
+  digest = hashlib.blake2b(item.encode('utf-8'), digest_size=16).digest()
+  return int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little')
+
+
+def encode_array(values):
+  return base64.b64encode(values.tobytes()).decode('ascii')
+
+
+def decode_array(typecode, data):
+  values = array(typecode)
+  values.frombytes(base64.b64decode(data))
+  return values
+
+
+class CountMinSketch(object):
+  '''Approximate counts in depth rows of width counters.
+
+  Estimates never undercount, and overcount by at most 2/width of the
+  total with probability 1 - 2^-depth. Two sketches of the same shape
+  merge by adding their counters.
+  '''
+
+  def __init__(self, width, depth):
+    self.width = width
+    self.depth = depth
+    self.counters = array('q', bytes(8 * width * depth))
+
+  def _cells(self, item):
+    first, second = hash_pair(item)
+    return [row * self.width + (first + row * second) % self.width for row in range(self.depth)]
+
+  def add(self, item, count=1):
+    cells = self._cells(item)
+    for cell in cells:
+      self.counters[cell] += count
+    return min(self.counters[cell] for cell in cells)
+
+  def estimate(self, item):
+    return min(self.counters[cell] for cell in self._cells(item))
+
+  def merge(self, other):
+    for cell, count in enumerate(other.counters):
+      self.counters[cell] += count
+
+  def to_dict(self):
+    return {'width': self.width, 'depth': self.depth, 'counters': encode_array(self.counters)}
+
+  @classmethod
+  def from_dict(cls, data):
+    sketch = cls(data['width'], data['depth'])
+    sketch.counters = decode_array('q', data['counters'])
+    return sketch
+
+
+class SpaceSaving(object):
+  '''The k most frequent items of a stream in k counters.
+
+  An unseen item takes over the smallest counter and inherits its count
+  as an error bound, so every item more frequent than total/k is kept.
+  '''
+
+  def __init__(self, capacity):
+    self.capacity = capacity
+    self.counts = {}
+
+  def add(self, item, count=1):
+    entry = self.counts.get(item)
+    if entry is not None:
+      entry[0] += count
+    elif len(self.counts) < self.capacity:
+      self.counts[item] = [count, 0]
+    else:
+      smallest = min(self.counts, key=lambda key: self.counts[key][0])
+      floor = self.counts.pop(smallest)[0]
+      self.counts[item] = [floor + count, floor]
+
+  def _floor(self):
+    if len(self.counts) < self.capacity:
+      return 0
+    return min(count for count, error in self.counts.values())
+
+  def merge(self, other):
+    # an item missing from one summary may still have up to its smallest count there
+    floor, other_floor = self._floor(), other._floor()
+    merged = {}
+    for item in set(self.counts) | set(other.counts):
+      count, error = self.counts.get(item, (floor, floor))
+      other_count, other_error = other.counts.get(item, (other_floor, other_floor))
+      merged[item] = [count + other_count, error + other_error]
+    top = sorted(merged.items(), key=lambda entry: -entry[1][0])[:self.capacity]
+    self.counts = dict(top)
+
+  def top(self, limit):
+    return sorted(self.counts.items(), key=lambda entry: -entry[1][0])[:limit]
+
+  def to_dict(self):
+    return {'capacity': self.capacity, 'counts': self.counts}
+
+  @classmethod
+  def from_dict(cls, data):
+    summary = cls(data['capacity'])
+    summary.counts = {item: list(entry) for item, entry in data['counts'].items()}
+    return summary
+
+
+class HyperLogLog(object):
+  '''Distinct count in 2^precision one-byte registers, about 1.04/sqrt(2^precision) error.'''
+
+  def __init__(self, precision):
+    self.precision = precision
+    self.registers = bytearray(1 << precision)
+
+  def add(self, item):
+    value = hash_pair(item)[0]
+    register = value >> (64 - self.precision)
+    rest = value & ((1 << (64 - self.precision)) - 1)
+    rank = (64 - self.precision) - rest.bit_length() + 1
+    if rank > self.registers[register]:
+      self.registers[register] = rank
+
+  def count(self):
+    size = len(self.registers)
+    alpha = 0.7213 / (1 + 1.079 / size)
+    estimate = alpha * size * size / sum(2.0 ** -rank for rank in self.registers)
+    empty = self.registers.count(0)
+    if estimate <= 2.5 * size and empty:
+      # linear counting is more accurate while most registers are unused
+      estimate = size * math.log(size / float(empty))
+    return int(round(estimate))
+
+  def merge(self, other):
+    self.registers = bytearray(max(pair) for pair in zip(self.registers, other.registers))
+
+  def to_dict(self):
+    return {'precision': self.precision, 'registers': base64.b64encode(bytes(self.registers)).decode('ascii')}
+
+  @classmethod
+  def from_dict(cls, data):
+    counter = cls(data['precision'])
+    counter.registers = bytearray(base64.b64decode(data['registers']))
+    return counter
+
+
+class HeavyHitters(object):
+  '''Space-Saving for which items are hot, Count-Min to bound their counts.'''
+
+  def __init__(self, width, depth, capacity):
+    self.sketch = CountMinSketch(width, depth)
+    self.summary = SpaceSaving(capacity)
+
+  def add(self, item):
+    self.sketch.add(item)
+    self.summary.add(item)
+
+  def merge(self, other):
+    self.sketch.merge(other.sketch)
+    self.summary.merge(other.summary)
+
+  def top(self, limit):
+    return [
+      (item, min(count, self.sketch.estimate(item)), error)
+      for item, (count, error) in self.summary.top(limit)
+    ]
+
+  def to_dict(self):
+    return {'sketch': self.sketch.to_dict(), 'summary': self.summary.to_dict()}
+
+  @classmethod
+  def from_dict(cls, data):
+    hitters = cls.__new__(cls)
+    hitters.sketch = CountMinSketch.from_dict(data['sketch'])
+    hitters.summary = SpaceSaving.from_dict(data['summary'])
+    return hitters
+
+
+STREAMS = ('questions', 'searches')
+
+
+class Window(object):
+  '''One generation of every stream plus the distinct players seen in it.'''
+
+  def __init__(self, width, depth, capacity, precision):
+    self.streams = {name: HeavyHitters(width, depth, capacity) for name in STREAMS}
+    self.players = HyperLogLog(precision)
+    self.started_at = time.time()
+
+  def merge(self, other):
+    for name in STREAMS:
+      self.streams[name].merge(other.streams[name])
+    self.players.merge(other.players)
+
+  def to_dict(self):
+    return {
+      'started_at': self.started_at,
+      'streams': {name: hitters.to_dict() for name, hitters in self.streams.items()},
+      'players': self.players.to_dict()
+    }
+
+  @classmethod
+  def from_dict(cls, data):
+    window = cls.__new__(cls)
+    window.started_at = data['started_at']
+    window.streams = {name: HeavyHitters.from_dict(data['streams'][name]) for name in STREAMS}
+    window.players = HyperLogLog.from_dict(data['players'])
+    return window
+
+
+class StreamAnalytics(object):
+  '''Hot questions, hot search terms and distinct players, in fixed memory.
+
+  Counts go to the current window. Every window_seconds it becomes the
+  previous window and a new one starts, and reports merge the two, so
+  "hot" covers between one and two windows. With a redis client each
+  worker also publishes its windows every publish_seconds, and reports
+  merge the latest copy from every worker.
+  '''
+
+  def __init__(self, width, depth, capacity, precision, window_seconds, client=None, publish_seconds=10.0):
+    self._shape = (width, depth, capacity, precision)
+    self._window_seconds = window_seconds
+    self._current = Window(*self._shape)
+    self._previous = None
+    self._client = client
+    self._publish_seconds = publish_seconds
+    self._published_at = 0.0
+    self._worker = '{}:{}'.format(socket.gethostname(), os.getpid())
+    self._lock = threading.Lock()
+
+  def _rotate(self):
+    if time.time() - self._current.started_at >= self._window_seconds:
+      self._previous, self._current = self._current, Window(*self._shape)
+
+  def _snapshot(self):
+    return {'current': self._current.to_dict(), 'previous': self._previous.to_dict() if self._previous else None}
+
+  def _publish(self):
+    if self._client is None or time.time() - self._published_at < self._publish_seconds:
+      return
+    self._published_at = time.time()
+    data = json.dumps(self._snapshot())
+    pipeline = self._client.pipeline()
+    pipeline.set('trivia:analytics:' + self._worker, data, px=int(self._window_seconds * 2000))
+    pipeline.sadd('trivia:analytics:workers', self._worker)
+    pipeline.execute()
+
+  def record(self, stream, items):
+    with self._lock:
+      self._rotate()
+      hitters = self._current.streams[stream]
+      for item in items:
+        hitters.add(item)
+      self._publish()
+
+  def record_player(self, player):
+    with self._lock:
+      self._rotate()
+      self._current.players.add(player)
+      self._publish()
+
+  def _remote_snapshots(self):
+    workers = sorted(worker.decode('utf-8') for worker in self._client.smembers('trivia:analytics:workers'))
+    others = [worker for worker in workers if worker != self._worker]
+    if not others:
+      return []
+    snapshots = []
+    for worker, data in zip(others, self._client.mget(['trivia:analytics:' + worker for worker in others])):
+      if data is None:
+        self._client.srem('trivia:analytics:workers', worker)
+      else:
+        snapshots.append(json.loads(data))
+    return snapshots
+
+  def report(self, limit):
+    with self._lock:
+      self._rotate()
+      self._publish()
+      snapshots = [self._snapshot()]
+    if self._client is not None:
+      snapshots.extend(self._remote_snapshots())
+
+    merged = Window(*self._shape)
+    for snapshot in snapshots:
+      for window in (snapshot['current'], snapshot['previous']):
+        if window is not None and time.time() - window['started_at'] < 2 * self._window_seconds:
+          merged.merge(Window.from_dict(window))
+    return self._format(merged, limit)
+
+  def _format(self, window, limit):
+    return {
+      'questions': [
+        {'id': int(item), 'count': count, 'error': error}
+        for item, count, error in window.streams['questions'].top(limit)
+      ],
+      'search_terms': [
+        {'term': item, 'count': count, 'error': error}
+        for item, count, error in window.streams['searches'].top(limit)
+      ],
+      'unique_players': window.players.count()
+    }
+
+
+def create_stream_analytics(redis_url, width, depth, capacity, precision, window_seconds):
+  client = None
+  if redis_url:
+    import redis
+    client = redis.Redis.from_url(redis_url)
+  return StreamAnalytics(width, depth, capacity, precision, window_seconds, client)
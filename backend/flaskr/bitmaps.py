@@ -0,0 +1,345 @@
+import bisect
+import random
+import threading
+
+from models import db, question_tags, Question, Tag
+
+CHUNK_BITS = 4096
+WORD_BITS = 64
+WORD_MASK = (1 << WORD_BITS) - 1
+
+
+def popcount(value):
+  return bin(value).count('1')
+
+
+def lowest_bits(value):
+  # positions of the set bits of value, lowest first
+  while value:
+    low = value & -value
+    yield low.bit_length() - 1
+    value ^= low
+
+
+class Bitmap(object):
+  '''A set of question ids as 4096-bit chunks held in Python ints.
+
+  Chunks with no ids are not stored, so a sparse set costs little and
+  AND / OR / ANDNOT only touch the chunks present. Set operations return
+  new bitmaps. Counts and the prefix sums behind choice() and slice() are
+  computed once per bitmap and dropped when it changes.
+  '''
+
+  __slots__ = ('chunks', '_keys', '_ranks')
+
+  def __init__(self, chunks=None):
+    self.chunks = chunks if chunks is not None else {}
+    self._keys = None
+    self._ranks = None
+
+  @classmethod
+  def from_ids(cls, ids):
+    bitmap = cls()
+    for question_id in ids:
+      bitmap.add(question_id)
+    return bitmap
+
+  @classmethod
+  def union(cls, bitmaps):
+    chunks = {}
+    for bitmap in bitmaps:
+      for key, bits in bitmap.chunks.items():
+        chunks[key] = chunks.get(key, 0) | bits
+    return cls(chunks)
+
+  def add(self, question_id):
+    key, bit = divmod(question_id, CHUNK_BITS)
+    self.chunks[key] = self.chunks.get(key, 0) | (1 << bit)
+    self._keys = self._ranks = None
+
+  def discard(self, question_id):
+    key, bit = divmod(question_id, CHUNK_BITS)
+    bits = self.chunks.get(key, 0) & ~(1 << bit)
+    if bits:
+      self.chunks[key] = bits
+    else:
+      self.chunks.pop(key, None)
+    self._keys = self._ranks = None
+
+  def __contains__(self, question_id):
+    key, bit = divmod(question_id, CHUNK_BITS)
+    return bool(self.chunks.get(key, 0) >> bit & 1)
+
+  def __and__(self, other):
+    if len(other.chunks) < len(self.chunks):
+      self, other = other, self
+    chunks = {}
+    for key, bits in self.chunks.items():
+      both = bits & other.chunks.get(key, 0)
+      if both:
+        chunks[key] = both
+    return Bitmap(chunks)
+
+  def __or__(self, other):
+    return Bitmap.union([self, other])
+
+  def __sub__(self, other):
+    chunks = {}
+    for key, bits in self.chunks.items():
+      rest = bits & ~other.chunks.get(key, 0)
+      if rest:
+        chunks[key] = rest
+    return Bitmap(chunks)
+
+  def _index(self):
+    if self._ranks is None:
+      self._keys = sorted(self.chunks)
+      ranks, total = [], 0
+      for key in self._keys:
+        total += popcount(self.chunks[key])
+        ranks.append(total)
+      self._ranks = ranks
+    return self._keys, self._ranks
+
+  def __len__(self):
+    ranks = self._index()[1]
+    return ranks[-1] if ranks else 0
+
+  def _select(self, position):
+    # id of the position-th smallest member: bisect to its chunk, then count 64-bit words
+    keys, ranks = self._index()
+    chunk = bisect.bisect_right(ranks, position)
+    position -= ranks[chunk - 1] if chunk else 0
+    bits = self.chunks[keys[chunk]]
+    offset = 0
+    while True:
+      word = bits & WORD_MASK
+      count = popcount(word)
+      if position < count:
+        for bit in lowest_bits(word):
+          if not position:
+            return keys[chunk] * CHUNK_BITS + offset + bit
+          position -= 1
+      position -= count
+      bits >>= WORD_BITS
+      offset += WORD_BITS
+
+  def choice(self, rng):
+    '''A uniformly random member, or None: a bisect over the chunks plus at most 64 words.'''
+    total = len(self)
+    return self._select(rng.randrange(total)) if total else None
+
+  def __iter__(self):
+    for key in sorted(self.chunks):
+      base = key * CHUNK_BITS
+      for bit in lowest_bits(self.chunks[key]):
+        yield base + bit
+
+  def slice(self, start, stop):
+    '''Members start to stop in id order, without walking the chunks before start.'''
+    if start >= len(self) or stop <= start:
+      return []
+    keys, ranks = self._index()
+    chunk = bisect.bisect_right(ranks, start)
+    skip = start - (ranks[chunk - 1] if chunk else 0)
+    found = []
+    for key in keys[chunk:]:
+      base = key * CHUNK_BITS
+      for bit in lowest_bits(self.chunks[key]):
+        if skip:
+          skip -= 1
+          continue
+        found.append(base + bit)
+        if len(found) == stop - start:
+          return found
+    return found
+
+
+def filter_key(field, value):
+  # categories are strings in the model but integers in the database
+  return (field, str(value))
+
+
+FIELDS = ('category', 'difficulty', 'tags')
+# a question has any number of tags, and a tag filter asks for all of them
+MULTI_VALUED = ('tags',)
+# every question is also in one ('bucket', (category, difficulty)) bitmap, the strata quizzes draw from
+BUCKET = 'bucket'
+
+
+class BitmapIndex(object):
+  '''One bitmap of question ids per filter value, e.g. ('difficulty', '3').
+
+  Listing, counting and drawing questions under any mix of filters is an
+  OR of the bitmaps of each field's accepted values (an AND for tags), an
+  AND across fields and an ANDNOT of excluded ids. Streamed in on first use, then kept
+  current by the question write hooks. A bitmap per (category, difficulty)
+  bucket lets quizzes draw stratified samples without combining the two.
+  '''
+
+  def __init__(self):
+    self._bitmaps = {}
+    self._all = Bitmap()
+    self._loaded = False
+    self._random = random.Random()
+    self._lock = threading.Lock()
+
+  def _filter_keys(self, values):
+    for field, value in values.items():
+      for item in (value or ()) if field in MULTI_VALUED else (value,):
+        yield filter_key(field, item)
+    if 'category' in values and 'difficulty' in values:
+      yield (BUCKET, (str(values['category']), str(values['difficulty'])))
+
+  def _add(self, question_id, values):
+    self._all.add(question_id)
+    for key in self._filter_keys(values):
+      if key not in self._bitmaps:
+        self._bitmaps[key] = Bitmap()
+      self._bitmaps[key].add(question_id)
+
+  def _remove(self, question_id, values):
+    self._all.discard(question_id)
+    for key in self._filter_keys(values):
+      bitmap = self._bitmaps.get(key)
+      if bitmap is not None:
+        bitmap.discard(question_id)
+        if not bitmap.chunks:
+          del self._bitmaps[key]
+
+  def _load(self):
+    if self._loaded:
+      return
+    self._bitmaps, self._all = {}, Bitmap()
+    live = db.session.query(Question.id, Question.category, Question.difficulty).filter(Question.deleted_at.is_(None))
+    for question_id, category, difficulty in live.yield_per(5000):
+      self._add(question_id, {'category': category, 'difficulty': difficulty})
+    tagged = db.session.query(question_tags.c.question_id, Tag.name).join(Tag, Tag.id == question_tags.c.tag_id).join(
+      Question, Question.id == question_tags.c.question_id
+    ).filter(Question.deleted_at.is_(None))
+    for question_id, name in tagged.yield_per(5000):
+      self._add(question_id, {'tags': [name]})
+    self._loaded = True
+
+  def reset(self):
+    with self._lock:
+      self._loaded = False
+
+  def on_questions_changed(self, action, questions):
+    with self._lock:
+      if not self._loaded:
+        return
+      for question in questions:
+        previous = question.get('previous', {})
+        if action != 'insert':
+          self._remove(question['id'], {field: previous.get(field, question.get(field)) for field in FIELDS})
+        if action != 'delete':
+          self._add(question['id'], {field: question.get(field) for field in FIELDS})
+
+  def _select(self, filters, exclude=()):
+    # filters maps a field to its accepted values, a missing or None field accepts any
+    selected = self._all
+    for field, values in filters.items():
+      if values is None:
+        continue
+      if field in MULTI_VALUED:
+        for value in values:
+          selected = selected & self._bitmaps.get(filter_key(field, value), Bitmap())
+        continue
+      selected = selected & Bitmap.union(
+        self._bitmaps[filter_key(field, value)] for value in values if filter_key(field, value) in self._bitmaps
+      )
+    if exclude:
+      selected = selected - Bitmap.from_ids(exclude)
+    return selected
+
+  def count(self, filters):
+    with self._lock:
+      self._load()
+      return len(self._select(filters))
+
+  def page(self, filters, start, stop):
+    '''Ids start to stop in id order under the filters, and how many there are in all.'''
+    with self._lock:
+      self._load()
+      selected = self._select(filters)
+      return selected.slice(start, stop), len(selected)
+
+  def ids(self, filters):
+    with self._lock:
+      self._load()
+      return list(self._select(filters))
+
+  def known_values(self, field):
+    return sorted(int(value) for key_field, value in self._bitmaps if key_field == field and value.lstrip('-').isdigit())
+
+  def _strata(self, categories, remaining):
+    # the non-empty (category, difficulty) buckets, categories taking turns so each gets its share
+    wanted = None if categories is None else {str(category) for category in categories}
+    by_category = {}
+    for key, bitmap in self._bitmaps.items():
+      if key[0] != BUCKET or (wanted is not None and key[1][0] not in wanted):
+        continue
+      stratum = bitmap & remaining
+      if len(stratum):
+        by_category.setdefault(key[1][0], []).append([key[1][1], stratum])
+    groups = list(by_category.values())
+    self._random.shuffle(groups)
+    for group in groups:
+      self._random.shuffle(group)
+    return [group[turn] for turn in range(max(map(len, groups), default=0)) for group in groups if turn < len(group)]
+
+  def sample(self, categories, difficulty_steps, exclude, widen=False, tags=None, served=None):
+    '''One id per step, each step a list of acceptable difficulties or None for any.
+
+    categories is a list of category ids, or None for every category, and
+    tags a list of tags every question must have, or None. Steps are
+    shared out round-robin over the (category, difficulty) buckets they
+    accept, so a large category cannot crowd out the small ones, and each
+    id is drawn inside its bucket's bitmap. With widen, a step with nothing
+    left moves to the nearest difficulty that has questions, so a curve
+    degrades gently on small categories. served maps ids to times served:
+    with it each pick is the less served of two draws from the bucket.
+    '''
+    with self._lock:
+      self._load()
+      strata = self._strata(categories, self._select({'tags': tags}, exclude))
+      known = self.known_values('difficulty')
+      chosen = []
+      turn = 0
+      for difficulties in difficulty_steps:
+        if difficulties is None:
+          attempts = [None]
+        elif widen:
+          attempts = self._nearest(difficulties, known)
+        else:
+          attempts = [set(difficulties)]
+        question_id = None
+        for candidates in attempts:
+          accepted = None if candidates is None else {str(value) for value in candidates}
+          for offset in range(len(strata)):
+            position = (turn + offset) % len(strata)
+            difficulty, stratum = strata[position]
+            if accepted is not None and difficulty not in accepted:
+              continue
+            question_id = stratum.choice(self._random)
+            if question_id is not None and served is not None:
+              other = stratum.choice(self._random)
+              if served.get(other, 0) < served.get(question_id, 0):
+                question_id = other
+            if question_id is not None:
+              stratum.discard(question_id)
+              turn = position + 1
+              break
+          if question_id is not None:
+            chosen.append(question_id)
+            break
+      return chosen
+
+  def _nearest(self, difficulties, known):
+    yield set(difficulties)
+    low, high = min(difficulties), max(difficulties)
+    for distance in range(1, len(known) + 1):
+      widened = set(difficulty for difficulty in known if low - distance <= difficulty <= high + distance)
+      if widened - set(difficulties):
+        yield widened
@@ -0,0 +1,64 @@
+from datetime import datetime
+
+from sqlalchemy import case
+
+from models import db, commit_questions, Question
+
+# what a bulk update may change, every matching question gets the same value
+BULK_FIELDS = ('category', 'difficulty')
+
+
+def live_questions(batch):
+  return Question.query.filter(Question.id.in_(batch), Question.deleted_at.is_(None)).all()
+
+
+def bulk_update(question_ids, values, batch_size=1000):
+  '''Sets the same values on many questions, one UPDATE per batch.
+
+  A new difficulty also clears the calibrated rating of the rows it
+  changes, as the rating index falls back to the prior for them.
+
+  A generator: after each batch commits and its questions_changed('update', ...)
+  has run, it yields how many ids have been processed so far and how many
+  questions actually changed.
+  '''
+  table = Question.__table__
+  processed = changed = 0
+  for start in range(0, len(question_ids), batch_size):
+    batch = question_ids[start:start + batch_size]
+    # the rows are read once, for the change notification and to skip what already matches
+    changes = []
+    for question in live_questions(batch):
+      change = question.format()
+      previous = {field: change[field] for field in values if str(change[field]) != str(values[field])}
+      if previous:
+        changes.append(dict(change, previous=previous, **values))
+    if changes:
+      updates = dict(values)
+      if 'difficulty' in values:
+        # SET reads the old row, so only questions whose difficulty moves lose their rating
+        updates['rating'] = case([(table.c.difficulty != values['difficulty'], None)], else_=table.c.rating)
+      db.session.execute(table.update().where(
+        table.c.id.in_([change['id'] for change in changes]) & table.c.deleted_at.is_(None)
+      ).values(**updates))
+      commit_questions('update', changes)
+    processed += len(batch)
+    changed += len(changes)
+    yield processed, changed
+
+
+def bulk_delete(question_ids, batch_size=1000):
+  '''Soft-deletes many questions, one UPDATE per batch, yielding progress like bulk_update.'''
+  table = Question.__table__
+  processed = changed = 0
+  for start in range(0, len(question_ids), batch_size):
+    batch = question_ids[start:start + batch_size]
+    changes = [question.format() for question in live_questions(batch)]
+    if changes:
+      db.session.execute(table.update().where(
+        table.c.id.in_([change['id'] for change in changes]) & table.c.deleted_at.is_(None)
+      ).values(deleted_at=datetime.utcnow()))
+      commit_questions('delete', changes)
+    processed += len(batch)
+    changed += len(changes)
+    yield processed, changed
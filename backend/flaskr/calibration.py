@@ -0,0 +1,69 @@
+import numpy as np
+from sqlalchemy import bindparam
+
+from models import db, rating_prior, ANONYMOUS_PLAYER, Answer, Question
+
+CHUNK_ROWS = 100000
+
+
+def load_answers():
+  # stream the answer log into flat arrays, a chunk of rows at a time
+  # anonymous answers cannot be told apart by player, so they would fit one meaningless skill
+  question_ids, players, correct = [], [], []
+  rows = db.session.query(Answer.question_id, Answer.player, Answer.correct).filter(Answer.player != ANONYMOUS_PLAYER).yield_per(CHUNK_ROWS)
+  for question_id, player, answer_correct in rows:
+    question_ids.append(question_id)
+    players.append(player)
+    correct.append(answer_correct)
+  return np.array(question_ids, dtype=np.int64), np.array(players, dtype=object), np.array(correct, dtype=np.float64)
+
+
+def fit_ratings(question_index, player_index, correct, priors, epochs=200, learning_rate=1.0, prior_weight=0.5):
+  '''Fits a Rasch model to the answer log with full-batch gradient steps.
+
+  Every epoch is a handful of vectorized passes over all answers: predict,
+  take residuals and sum them per question and per player with bincount.
+  Question ratings are pulled towards their difficulty label's prior,
+  which keeps rarely answered questions sensible.
+  '''
+  question_count, player_count = len(priors), player_index.max() + 1
+  ratings = priors.copy()
+  skills = np.zeros(player_count)
+  answers_per_question = np.bincount(question_index, minlength=question_count) + prior_weight
+  answers_per_player = np.bincount(player_index, minlength=player_count) + 1.0
+
+  for _ in range(epochs):
+    expected = 1.0 / (1.0 + np.exp(ratings[question_index] - skills[player_index]))
+    residual = correct - expected
+    skills += learning_rate * (np.bincount(player_index, residual, minlength=player_count) - skills) / answers_per_player
+    ratings -= learning_rate * (np.bincount(question_index, residual, minlength=question_count) + prior_weight * (ratings - priors)) / answers_per_question
+
+  return ratings
+
+
+def calibrate(epochs=200):
+  question_ids, players, correct = load_answers()
+  if not len(question_ids):
+    return 0
+
+  known = db.session.query(Question.id, Question.difficulty).filter(
+    Question.id.in_(np.unique(question_ids).tolist()), Question.deleted_at.is_(None)
+  ).all()
+  ids = np.array([question_id for question_id, difficulty in known], dtype=np.int64)
+  priors = np.array([rating_prior(difficulty) for question_id, difficulty in known], dtype=np.float64)
+  order = np.argsort(ids)
+  ids, priors = ids[order], priors[order]
+
+  # answers to questions that have since been deleted are left out
+  position = np.searchsorted(ids, question_ids)
+  position[position >= len(ids)] = 0
+  keep = ids[position] == question_ids if len(ids) else np.zeros(len(question_ids), dtype=bool)
+  if not keep.any():
+    return 0
+  player_index = np.unique(players[keep], return_inverse=True)[1]
+  ratings = fit_ratings(position[keep], player_index, correct[keep], priors, epochs=epochs)
+
+  update = Question.__table__.update().where(Question.id == bindparam('question_id')).values(rating=bindparam('new_rating'))
+  db.session.execute(update, [{'question_id': int(question_id), 'new_rating': float(rating)} for question_id, rating in zip(ids, ratings)])
+  db.session.commit()
+  return len(ids)
@@ -0,0 +1,123 @@
+import threading
+
+from sqlalchemy import text
+
+from models import db, commit_categories, Category, CategoryPath
+
+# the new category sits below every ancestor of its parent, and below itself
+INSERT_PATHS = text(
+  "INSERT INTO category_paths (ancestor_id, descendant_id, depth) "
+  "SELECT ancestor_id, :id, depth + 1 FROM category_paths WHERE descendant_id = :parent_id "
+  "UNION ALL SELECT :id, :id, 0"
+)
+# cut the subtree loose from its old ancestors, the paths inside it stay
+DETACH_PATHS = text(
+  "DELETE FROM category_paths "
+  "WHERE descendant_id IN (SELECT descendant_id FROM category_paths WHERE ancestor_id = :id) "
+  "AND ancestor_id NOT IN (SELECT descendant_id FROM category_paths WHERE ancestor_id = :id)"
+)
+# then hang it under every ancestor of the new parent
+ATTACH_PATHS = text(
+  "INSERT INTO category_paths (ancestor_id, descendant_id, depth) "
+  "SELECT above.ancestor_id, below.descendant_id, above.depth + below.depth + 1 "
+  "FROM category_paths above, category_paths below "
+  "WHERE above.descendant_id = :parent_id AND below.ancestor_id = :id"
+)
+
+
+def create_category(type, parent_id=None):
+  category = Category(type, parent_id)
+  db.session.add(category)
+  db.session.flush()
+  db.session.execute(INSERT_PATHS, {'id': category.id, 'parent_id': parent_id})
+  commit_categories()
+  return category
+
+
+def move_category(category, parent_id):
+  '''Puts the category, with everything below it, under parent_id or at the top.'''
+  db.session.execute(DETACH_PATHS, {'id': category.id})
+  if parent_id is not None:
+    db.session.execute(ATTACH_PATHS, {'id': category.id, 'parent_id': parent_id})
+  category.parent_id = parent_id
+  commit_categories()
+
+
+def questions_under(query, question_category, category_id):
+  # one indexed join against the closure table, however deep the subtree
+  return query.join(CategoryPath, CategoryPath.descendant_id == question_category).filter(CategoryPath.ancestor_id == category_id)
+
+
+class CategoryTree(object):
+  '''The whole category tree, read in one query and kept until a category changes.
+
+  Every category's subtree is worked out on load, so expanding a filter to
+  a category and its descendants is a dictionary lookup.
+  '''
+
+  def __init__(self):
+    self._types = {}
+    self._parents = {}
+    self._subtrees = {}
+    self._loaded = False
+    self._lock = threading.Lock()
+
+  def _load(self):
+    if self._loaded:
+      return
+    types, parents, children = {}, {}, {}
+    for category_id, type, parent_id in db.session.query(Category.id, Category.type, Category.parent_id):
+      types[category_id] = type
+      parents[category_id] = parent_id
+      children.setdefault(parent_id, []).append(category_id)
+
+    subtrees = {}
+    for category_id in types:
+      found, pending = [], [category_id]
+      while pending:
+        current = pending.pop()
+        found.append(current)
+        pending.extend(children.get(current, ()))
+      subtrees[category_id] = sorted(found)
+
+    self._types, self._parents, self._subtrees = types, parents, subtrees
+    self._loaded = True
+
+  def reset(self):
+    with self._lock:
+      self._loaded = False
+
+  def types(self):
+    with self._lock:
+      self._load()
+      return dict(self._types)
+
+  def parents(self):
+    with self._lock:
+      self._load()
+      return dict(self._parents)
+
+  def get(self, category_id):
+    with self._lock:
+      self._load()
+      return self._types.get(category_id)
+
+  def subtree(self, category_id):
+    '''The category and all its descendants, empty for an unknown id.'''
+    with self._lock:
+      self._load()
+      return list(self._subtrees.get(category_id, ()))
+
+  def expand(self, category_ids):
+    # ids as the client sent them, unknown ones are kept so they match nothing
+    if category_ids is None:
+      return None
+    with self._lock:
+      self._load()
+      expanded = set()
+      for category_id in category_ids:
+        try:
+          expanded.update(self._subtrees.get(int(category_id), (category_id,)))
+        except (TypeError, ValueError):
+          expanded.add(category_id)
+      return sorted(expanded, key=str)
@@ -0,0 +1,141 @@
+import base64
+import functools
+import json
+import threading
+import time
+
+from urllib.parse import urlencode
+
+from flask import Response, current_app, request
+
+
+def request_key():
+  # same route and same arguments in any order share one computation
+  return request.path + '?' + urlencode(sorted(request.args.items(multi=True)))
+
+
+class _Call(object):
+  __slots__ = ('done', 'result', 'error')
+
+  def __init__(self):
+    self.done = threading.Event()
+    self.result = None
+    self.error = None
+
+
+class SingleFlight(object):
+  '''Runs one computation per key at a time within a worker.
+
+  Threads asking for a key that is already being computed wait for that
+  result instead of starting their own.
+  '''
+
+  def __init__(self):
+    self._calls = {}
+    self._lock = threading.Lock()
+
+  def do(self, key, compute):
+    with self._lock:
+      call = self._calls.get(key)
+      leader = call is None
+      if leader:
+        call = self._calls[key] = _Call()
+
+    if not leader:
+      call.done.wait()
+      if call.error is not None:
+        raise call.error
+      return call.result
+
+    try:
+      call.result = compute()
+      return call.result
+    except Exception as error:
+      call.error = error
+      raise
+    finally:
+      with self._lock:
+        del self._calls[key]
+      call.done.set()
+
+
+class SharedSingleFlight(object):
+  '''SingleFlight across prefork workers, coordinated through redis.
+
+  The worker holding the lock computes and publishes the result, the
+  others poll for it until the lock is released or expires. Threads within
+  a worker are still coalesced locally first.
+  '''
+
+  def __init__(self, client, ttl=5.0, poll=0.01):
+    self._client = client
+    self._local = SingleFlight()
+    self._ttl_ms = int(ttl * 1000)
+    self._poll = poll
+
+  def do(self, key, compute):
+    return self._local.do(key, lambda: self._shared(key, compute))
+
+  def _shared(self, key, compute):
+    lock_key = 'trivia:flight:lock:' + key
+    result_key = 'trivia:flight:result:' + key
+
+    if self._client.set(lock_key, b'1', nx=True, px=self._ttl_ms):
+      try:
+        self._client.delete(result_key)
+        result = compute()
+        self._client.set(result_key, encode_frozen(result), px=self._ttl_ms)
+        return result
+      finally:
+        self._client.delete(lock_key)
+
+    deadline = time.monotonic() + self._ttl_ms / 1000.0
+    while time.monotonic() < deadline:
+      published = self._client.get(result_key)
+      if published is not None:
+        return decode_frozen(published)
+      if not self._client.exists(lock_key):
+        break
+      time.sleep(self._poll)
+    return compute()
+
+
+def create_single_flight(redis_url):
+  if not redis_url:
+    return SingleFlight()
+  import redis
+  return SharedSingleFlight(redis.Redis.from_url(redis_url))
+
+
+def freeze(response):
+  return response.status_code, list(response.headers.items()), response.get_data()
+
+
+def thaw(frozen):
+  status, headers, body = frozen
+  return Response(body, status=status, headers=headers)
+
+
+def encode_frozen(frozen):
+  status, headers, body = frozen
+  return json.dumps({
+    'status': status,
+    'headers': headers,
+    'body': base64.b64encode(body).decode('ascii')
+  })
+
+
+def decode_frozen(data):
+  frozen = json.loads(data)
+  return frozen['status'], [tuple(header) for header in frozen['headers']], base64.b64decode(frozen['body'])
+
+
+def coalesce(flights):
+  '''Decorator for GET views whose concurrent identical requests may share a response.'''
+  def decorator(view):
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+      compute = lambda: freeze(current_app.make_response(view(*args, **kwargs)))
+      return thaw(flights.do(request_key(), compute))
+    return wrapper
+  return decorator
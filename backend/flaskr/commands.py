@@ -0,0 +1,68 @@
+import click
+from flask.cli import AppGroup, with_appcontext
+
+from models import db, upgrade_db, Question
+from settings import DEDUP_THRESHOLD, PURGE_AFTER_DAYS, PURGE_BATCH_SIZE
+
+db_cli = AppGroup('db', help='Manage the trivia database schema.')
+
+
+#Create or upgrade the schema, e.g. `flask db upgrade`
+@db_cli.command('upgrade')
+def upgrade():
+  upgrade_db()
+  click.echo('Database schema is up to date.')
+
+
+#Fit question ratings from the answer log, e.g. from cron: `flask calibrate`
+@click.command('calibrate')
+@click.option('--epochs', default=200, help='Gradient steps over the whole answer log.')
+@with_appcontext
+def calibrate(epochs):
+  # numpy is only imported by this job, never by the web workers
+  from .calibration import calibrate as calibrate_ratings
+  click.echo('Calibrated {} question ratings.'.format(calibrate_ratings(epochs=epochs)))
+
+
+#Precompute similar questions, e.g. nightly `flask similar` and every few minutes `flask similar --incremental`
+@click.command('similar')
+@click.option('--neighbours', default=20, help='Similar questions kept per question.')
+@click.option('--incremental', is_flag=True, help='Only add questions inserted since the last run.')
+@with_appcontext
+def similar(neighbours, incremental):
+  # numpy and scipy are only imported by this job, never by the web workers
+  from .similarity import compute_neighbours
+  click.echo('Updated neighbours of {} questions.'.format(compute_neighbours(k=neighbours, incremental=incremental)))
+
+
+#List near-duplicate questions across the whole bank, e.g. `flask dedup-report --threshold 0.8`
+@click.command('dedup-report')
+@click.option('--threshold', default=DEDUP_THRESHOLD, help='Estimated Jaccard similarity to report a pair.')
+@click.option('--processes', default=None, type=int, help='Worker processes, one per core by default.')
+@with_appcontext
+def dedup_report(threshold, processes):
+  from .dedup import duplicate_report
+  rows = db.session.query(Question.id, Question.question).filter(Question.deleted_at.is_(None)).order_by(Question.id).all()
+  pairs = duplicate_report(rows, threshold, processes)
+  for first, second, score in pairs:
+    click.echo('{}\t{}\t{:.2f}'.format(first, second, score))
+  click.echo('{} near-duplicate pairs among {} questions.'.format(len(pairs), len(rows)), err=True)
+
+
+#Remove soft-deleted questions for good, e.g. nightly from cron: `flask purge-questions`
+@click.command('purge-questions')
+@click.option('--days', default=PURGE_AFTER_DAYS, help='Only purge questions deleted at least this many days ago.')
+@click.option('--batch-size', default=PURGE_BATCH_SIZE, help='Rows removed per transaction.')
+@click.option('--pause', default=0.0, help='Seconds to sleep between batches to spare a busy database.')
+@with_appcontext
+def purge(days, batch_size, pause):
+  from .purge import purge_questions
+  click.echo('Purged {} deleted questions.'.format(purge_questions(days, batch_size, pause)))
+
+
+def register_commands(app):
+  app.cli.add_command(db_cli)
+  app.cli.add_command(calibrate)
+  app.cli.add_command(dedup_report)
+  app.cli.add_command(similar)
+  app.cli.add_command(purge)
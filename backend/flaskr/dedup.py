@@ -0,0 +1,189 @@
+import hashlib
+import threading
+from collections import defaultdict
+from functools import lru_cache
+
+from models import db, Question
+from textutils import normalize_answer
+
+SHINGLE_SIZE = 5
+BANDS = 16
+ROWS = 4
+SLOTS = BANDS * ROWS
+# added per slot skipped when an empty slot borrows a neighbour's minimum, an odd 64-bit constant
+SKIP_OFFSET = 0x9e3779b97f4a7c15
+MASK = (1 << 64) - 1
+
+
+def shingles(text):
+  # overlapping character 5-grams of the normalized question, word order matters but case and articles do not
+  normalized = normalize_answer(text or '')
+  if len(normalized) <= SHINGLE_SIZE:
+    return {normalized}
+  return {normalized[start:start + SHINGLE_SIZE] for start in range(len(normalized) - SHINGLE_SIZE + 1)}
+
+
+@lru_cache(maxsize=65536)
+def shingle_hash(shingle):
+  # common shingles ("what ", "which") recur in most questions, each is hashed once
+  return int.from_bytes(hashlib.blake2b(shingle.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+def shingle_hashes(text):
+  return [shingle_hash(shingle) for shingle in shingles(text)]
+
+
+def signature(text):
+  '''One-permutation MinHash: every shingle is hashed once, not once per slot.
+
+  The low bits of a shingle's hash pick one of the 64 slots and the rest
+  competes for that slot's minimum. A slot no shingle fell into borrows
+  the minimum of the next filled slot to its right, offset by the distance,
+  so two texts agree on it about as often as on a filled slot.
+  '''
+  slots = [None] * SLOTS
+  for value in shingle_hashes(text):
+    slot, rest = value % SLOTS, value // SLOTS
+    if slots[slot] is None or rest < slots[slot]:
+      slots[slot] = rest
+  if None not in slots:
+    return tuple(slots)
+  # walk right to left twice round, carrying the nearest filled slot seen so far
+  sig = list(slots)
+  nearest = None
+  for slot in range(2 * SLOTS - 1, -1, -1):
+    position = slot % SLOTS
+    if slots[position] is not None:
+      nearest = slot
+    elif nearest is not None and sig[position] is None:
+      sig[position] = (slots[nearest % SLOTS] + (nearest - slot) * SKIP_OFFSET) & MASK
+  return tuple(sig)
+
+
+def similarity(first, second):
+  # share of equal slots, an unbiased estimate of the Jaccard similarity of the shingle sets
+  return sum(1 for one, other in zip(first, second) if one == other) / float(len(first))
+
+
+def bands(sig):
+  return [(band, sig[band * ROWS:(band + 1) * ROWS]) for band in range(BANDS)]
+
+
+class LshIndex(object):
+  '''MinHash signatures bucketed by band.
+
+  Two questions are candidates when all rows of any one band agree, which
+  with 16 bands of 4 rows catches pairs above about 0.5 similarity. A
+  lookup touches 16 buckets whatever the size of the bank.
+  '''
+
+  def __init__(self):
+    self.signatures = {}
+    self.buckets = defaultdict(set)
+
+  def add(self, question_id, sig):
+    self.remove(question_id)
+    self.signatures[question_id] = sig
+    for key in bands(sig):
+      self.buckets[key].add(question_id)
+
+  def remove(self, question_id):
+    sig = self.signatures.pop(question_id, None)
+    if sig is None:
+      return
+    for key in bands(sig):
+      bucket = self.buckets.get(key)
+      if bucket is not None:
+        bucket.discard(question_id)
+        if not bucket:
+          del self.buckets[key]
+
+  def candidates(self, sig):
+    found = set()
+    for key in bands(sig):
+      found.update(self.buckets.get(key, ()))
+    return found
+
+  def query(self, sig, threshold, exclude=None):
+    matches = []
+    for question_id in self.candidates(sig):
+      if question_id == exclude:
+        continue
+      score = similarity(sig, self.signatures[question_id])
+      if score >= threshold:
+        matches.append((question_id, score))
+    return sorted(matches, key=lambda match: -match[1])
+
+
+class DuplicateIndex(object):
+  '''LSH index over every question, kept current by the question write hooks.
+
+  Signatures are computed by streaming the question texts on first use,
+  after that only written questions are hashed again.
+  '''
+
+  def __init__(self, threshold):
+    self.threshold = threshold
+    self._index = LshIndex()
+    self._loaded = False
+    self._lock = threading.Lock()
+
+  def _load(self):
+    if self._loaded:
+      return
+    self._index = LshIndex()
+    for question_id, text in db.session.query(Question.id, Question.question).filter(Question.deleted_at.is_(None)).yield_per(5000):
+      self._index.add(question_id, signature(text))
+    self._loaded = True
+
+  def reset(self):
+    with self._lock:
+      self._loaded = False
+
+  def on_questions_changed(self, action, questions):
+    with self._lock:
+      if not self._loaded:
+        return
+      for question in questions:
+        if action == 'delete':
+          self._index.remove(question['id'])
+        else:
+          self._index.add(question['id'], signature(question['question']))
+
+  def find(self, text, exclude=None):
+    sig = signature(text)
+    with self._lock:
+      self._load()
+      return self._index.query(sig, self.threshold, exclude)
+
+
+def _signatures(rows):
+  return [(question_id, signature(text)) for question_id, text in rows]
+
+
+def duplicate_report(rows, threshold, processes=None, chunk_size=2000):
+  '''Pairs of near-duplicate questions in rows of (id, text), most similar first.
+
+  Signatures are computed in chunks by a process pool, then bucketed once
+  so only questions sharing a band are ever compared.
+  '''
+  from concurrent.futures import ProcessPoolExecutor
+
+  chunks = [rows[start:start + chunk_size] for start in range(0, len(rows), chunk_size)]
+  index = LshIndex()
+  with ProcessPoolExecutor(max_workers=processes) as pool:
+    for signatures in pool.map(_signatures, chunks):
+      for question_id, sig in signatures:
+        index.add(question_id, sig)
+
+  pairs = {}
+  for members in index.buckets.values():
+    ordered = sorted(members)
+    for position, first in enumerate(ordered):
+      for second in ordered[position + 1:]:
+        if (first, second) not in pairs:
+          pairs[(first, second)] = similarity(index.signatures[first], index.signatures[second])
+  return sorted(
+    ((first, second, score) for (first, second), score in pairs.items() if score >= threshold),
+    key=lambda pair: -pair[2]
+  )
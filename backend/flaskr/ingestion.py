@@ -0,0 +1,174 @@
+import logging
+import queue
+import threading
+import time
+
+from models import db
+from .response_cache import DATABASE_UNAVAILABLE
+
+RETRY_SECONDS = 1.0
+STOP = object()
+
+logger = logging.getLogger(__name__)
+
+
+class EventBuffer(object):
+  '''Write-behind buffer of rows for one table.
+
+  Requests hand rows to a bounded in-memory queue and return at once. A
+  flusher thread writes them as one multi-row INSERT when batch_size rows
+  are waiting or flush_seconds have passed since the first one arrived.
+  When the queue is full, publish() waits up to put_timeout and then
+  reports failure, so callers can shed load instead of growing memory.
+  A batch is retried only while the database is unreachable. A batch the
+  database refuses is split until the refused rows are found, and those
+  rows are dropped and counted so they cannot hold up the rows behind them.
+  close() drains everything on shutdown. Listeners added with on_written
+  get every batch once it is committed, so aggregates can follow the stream.
+  '''
+
+  def __init__(self, app, table, max_queue, batch_size, flush_seconds, put_timeout):
+    self._app = app
+    self._table = table
+    self._queue = queue.Queue(maxsize=max_queue)
+    self._batch_size = batch_size
+    self._flush_seconds = flush_seconds
+    self._put_timeout = put_timeout
+    self._thread = None
+    self._closed = False
+    self._listeners = []
+    self._write_lock = threading.Lock()
+    self._lock = threading.Lock()
+    self._metrics = {
+      'published': 0,
+      'rejected': 0,
+      'written': 0,
+      'batches': 0,
+      'failed_batches': 0,
+      'dropped': 0,
+      'last_batch_rows': 0,
+      'last_batch_seconds': 0.0,
+    }
+
+  def on_written(self, listener):
+    self._listeners.append(listener)
+
+  def _count(self, name, amount=1):
+    with self._lock:
+      self._metrics[name] += amount
+
+  def _start(self):
+    with self._lock:
+      if self._thread is None and not self._closed:
+        self._thread = threading.Thread(target=self._run, name='ingest-' + self._table.name, daemon=True)
+        self._thread.start()
+
+  def publish(self, row):
+    if self._closed:
+      return False
+    self._start()
+    try:
+      self._queue.put(row, timeout=self._put_timeout)
+    except queue.Full:
+      self._count('rejected')
+      return False
+    self._count('published')
+    return True
+
+  def _collect(self):
+    # a batch of rows, and whether close() asked the flusher to stop
+    first = self._queue.get()
+    if first is STOP:
+      return [], True
+    rows = [first]
+    deadline = time.monotonic() + self._flush_seconds
+    while len(rows) < self._batch_size:
+      remaining = deadline - time.monotonic()
+      if remaining <= 0:
+        break
+      try:
+        row = self._queue.get(timeout=remaining)
+      except queue.Empty:
+        break
+      if row is STOP:
+        return rows, True
+      rows.append(row)
+    return rows, False
+
+  def _run(self):
+    while True:
+      rows, stop = self._collect()
+      while rows:
+        rows = self._write(rows)
+        if rows:
+          time.sleep(RETRY_SECONDS)
+      if stop:
+        return
+
+  def _write(self, rows):
+    # returns the rows left to retry because the database could not be reached
+    started = time.monotonic()
+    written, pending = [], [rows]
+    try:
+      with self._write_lock, self._app.app_context():
+        while pending:
+          batch = pending.pop()
+          try:
+            db.session.execute(self._table.insert().values(batch))
+            db.session.commit()
+          except DATABASE_UNAVAILABLE:
+            db.session.rollback()
+            pending.append(batch)
+            raise
+          except Exception:
+            db.session.rollback()
+            if len(batch) == 1:
+              logger.exception('dropped a row %s refused: %r', self._table.name, batch[0])
+              self._count('dropped')
+            else:
+              middle = len(batch) // 2
+              pending.extend([batch[middle:], batch[:middle]])
+            continue
+          written.extend(batch)
+    except DATABASE_UNAVAILABLE:
+      logger.exception('could not reach the database to write %d rows to %s, will retry', len(rows), self._table.name)
+      self._count('failed_batches')
+
+    if written:
+      with self._lock:
+        self._metrics['written'] += len(written)
+        self._metrics['batches'] += 1
+        self._metrics['last_batch_rows'] = len(written)
+        self._metrics['last_batch_seconds'] = time.monotonic() - started
+      for listener in self._listeners:
+        try:
+          listener(written)
+        except Exception:
+          logger.exception('listener of %s failed on a batch of %d rows', self._table.name, len(written))
+    return [row for batch in pending for row in batch]
+
+  def close(self, timeout=10.0):
+    # stop accepting rows, let the flusher finish its batch, write what is left
+    self._closed = True
+    if self._thread is not None:
+      try:
+        self._queue.put(STOP, timeout=timeout)
+        self._thread.join(timeout)
+      except queue.Full:
+        pass
+    rows = []
+    while True:
+      try:
+        row = self._queue.get_nowait()
+      except queue.Empty:
+        break
+      if row is not STOP:
+        rows.append(row)
+    for start in range(0, len(rows), self._batch_size):
+      self._write(rows[start:start + self._batch_size])
+
+  def metrics(self):
+    with self._lock:
+      metrics = dict(self._metrics)
+    metrics['queued'] = self._queue.qsize()
+    return metrics
@@ -0,0 +1,174 @@
+import json
+import logging
+import os
+import select
+import threading
+import time
+import uuid
+
+from sqlalchemy import text
+
+from models import db, categories_changed, questions_changed, Question
+
+CHANNEL = 'trivia_changes'
+# Postgres refuses NOTIFY payloads of 8000 bytes or more
+MAX_PAYLOAD = 7900
+# room left in a payload for everything but the questions
+ENVELOPE = 200
+POLL_SECONDS = 5.0
+RECONNECT_SECONDS = 1.0
+
+logger = logging.getLogger(__name__)
+
+
+class InvalidationBus(object):
+  '''Fans question and category writes out to every worker on every node through Postgres.
+
+  Inside each write's transaction, the writing worker sends NOTIFY
+  trivia_changes with the changed questions, so Postgres delivers it exactly
+  when the write commits and never for a write that rolled back. Each worker runs one listener thread that replays
+  other workers' changes through its own question listeners, so in-process
+  caches and indexes get the same targeted invalidations as a local write.
+  A category change carries no payload, listeners just reload the tree.
+  Other events, such as leaderboard scores, go through send() to the
+  handler registered for them with on_message().
+  If the listener loses its connection, notifications may have been missed,
+  so the reset callbacks run and caches start over.
+  '''
+
+  def __init__(self, app):
+    self._app = app
+    self._token = uuid.uuid4().hex
+    self._replaying = threading.local()
+    self._resets = []
+    self._handlers = {}
+    self._thread = None
+    self._lock = threading.Lock()
+
+  @property
+  def _origin(self):
+    # the app may be built before the server forks its workers, the pid tells them apart
+    return '{}:{}'.format(os.getpid(), self._token)
+
+  def on_reset(self, callback):
+    self._resets.append(callback)
+
+  def on_message(self, entity, callback):
+    # callback(data) runs for every send(entity, data) of the other workers
+    self._handlers[entity] = callback
+
+  def _enabled(self):
+    return db.engine.dialect.name == 'postgresql'
+
+  def publish(self, action, questions):
+    # runs inside the write's transaction, see on_questions_commit
+    if getattr(self._replaying, 'active', False) or not self._enabled():
+      return
+    payload = json.dumps({'origin': self._origin, 'entity': 'question', 'action': action, 'questions': questions})
+    if len(payload) <= MAX_PAYLOAD:
+      self._notify(payload)
+      return
+    # keep what invalidation needs, listeners reload the rows, over as many notifications as it takes
+    batch, size = [], 0
+    for question in questions:
+      slim = dict({key: question[key] for key in ('id', 'category', 'difficulty')}, previous=question.get('previous', {}))
+      length = len(json.dumps(slim)) + 2
+      if batch and size + length > MAX_PAYLOAD - ENVELOPE:
+        self._notify_partial(action, batch)
+        batch, size = [], 0
+      batch.append(slim)
+      size += length
+    if batch:
+      self._notify_partial(action, batch)
+
+  def _notify_partial(self, action, questions):
+    self._notify(json.dumps({'origin': self._origin, 'entity': 'question', 'action': action, 'questions': questions, 'partial': True}))
+
+  def publish_categories(self):
+    # the tree is small, other workers simply reload it
+    if getattr(self._replaying, 'active', False) or not self._enabled():
+      return
+    self._notify(json.dumps({'origin': self._origin, 'entity': 'category'}))
+
+  def send(self, entity, data):
+    # not tied to a write of ours, so it goes out in a transaction of its own
+    if getattr(self._replaying, 'active', False) or not self._enabled():
+      return
+    self._notify(json.dumps({'origin': self._origin, 'entity': entity, 'data': data}))
+    db.session.commit()
+
+  def _notify(self, payload):
+    # NOTIFY is transactional: it is delivered when the surrounding transaction commits
+    db.session.execute(text('SELECT pg_notify(:channel, :payload)'), {'channel': CHANNEL, 'payload': payload})
+
+  def start(self):
+    with self._lock:
+      if self._thread is not None or not self._enabled():
+        return
+      self._thread = threading.Thread(target=self._listen_forever, name='invalidation-bus', daemon=True)
+      self._thread.start()
+
+  def _listen_forever(self):
+    connected_before = False
+    while True:
+      raw = None
+      try:
+        with self._app.app_context():
+          connection = db.engine.raw_connection()
+          # the listener holds its connection for good, take it out of the pool
+          connection.detach()
+        raw = connection.connection
+        raw.autocommit = True
+        raw.cursor().execute('LISTEN ' + CHANNEL)
+        if connected_before:
+          self._reset()
+        connected_before = True
+        self._listen(raw)
+      except Exception:
+        logger.exception('invalidation bus listener lost its connection')
+        time.sleep(RECONNECT_SECONDS)
+      finally:
+        # detached connections are not returned to the pool, close it or it leaks
+        if raw is not None and not raw.closed:
+          raw.close()
+
+  def _listen(self, raw):
+    while True:
+      if select.select([raw], [], [], POLL_SECONDS) == ([], [], []):
+        continue
+      raw.poll()
+      while raw.notifies:
+        notification = raw.notifies.pop(0)
+        try:
+          self._apply(notification.payload)
+        except Exception:
+          # the connection is fine, only this change is lost: start the caches over and keep listening
+          logger.exception('invalidation bus could not apply a change')
+          self._reset()
+
+  def _apply(self, payload):
+    message = json.loads(payload)
+    if message.get('origin') == self._origin or message.get('entity') not in ('question', 'category') + tuple(self._handlers):
+      return
+    with self._app.app_context():
+      self._replaying.active = True
+      try:
+        if message['entity'] in self._handlers:
+          self._handlers[message['entity']](message['data'])
+        elif message['entity'] == 'category':
+          categories_changed()
+        elif message.get('partial'):
+          questions_changed(message['action'], self._reload(message['questions']))
+        else:
+          questions_changed(message['action'], message['questions'])
+      finally:
+        self._replaying.active = False
+
+  def _reload(self, slim):
+    # deleted questions are only soft-deleted, so their rows can be read back too
+    rows = {question.id: question.format() for question in Question.query.filter(Question.id.in_([question['id'] for question in slim]))}
+    return [dict(rows[question['id']], previous=question['previous']) for question in slim if question['id'] in rows]
+
+  def _reset(self):
+    for callback in self._resets:
+      callback()
@@ -0,0 +1,36 @@
+import threading
+
+
+class LazyExtension(object):
+  '''Stands in for a subsystem until it is first used, then builds it once.
+
+  create_app registers these in app.extensions, so a worker only imports and
+  builds what its requests need, the same way the engine only connects on
+  the first query. Attribute access is passed through to the subsystem.
+  '''
+
+  def __init__(self, build):
+    self._build = build
+    self._instance = None
+    self._lock = threading.Lock()
+
+  @property
+  def built(self):
+    return self._instance is not None
+
+  def _get(self):
+    if self._instance is None:
+      with self._lock:
+        if self._instance is None:
+          self._instance = self._build()
+    return self._instance
+
+  def __getattr__(self, name):
+    return getattr(self._get(), name)
+
+  def if_built(self, name):
+    # for change hooks and resets: a subsystem that does not exist yet will load fresh anyway
+    def forward(*args, **kwargs):
+      if self._instance is not None:
+        return getattr(self._instance, name)(*args, **kwargs)
+    return forward
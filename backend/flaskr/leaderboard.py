@@ -0,0 +1,226 @@
+import itertools
+import random
+import threading
+from datetime import datetime
+
+from models import db, Score
+
+MAX_LEVELS = 24
+
+
+class _Node(object):
+  __slots__ = ('key', 'next', 'width')
+
+  def __init__(self, key, height):
+    self.key = key
+    self.next = [None] * height
+    self.width = [1] * height
+
+
+class IndexableSkiplist(object):
+  '''Sorted keys with O(log n) insert, remove, rank and index lookups.
+
+  Every forward link records how many positions it skips, which lets
+  rank() count its way down to a key instead of walking the list.
+  '''
+
+  def __init__(self):
+    self._head = _Node(None, MAX_LEVELS)
+    self._random = random.Random()
+    self._size = 0
+
+  def __len__(self):
+    return self._size
+
+  def _height(self):
+    height = 1
+    while height < MAX_LEVELS and self._random.random() < 0.5:
+      height += 1
+    return height
+
+  def insert(self, key):
+    chain = [None] * MAX_LEVELS
+    steps_at_level = [0] * MAX_LEVELS
+    node = self._head
+    for level in reversed(range(MAX_LEVELS)):
+      while node.next[level] is not None and node.next[level].key <= key:
+        steps_at_level[level] += node.width[level]
+        node = node.next[level]
+      chain[level] = node
+
+    height = self._height()
+    new_node = _Node(key, height)
+    steps = 0
+    for level in range(height):
+      previous = chain[level]
+      new_node.next[level] = previous.next[level]
+      previous.next[level] = new_node
+      new_node.width[level] = previous.width[level] - steps
+      previous.width[level] = steps + 1
+      steps += steps_at_level[level]
+    for level in range(height, MAX_LEVELS):
+      chain[level].width[level] += 1
+    self._size += 1
+
+  def remove(self, key):
+    chain = [None] * MAX_LEVELS
+    node = self._head
+    for level in reversed(range(MAX_LEVELS)):
+      while node.next[level] is not None and node.next[level].key < key:
+        node = node.next[level]
+      chain[level] = node
+
+    target = chain[0].next[0]
+    if target is None or target.key != key:
+      raise KeyError(key)
+    for level in range(len(target.next)):
+      previous = chain[level]
+      previous.width[level] += target.width[level] - 1
+      previous.next[level] = target.next[level]
+    for level in range(len(target.next), MAX_LEVELS):
+      chain[level].width[level] -= 1
+    self._size -= 1
+
+  def rank(self, key):
+    # zero based position of key
+    position = 0
+    node = self._head
+    for level in reversed(range(MAX_LEVELS)):
+      while node.next[level] is not None and node.next[level].key < key:
+        position += node.width[level]
+        node = node.next[level]
+    if node.next[0] is None or node.next[0].key != key:
+      raise KeyError(key)
+    return position
+
+  def slice(self, start, stop):
+    # keys at positions start..stop-1, one descent then a walk along the bottom
+    start = max(start, 0)
+    if start >= min(stop, self._size):
+      return []
+    remaining = start + 1
+    node = self._head
+    for level in reversed(range(MAX_LEVELS)):
+      while node.next[level] is not None and node.width[level] <= remaining:
+        remaining -= node.width[level]
+        node = node.next[level]
+    keys = []
+    while node is not None and len(keys) < stop - start:
+      keys.append(node.key)
+      node = node.next[0]
+    return keys
+
+
+class Board(object):
+  '''Best score per player, ordered highest first, ties to the earlier score.'''
+
+  def __init__(self):
+    self._index = IndexableSkiplist()
+    self._keys = {}
+
+  def __len__(self):
+    return len(self._index)
+
+  def record(self, player, score, sequence):
+    current = self._keys.get(player)
+    key = (-score, sequence, player)
+    if current is not None:
+      if current <= key:
+        return
+      self._index.remove(current)
+    self._index.insert(key)
+    self._keys[player] = key
+
+  def rank_of(self, player):
+    key = self._keys.get(player)
+    if key is None:
+      return None
+    return self._index.rank(key)
+
+  def entries(self, start, stop):
+    return [{
+      'rank': rank,
+      'player': key[2],
+      'score': -key[0]
+    } for rank, key in enumerate(self._index.slice(start, stop), start + 1)]
+
+
+class Leaderboard(object):
+  '''In-memory global and per-category boards over the scores table.
+
+  Boards are rebuilt lazily by streaming the table on first use, so app
+  startup stays connection-free. New scores are ranked immediately and
+  reach the database through the write-behind score events buffer.
+  Listeners added with on_score hear about every accepted score, so other
+  workers can rank it too through record().
+  '''
+
+  def __init__(self, events):
+    self._events = events
+    self._lock = threading.RLock()
+    self._boards = None
+    self._listeners = []
+    self._sequence = itertools.count()
+
+  def on_score(self, listener):
+    self._listeners.append(listener)
+
+  def _board(self, category, boards=None):
+    boards = boards if boards is not None else self._boards
+    board = boards.get(category)
+    if board is None:
+      board = boards[category] = Board()
+    return board
+
+  def _record(self, player, score, category, boards=None):
+    sequence = next(self._sequence)
+    self._board(None, boards).record(player, score, sequence)
+    if category is not None:
+      self._board(category, boards).record(player, score, sequence)
+
+  def _load(self):
+    if self._boards is not None:
+      return
+    # built aside and swapped in whole, a failed load leaves nothing half-filled behind
+    boards = {}
+    rows = db.session.query(Score.player, Score.score, Score.category).order_by(Score.id).yield_per(1000)
+    for player, score, category in rows:
+      self._record(player, score, category, boards)
+    self._boards = boards
+
+  def reset(self):
+    with self._lock:
+      self._boards = None
+
+  def record(self, score):
+    # a score accepted by another worker; a best score counted twice ranks the same
+    with self._lock:
+      if self._boards is not None:
+        self._record(score['player'], score['score'], score['category'])
+
+  def submit(self, player, score, category=None):
+    # None when the events buffer is full and the score was not accepted
+    with self._lock:
+      self._load()
+      if not self._events.publish({'player': player, 'score': score, 'category': category, 'created_at': datetime.utcnow()}):
+        return None
+      self._record(player, score, category)
+      ranks = self._board(None).rank_of(player), self._board(category).rank_of(player) if category is not None else None
+    for listener in self._listeners:
+      listener({'player': player, 'score': score, 'category': category})
+    return ranks
+
+  def around(self, player, category=None, radius=5):
+    with self._lock:
+      self._load()
+      board = self._board(category)
+      rank = board.rank_of(player)
+      if rank is None:
+        return None, len(board)
+      return board.entries(max(rank - radius, 0), rank + radius + 1), len(board)
+
+  def top(self, category=None, limit=10):
+    with self._lock:
+      self._load()
+      board = self._board(category)
+      return board.entries(0, limit), len(board)
@@ -0,0 +1,41 @@
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import text
+
+from models import db
+
+# the oldest deleted rows first, through the partial index on deleted_at; rows a
+# concurrent purge holds are skipped rather than waited for
+PURGE_BATCH = text(
+  "DELETE FROM questions WHERE id IN ("
+  "SELECT id FROM questions WHERE deleted_at IS NOT NULL AND deleted_at < :cutoff "
+  "ORDER BY deleted_at LIMIT :batch_size FOR UPDATE SKIP LOCKED"
+  ") RETURNING id"
+)
+# precomputed similar questions have no foreign key, drop them with the question
+PURGE_NEIGHBOURS = text(
+  "DELETE FROM question_neighbours WHERE question_id = ANY(:ids) OR neighbour_id = ANY(:ids)"
+)
+
+
+def purge_questions(older_than_days, batch_size=500, pause_seconds=0.0):
+  '''Hard-deletes questions soft-deleted more than older_than_days ago.
+
+  Each batch is its own short transaction, so row locks are held briefly
+  and autovacuum can reclaim the dead tuples as the purge goes. Tags go
+  with the question through ON DELETE CASCADE. Answers and question_stats
+  are history and stay. Returns how many questions were removed.
+  '''
+  cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+  purged = 0
+  while True:
+    ids = [row[0] for row in db.session.execute(PURGE_BATCH, {'cutoff': cutoff, 'batch_size': batch_size})]
+    if ids:
+      db.session.execute(PURGE_NEIGHBOURS, {'ids': ids})
+    db.session.commit()
+    purged += len(ids)
+    if len(ids) < batch_size:
+      return purged
+    if pause_seconds:
+      time.sleep(pause_seconds)
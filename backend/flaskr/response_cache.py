@@ -0,0 +1,281 @@
+import functools
+import json
+import threading
+import time
+from collections import OrderedDict, defaultdict
+
+from flask import current_app, request
+from sqlalchemy.exc import InterfaceError, OperationalError, TimeoutError as PoolTimeoutError
+
+from .coalescing import decode_frozen, encode_frozen, freeze, request_key, thaw
+
+# errors that mean the database is unreachable rather than the request being wrong,
+# integrity, programming and data errors are bugs and must not be hidden behind stale pages
+DATABASE_UNAVAILABLE = (OperationalError, InterfaceError, PoolTimeoutError)
+
+
+class MemoryBackend(object):
+  '''LRU of rendered responses for one worker, bounded by entries and bytes.
+
+  Every tag has a version. A response computed while one of its tags was
+  invalidated is dropped instead of stored, so a slow read racing a write
+  cannot put the old page back. Invalidated entries are kept, marked
+  invalid, as a last good copy to fall back on while the database is down.
+  '''
+
+  def __init__(self, max_entries, max_bytes, retention):
+    self._entries = OrderedDict()
+    self._keys_by_tag = defaultdict(set)
+    self._versions = defaultdict(int)
+    self._max_entries = max_entries
+    self._max_bytes = max_bytes
+    self._retention = retention
+    self._bytes = 0
+    self._lock = threading.Lock()
+
+  def lookup(self, key, tags):
+    # (frozen, age, valid) or None, plus the token store() needs
+    with self._lock:
+      token = tuple(self._versions[tag] for tag in tags)
+      entry = self._entries.get(key)
+      if entry is None:
+        return None, token
+      frozen, entry_tags, size, stored_at, valid = entry
+      age = time.monotonic() - stored_at
+      if age > self._retention:
+        self._remove(key)
+        return None, token
+      self._entries.move_to_end(key)
+      return (frozen, age, valid), token
+
+  def store(self, key, tags, token, frozen):
+    size = len(frozen[2])
+    if size > self._max_bytes:
+      return
+    with self._lock:
+      if token != tuple(self._versions[tag] for tag in tags):
+        return
+      if key in self._entries:
+        self._remove(key)
+      self._entries[key] = (frozen, tags, size, time.monotonic(), True)
+      self._bytes += size
+      for tag in tags:
+        self._keys_by_tag[tag].add(key)
+      while len(self._entries) > self._max_entries or self._bytes > self._max_bytes:
+        self._remove(next(iter(self._entries)))
+
+  def invalidate(self, tags):
+    with self._lock:
+      for tag in tags:
+        self._versions[tag] += 1
+        for key in self._keys_by_tag.pop(tag, ()):
+          entry = self._entries.get(key)
+          if entry is not None:
+            self._entries[key] = entry[:4] + (False,)
+
+  def clear(self):
+    with self._lock:
+      for tag in list(self._versions):
+        self._versions[tag] += 1
+      self._entries.clear()
+      self._keys_by_tag.clear()
+      self._bytes = 0
+
+  def _remove(self, key):
+    frozen, tags, size, stored_at, valid = self._entries.pop(key)
+    self._bytes -= size
+    for tag in tags:
+      keys = self._keys_by_tag.get(tag)
+      if keys is not None:
+        keys.discard(key)
+
+  def stats(self):
+    # invalidated entries are only kept to serve through an outage, they are not counted as cached
+    with self._lock:
+      invalid = sum(1 for entry in self._entries.values() if not entry[4])
+      return {'entries': len(self._entries) - invalid, 'invalid_entries': invalid, 'bytes': self._bytes}
+
+
+class RedisBackend(object):
+  '''Responses shared by every worker through redis.
+
+  The versions of an entry's tags are part of its key, so invalidating a
+  tag is a single INCR. Entries written under old versions are never read
+  again and expire on their own. The latest response for each key is also
+  kept unversioned as the last good copy.
+  '''
+
+  def __init__(self, client, retention):
+    self._client = client
+    self._retention_ms = int(retention * 1000)
+
+  def _versions(self, tags):
+    if not tags:
+      return ()
+    return tuple(int(version or 0) for version in self._client.mget(['trivia:cache:tag:' + tag for tag in tags]))
+
+  def _key(self, key, token):
+    return 'trivia:cache:{}|{}'.format(key, ':'.join(str(version) for version in token))
+
+  def lookup(self, key, tags):
+    token = self._versions(tags)
+    current, last_good = self._client.mget([self._key(key, token), 'trivia:cache:last:' + key])
+    data = current if current is not None else last_good
+    if data is None:
+      return None, token
+    entry = json.loads(data)
+    return (decode_frozen(entry['frozen']), time.time() - entry['stored_at'], current is not None), token
+
+  def store(self, key, tags, token, frozen):
+    if token != self._versions(tags):
+      return
+    data = json.dumps({'stored_at': time.time(), 'frozen': encode_frozen(frozen)})
+    pipeline = self._client.pipeline()
+    pipeline.set(self._key(key, token), data, px=self._retention_ms)
+    pipeline.set('trivia:cache:last:' + key, data, px=self._retention_ms)
+    pipeline.execute()
+
+  def invalidate(self, tags):
+    pipeline = self._client.pipeline()
+    for tag in tags:
+      pipeline.incr('trivia:cache:tag:' + tag)
+    pipeline.execute()
+
+  def clear(self):
+    # shared entries never miss a write, nothing to drop
+    pass
+
+  def stats(self):
+    return {}
+
+
+def create_cache_backend(name, redis_url, max_entries, max_bytes, retention):
+  if name == 'redis':
+    import redis
+    return RedisBackend(redis.Redis.from_url(redis_url), retention)
+  return MemoryBackend(max_entries, max_bytes, retention)
+
+
+def question_tags(questions):
+  # a question write touches the full listing and the pages of its categories
+  tags = {'questions:all'}
+  for question in questions:
+    tags.add('category:{}'.format(question['category']))
+    if 'category' in question.get('previous', {}):
+      tags.add('category:{}'.format(question['previous']['category']))
+  return tags
+
+
+def stale_response(frozen, age, warning):
+  response = thaw(frozen)
+  response.headers['Age'] = str(int(age))
+  response.headers['Warning'] = warning
+  return response
+
+
+class ResponseCache(object):
+  '''Rendered responses with stale-while-revalidate and serve-stale-on-error.
+
+  A valid entry younger than fresh_seconds is served as is. Up to max_stale
+  it is still served, with Age and Warning headers, while one background
+  thread per key renders a new copy. When rendering fails because the
+  database is unreachable, any copy up to max_stale old is served instead,
+  invalidated ones included.
+  '''
+
+  def __init__(self, backend, fresh_seconds, max_stale):
+    self.backend = backend
+    self.fresh_seconds = fresh_seconds
+    self.max_stale = max_stale
+    self._counts = defaultdict(int)
+    self._revalidating = set()
+    self._lock = threading.Lock()
+
+  def _count(self, name, amount=1):
+    with self._lock:
+      self._counts[name] += amount
+
+  def _render(self, view, args, kwargs):
+    return current_app.make_response(view(*args, **kwargs))
+
+  def _revalidate(self, key, tags, view, args, kwargs):
+    with self._lock:
+      if key in self._revalidating:
+        return
+      self._revalidating.add(key)
+
+    app = current_app._get_current_object()
+    path, query_string = request.path, request.query_string
+
+    def revalidate():
+      try:
+        with app.test_request_context(path, query_string=query_string):
+          entry, token = self.backend.lookup(key, tags)
+          response = self._render(view, args, kwargs)
+          if response.status_code == 200:
+            self.backend.store(key, tags, token, freeze(response))
+            self._count('revalidations')
+      except DATABASE_UNAVAILABLE:
+        self._count('revalidation_failures')
+      finally:
+        with self._lock:
+          self._revalidating.discard(key)
+
+    threading.Thread(target=revalidate, name='cache-revalidate', daemon=True).start()
+
+  def cached(self, tags):
+    '''Decorator caching successful responses of a GET view under the tags it returns.'''
+    def decorator(view):
+      @functools.wraps(view)
+      def wrapper(*args, **kwargs):
+        key = request_key()
+        view_tags = tuple(tags(**kwargs))
+        entry, token = self.backend.lookup(key, view_tags)
+        if entry is not None:
+          frozen, age, valid = entry
+          if valid and age <= self.fresh_seconds:
+            self._count('hits')
+            return thaw(frozen)
+          if valid and age <= self.max_stale:
+            self._count('stale_hits')
+            self._revalidate(key, view_tags, view, args, kwargs)
+            return stale_response(frozen, age, '110 - "Response is Stale"')
+
+        self._count('misses')
+        try:
+          response = self._render(view, args, kwargs)
+        except DATABASE_UNAVAILABLE:
+          if entry is None or entry[1] > self.max_stale:
+            raise
+          self._count('stale_on_error')
+          return stale_response(entry[0], entry[1], '111 - "Revalidation Failed"')
+
+        if response.status_code == 200:
+          self.backend.store(key, view_tags, token, freeze(response))
+        return response
+      return wrapper
+    return decorator
+
+  def invalidate(self, tags):
+    self._count('invalidations', len(tags))
+    self.backend.invalidate(tags)
+
+  def clear(self):
+    self._count('clears')
+    self.backend.clear()
+
+  def on_questions_changed(self, action, questions):
+    self.invalidate(question_tags(questions))
+
+  def on_categories_changed(self):
+    self.invalidate(['categories'])
+
+  def stats(self):
+    with self._lock:
+      counts = dict(self._counts)
+    for name in ('hits', 'stale_hits', 'misses', 'stale_on_error', 'invalidations'):
+      counts.setdefault(name, 0)
+    lookups = counts['hits'] + counts['stale_hits'] + counts['misses']
+    counts['hit_rate'] = (counts['hits'] + counts['stale_hits']) / float(lookups) if lookups else 0.0
+    counts.update(self.backend.stats())
+    return counts
@@ -0,0 +1,235 @@
+import json
+import queue
+import secrets
+import string
+import threading
+import time
+
+from textutils import check_answer
+
+CODE_ALPHABET = string.ascii_uppercase + string.digits
+CODE_LENGTH = 6
+# queued after a room's last event, the stream that reads it ends
+CLOSE = object()
+
+
+def format_event(event, data, sequence):
+  # serialized once per room message, every subscriber gets the same bytes
+  return 'id: {}\nevent: {}\ndata: {}\n\n'.format(sequence, event, json.dumps(data)).encode()
+
+
+class Subscriber(object):
+  '''One connected player with a bounded queue of pending events.
+
+  A player that falls a full queue behind is disconnected instead of
+  letting events pile up; the browser reconnects and gets a fresh snapshot.
+  close() ends the stream once the events already queued are sent.
+  '''
+
+  def __init__(self, player, size):
+    self.player = player
+    self.events = queue.Queue(maxsize=size)
+    self.closed = False
+
+  def offer(self, payload):
+    try:
+      self.events.put_nowait(payload)
+      return True
+    except queue.Full:
+      self.closed = True
+      return False
+
+  def close(self):
+    try:
+      self.events.put_nowait(CLOSE)
+    except queue.Full:
+      self.closed = True
+
+  def stream(self, keepalive, on_close):
+    try:
+      while not self.closed:
+        try:
+          payload = self.events.get(timeout=keepalive)
+        except queue.Empty:
+          payload = b': keepalive\n\n'
+        if self.closed or payload is CLOSE:
+          break
+        yield payload
+    finally:
+      on_close(self)
+
+
+class Room(object):
+  def __init__(self, code, host_token, category_id):
+    self.code = code
+    self.host_token = host_token
+    self.category_id = category_id
+    self.previous_questions = []
+    self.question = None
+    self.answer_text = None
+    self.normalized_answer = None
+    self.answers = {}
+    self.scores = {}
+    self.finished = False
+    self.closed = False
+    self.touched = time.monotonic()
+    self._subscribers = set()
+    self._sequence = 0
+    self._lock = threading.Lock()
+
+  def subscribe(self, subscriber):
+    with self._lock:
+      subscriber.offer(format_event('state', self._snapshot(), self._sequence))
+      closed = self.closed
+      if not closed:
+        self._subscribers.add(subscriber)
+    if closed:
+      # a finished room still shows its final state, then the stream ends
+      subscriber.close()
+    self.touched = time.monotonic()
+
+  def unsubscribe(self, subscriber):
+    with self._lock:
+      self._subscribers.discard(subscriber)
+
+  def close(self):
+    # no stream may outlive its room, each would hold a worker thread sending keepalives
+    with self._lock:
+      self.closed = True
+      subscribers = list(self._subscribers)
+      self._subscribers.clear()
+    for subscriber in subscribers:
+      subscriber.close()
+
+  def message(self, event, data):
+    with self._lock:
+      self._sequence += 1
+      return format_event(event, data, self._sequence)
+
+  def fan_out(self, payload):
+    with self._lock:
+      subscribers = list(self._subscribers)
+    slow = [subscriber for subscriber in subscribers if not subscriber.offer(payload)]
+    if slow:
+      with self._lock:
+        self._subscribers.difference_update(slow)
+
+  # the readers take the lock and hand out copies, answer() mutates from other request threads
+  def _tally(self):
+    return {
+      'answered': len(self.answers),
+      'correct': sum(1 for correct in self.answers.values() if correct)
+    }
+
+  def tally(self):
+    with self._lock:
+      return self._tally()
+
+  def ask(self, question, answer_text, normalized_answer):
+    with self._lock:
+      self.question = question
+      self.answer_text = answer_text
+      self.normalized_answer = normalized_answer
+      self.answers = {}
+      self.previous_questions.append(question['id'])
+    self.touched = time.monotonic()
+
+  def answer(self, player, guess):
+    with self._lock:
+      if self.question is None or player in self.answers:
+        return None
+      correct = check_answer(guess, self.normalized_answer)
+      self.answers[player] = correct
+      self.scores[player] = self.scores.get(player, 0) + (1 if correct else 0)
+    self.touched = time.monotonic()
+    return correct
+
+  def results(self):
+    with self._lock:
+      return {
+        'question_id': self.question['id'],
+        'answer': self.answer_text,
+        'tally': self._tally(),
+        'scores': dict(self.scores)
+      }
+
+  def _snapshot(self):
+    return {
+      'code': self.code,
+      'question': self.question,
+      'finished': self.finished,
+      'players': len(self._subscribers),
+      'tally': self._tally(),
+      'scores': dict(self.scores)
+    }
+
+  def snapshot(self):
+    with self._lock:
+      return self._snapshot()
+
+
+class RoomRegistry(object):
+  '''Hosted quiz rooms and the broadcaster loop that feeds their players.
+
+  Hosts hand messages to a single broadcaster thread, so a request never
+  waits on fan-out to hundreds of players. The thread starts with the
+  first message, not with the app.
+
+  Rooms live in this process only: every request for a room must reach
+  the worker that created it, and each open event stream occupies one of
+  its threads for as long as the player stays connected. Streams end when
+  their room finishes or expires. A room expires after idle_seconds without
+  a question, an answer or a new player.
+  '''
+
+  def __init__(self, queue_size, keepalive, idle_seconds):
+    self.queue_size = queue_size
+    self.keepalive = keepalive
+    self.idle_seconds = idle_seconds
+    self._rooms = {}
+    self._outbox = queue.Queue()
+    self._broadcaster = None
+    self._lock = threading.Lock()
+
+  def create(self, category_id):
+    with self._lock:
+      self._expire()
+      code = ''.join(secrets.choice(CODE_ALPHABET) for _ in range(CODE_LENGTH))
+      while code in self._rooms:
+        code = ''.join(secrets.choice(CODE_ALPHABET) for _ in range(CODE_LENGTH))
+      room = self._rooms[code] = Room(code, secrets.token_urlsafe(16), category_id)
+      return room
+
+  def get(self, code):
+    return self._rooms.get(code.upper())
+
+  def _expire(self):
+    cutoff = time.monotonic() - self.idle_seconds
+    for code in [code for code, room in self._rooms.items() if room.touched < cutoff]:
+      self._rooms.pop(code).close()
+
+  def publish(self, room, event, data):
+    with self._lock:
+      if self._broadcaster is None:
+        self._broadcaster = threading.Thread(target=self._broadcast, name='room-broadcaster', daemon=True)
+        self._broadcaster.start()
+    self._outbox.put((room, room.message(event, data)))
+
+  def finish(self, room):
+    # the final scores go out first, then every player's stream ends
+    room.finished = True
+    self.publish(room, 'finished', {'scores': room.snapshot()['scores']})
+    self._outbox.put((room, CLOSE))
+
+  def _broadcast(self):
+    while True:
+      room, payload = self._outbox.get()
+      if payload is CLOSE:
+        room.close()
+      else:
+        room.fan_out(payload)
+
+  def subscribe(self, room, player):
+    subscriber = Subscriber(player, self.queue_size)
+    room.subscribe(subscriber)
+    return subscriber.stream(self.keepalive, room.unsubscribe)
@@ -0,0 +1,285 @@
+import bisect
+import heapq
+import threading
+from collections import OrderedDict
+
+from models import db, Question
+from textutils import PUNCTUATION, STOPWORDS, normalize_answer, within_edit_distance
+
+MIN_TOKEN_LENGTH = 3
+MAX_SUGGESTIONS = 20
+# a prefix matching more terms than this keeps a top list rather than being scanned
+SCAN_LIMIT = 1000
+CACHED_PREFIXES = 512
+SEARCH_WEIGHT = 2
+MAX_EDITS = 2
+# SymSpell only indexes deletes of a word's first letters, typos past them are still found through the rest
+PREFIX_LENGTH = 7
+
+
+def suggestion_terms(question, answer):
+  # words of the question, plus the whole answer so "george wa" finds "george washington carver"
+  terms = {word for word in normalize_answer(question or '').split() if len(word) >= MIN_TOKEN_LENGTH and word not in STOPWORDS}
+  normalized_answer = normalize_answer(answer or '')
+  if normalized_answer:
+    terms.add(normalized_answer)
+  return terms
+
+
+class SuggestIndex(object):
+  '''Search-box suggestions from a sorted array of terms.
+
+  A prefix is a contiguous range of the array, found with two bisects, and
+  the most popular terms of the range are picked with a heap. Popularity
+  is the number of questions using a term plus searches that hit it. A
+  prefix whose range is longer than SCAN_LIMIT, the short ones, keeps its
+  top MAX_SUGGESTIONS terms in a list instead, and a change to a term only
+  touches the lists of its own prefixes. Past max_terms the least popular
+  tenth of the terms is dropped.
+  '''
+
+  def __init__(self, max_terms):
+    self._max_terms = max_terms
+    self._terms = []
+    self._questions = {}
+    self._searches = {}
+    self._top = OrderedDict()
+    self._loaded = False
+    self._lock = threading.Lock()
+
+  def _popularity(self, term):
+    return self._questions[term] + SEARCH_WEIGHT * self._searches.get(term, 0)
+
+  def _rank(self, term):
+    return (-self._popularity(term), term)
+
+  def _changed(self, term, before):
+    # before is the term's popularity ahead of the change, None if it is new
+    after = self._popularity(term) if term in self._questions else None
+    for length in range(1, len(term) + 1):
+      prefix = term[:length]
+      top = self._top.get(prefix)
+      if top is None:
+        continue
+      if term in top:
+        if after is None or (before is not None and after < before):
+          # something outside the list may now belong in it, so it is rebuilt on next use
+          del self._top[prefix]
+        else:
+          top.sort(key=self._rank)
+      elif after is not None and (len(top) < MAX_SUGGESTIONS or self._rank(term) < self._rank(top[-1])):
+        top.append(term)
+        top.sort(key=self._rank)
+        del top[MAX_SUGGESTIONS:]
+
+  def _add(self, term):
+    count = self._questions.get(term)
+    if count is None:
+      if len(self._terms) >= self._max_terms:
+        self._prune()
+      bisect.insort(self._terms, term)
+      before, count = None, 0
+    else:
+      before = self._popularity(term)
+    self._questions[term] = count + 1
+    self._changed(term, before)
+
+  def _remove(self, term):
+    count = self._questions.get(term)
+    if count is None:
+      return
+    before = self._popularity(term)
+    if count > 1:
+      self._questions[term] = count - 1
+    else:
+      del self._questions[term]
+      self._searches.pop(term, None)
+      position = bisect.bisect_left(self._terms, term)
+      if position < len(self._terms) and self._terms[position] == term:
+        del self._terms[position]
+    self._changed(term, before)
+
+  def _prune(self):
+    keep = set(heapq.nlargest(self._max_terms * 9 // 10, self._terms, key=self._popularity))
+    self._terms = [term for term in self._terms if term in keep]
+    self._questions = {term: count for term, count in self._questions.items() if term in keep}
+    self._searches = {term: count for term, count in self._searches.items() if term in keep}
+    self._top.clear()
+
+  def _load(self):
+    if self._loaded:
+      return
+    self._terms, self._questions, self._searches = [], {}, {}
+    counts = {}
+    for question, answer in db.session.query(Question.question, Question.answer).filter(Question.deleted_at.is_(None)).yield_per(5000):
+      for term in suggestion_terms(question, answer):
+        counts[term] = counts.get(term, 0) + 1
+    if len(counts) > self._max_terms:
+      counts = dict(heapq.nlargest(self._max_terms, counts.items(), key=lambda item: item[1]))
+    self._questions = counts
+    self._terms = sorted(counts)
+    self._top.clear()
+    self._loaded = True
+
+  def reset(self):
+    with self._lock:
+      self._loaded = False
+
+  def on_questions_changed(self, action, questions):
+    with self._lock:
+      if not self._loaded:
+        return
+      for question in questions:
+        previous = question.get('previous', {})
+        if action != 'insert':
+          old_terms = suggestion_terms(previous.get('question', question['question']), previous.get('answer', question['answer']))
+          for term in old_terms:
+            self._remove(term)
+        if action != 'delete':
+          for term in suggestion_terms(question['question'], question['answer']):
+            self._add(term)
+
+  def record_search(self, text):
+    term = normalize_answer(text or '')
+    with self._lock:
+      if term in self._questions:
+        before = self._popularity(term)
+        self._searches[term] = self._searches.get(term, 0) + 1
+        self._changed(term, before)
+
+  def suggest(self, text, limit):
+    prefix = normalize_answer(text or '')
+    if not prefix:
+      return []
+    limit = min(limit, MAX_SUGGESTIONS)
+    with self._lock:
+      self._load()
+      top = self._top.get(prefix)
+      if top is not None:
+        self._top.move_to_end(prefix)
+      else:
+        start = bisect.bisect_left(self._terms, prefix)
+        end = bisect.bisect_left(self._terms, prefix + '\U0010ffff', start)
+        if end - start <= SCAN_LIMIT:
+          top = heapq.nsmallest(limit, self._terms[start:end], key=self._rank)
+        else:
+          top = self._top[prefix] = heapq.nsmallest(MAX_SUGGESTIONS, self._terms[start:end], key=self._rank)
+          if len(self._top) > CACHED_PREFIXES:
+            self._top.popitem(last=False)
+      return [{'term': term, 'questions': self._questions[term]} for term in top[:limit]]
+
+
+def vocabulary_words(text):
+  return PUNCTUATION.sub(' ', (text or '').casefold()).split()
+
+
+def deletes(word, max_edits):
+  # every string reachable from the word's prefix by removing up to max_edits characters
+  found = {word}
+  frontier = {word}
+  for _ in range(max_edits):
+    frontier = {
+      candidate[:position] + candidate[position + 1:]
+      for candidate in frontier if len(candidate) > 1
+      for position in range(len(candidate))
+    }
+    found.update(frontier)
+  return found
+
+
+def allowed_edits(word):
+  return 1 if len(word) <= 4 else MAX_EDITS
+
+
+class SpellIndex(object):
+  '''Typo correction for search terms with a SymSpell deletion dictionary.
+
+  Every word of every question and answer is stored under each string its
+  first PREFIX_LENGTH letters reduce to by up to MAX_EDITS deletions. A
+  misspelled word is corrected by generating its own deletions and looking
+  them up, so candidates come from a few dozen dictionary hits rather than
+  a distance computation against the whole vocabulary. Candidates are then
+  checked with a real edit distance and the most frequent closest one wins.
+  '''
+
+  def __init__(self):
+    self._counts = {}
+    self._deletes = {}
+    self._loaded = False
+    self._lock = threading.Lock()
+
+  def _add(self, word):
+    count = self._counts.get(word, 0)
+    self._counts[word] = count + 1
+    if count == 0:
+      for variant in deletes(word[:PREFIX_LENGTH], MAX_EDITS):
+        self._deletes.setdefault(variant, set()).add(word)
+
+  def _remove(self, word):
+    count = self._counts.get(word)
+    if count is None:
+      return
+    if count > 1:
+      self._counts[word] = count - 1
+      return
+    del self._counts[word]
+    for variant in deletes(word[:PREFIX_LENGTH], MAX_EDITS):
+      words = self._deletes.get(variant)
+      if words is not None:
+        words.discard(word)
+        if not words:
+          del self._deletes[variant]
+
+  def _load(self):
+    if self._loaded:
+      return
+    self._counts, self._deletes = {}, {}
+    for question, answer in db.session.query(Question.question, Question.answer).filter(Question.deleted_at.is_(None)).yield_per(5000):
+      for word in vocabulary_words(question) + vocabulary_words(answer):
+        self._add(word)
+    self._loaded = True
+
+  def reset(self):
+    with self._lock:
+      self._loaded = False
+
+  def on_questions_changed(self, action, questions):
+    with self._lock:
+      if not self._loaded:
+        return
+      for question in questions:
+        previous = question.get('previous', {})
+        if action != 'insert':
+          for word in vocabulary_words(previous.get('question', question['question'])) + vocabulary_words(previous.get('answer', question['answer'])):
+            self._remove(word)
+        if action != 'delete':
+          for word in vocabulary_words(question['question']) + vocabulary_words(question['answer']):
+            self._add(word)
+
+  def _correct_word(self, word):
+    if word in self._counts or len(word) < MIN_TOKEN_LENGTH or any(char.isdigit() for char in word):
+      return word
+    limit = allowed_edits(word)
+    candidates = set()
+    for variant in deletes(word[:PREFIX_LENGTH], limit):
+      candidates.update(self._deletes.get(variant, ()))
+    best = None
+    for candidate in candidates:
+      for distance in range(1, limit + 1):
+        if within_edit_distance(word, candidate, distance):
+          key = (distance, -self._counts[candidate], candidate)
+          if best is None or key < best:
+            best = key
+          break
+    return best[2] if best is not None else word
+
+  def correct(self, text):
+    '''The search text with each unknown word replaced by its closest known word.
+
+    Text whose words are all known comes back untouched, punctuation included.
+    '''
+    words = vocabulary_words(text)
+    with self._lock:
+      self._load()
+      corrected = [self._correct_word(word) for word in words]
+    return text if corrected == words else ' '.join(corrected)
@@ -0,0 +1,157 @@
+from datetime import datetime
+
+import numpy as np
+from scipy import sparse
+
+from models import db, Question, QuestionNeighbour
+from textutils import STOPWORDS, normalize_answer
+
+BLOCK_ROWS = 128
+WRITE_CHUNK = 5000
+
+
+def tokenize(question, answer):
+  text = '{} {}'.format(question or '', answer or '')
+  return [word for word in normalize_answer(text).split() if word not in STOPWORDS]
+
+
+def tfidf_matrix(documents):
+  '''L2-normalized sublinear TF-IDF rows, one per token list, as a CSR matrix.'''
+  vocabulary = {}
+  indptr, indices, counts = [0], [], []
+  for tokens in documents:
+    row = {}
+    for token in tokens:
+      column = vocabulary.setdefault(token, len(vocabulary))
+      row[column] = row.get(column, 0) + 1
+    indices.extend(row)
+    counts.extend(row.values())
+    indptr.append(len(indices))
+
+  matrix = sparse.csr_matrix(
+    (np.array(counts, dtype=np.float64), np.array(indices, dtype=np.int64), np.array(indptr, dtype=np.int64)),
+    shape=(len(documents), len(vocabulary))
+  )
+  matrix.sort_indices()
+  matrix.data = 1.0 + np.log(matrix.data)
+  document_frequency = np.bincount(matrix.indices, minlength=len(vocabulary))
+  idf = np.log((1.0 + len(documents)) / (1.0 + document_frequency)) + 1.0
+  matrix = matrix.multiply(idf).tocsr()
+  norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+  norms[norms == 0] = 1.0
+  return sparse.diags(1.0 / norms).dot(matrix).tocsr()
+
+
+def neighbour_blocks(matrix, rows, k, block_rows=BLOCK_ROWS):
+  '''Top-k cosine neighbours of the given rows, a block of rows at a time.
+
+  Each block is one sparse product against the whole matrix, densified to
+  block_rows x N scores, so memory stays bounded however large the bank.
+  Yields the block's rows, their neighbour columns and scores best first,
+  and the dense scores for callers that need more than the top k.
+  '''
+  total = matrix.shape[0]
+  k = min(k, total - 1)
+  transposed = matrix.T.tocsc()
+  for start in range(0, len(rows), block_rows):
+    block = np.asarray(rows[start:start + block_rows])
+    scores = matrix[block].dot(transposed).toarray()
+    scores[np.arange(len(block)), block] = 0.0
+    if k <= 0:
+      yield block, np.zeros((len(block), 0), dtype=np.int64), np.zeros((len(block), 0)), scores
+      continue
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    top_scores = np.take_along_axis(scores, top, axis=1)
+    order = np.argsort(-top_scores, axis=1)
+    yield block, np.take_along_axis(top, order, axis=1), np.take_along_axis(top_scores, order, axis=1), scores
+
+
+def load_questions():
+  rows = db.session.query(Question.id, Question.question, Question.answer).filter(Question.deleted_at.is_(None)).order_by(Question.id).yield_per(5000)
+  ids, documents = [], []
+  for question_id, question, answer in rows:
+    ids.append(question_id)
+    documents.append(tokenize(question, answer))
+  return np.array(ids, dtype=np.int64), documents
+
+
+def write_neighbours(neighbours):
+  # neighbours maps a question id to its [(score, neighbour id)] best first
+  table = QuestionNeighbour.__table__
+  rows = [
+    {'question_id': question_id, 'rank': rank, 'neighbour_id': neighbour_id, 'score': score}
+    for question_id, entries in neighbours.items()
+    for rank, (score, neighbour_id) in enumerate(entries)
+  ]
+  for start in range(0, len(rows), WRITE_CHUNK):
+    db.session.execute(table.insert(), rows[start:start + WRITE_CHUNK])
+
+
+def mark_scored(question_ids):
+  table = Question.__table__
+  scored_at = datetime.utcnow()
+  for start in range(0, len(question_ids), WRITE_CHUNK):
+    db.session.execute(table.update().where(table.c.id.in_(question_ids[start:start + WRITE_CHUNK])).values(neighbours_at=scored_at))
+
+
+def compute_neighbours(k=20, incremental=False, block_rows=BLOCK_ROWS):
+  '''Rewrites the neighbour table, or with incremental only what new or edited questions change.
+
+  TF-IDF weights are always refitted on the whole bank, which is linear in
+  its size. The quadratic part, scoring pairs, is limited in incremental
+  mode to the questions with no neighbours_at stamp: they get their own
+  top k, and every other question they beat the k-th neighbour of is
+  updated. Each scored question is stamped, whether it found neighbours
+  or not, so the next run skips it.
+  '''
+  ids, documents = load_questions()
+  if not len(ids):
+    return 0
+  matrix = tfidf_matrix(documents)
+  table = QuestionNeighbour.__table__
+
+  if not incremental:
+    neighbours = {}
+    for block, top, top_scores, scores in neighbour_blocks(matrix, np.arange(len(ids)), k, block_rows):
+      for row, columns, values in zip(block, top, top_scores):
+        neighbours[int(ids[row])] = [(float(value), int(ids[column])) for column, value in zip(columns, values) if value > 0]
+    db.session.execute(table.delete())
+    write_neighbours(neighbours)
+    mark_scored([int(question_id) for question_id in ids])
+    db.session.commit()
+    return len(neighbours)
+
+  existing = {}
+  for question_id, rank, neighbour_id, score in db.session.query(
+      QuestionNeighbour.question_id, QuestionNeighbour.rank, QuestionNeighbour.neighbour_id, QuestionNeighbour.score
+  ).order_by(QuestionNeighbour.question_id, QuestionNeighbour.rank).yield_per(WRITE_CHUNK):
+    existing.setdefault(question_id, []).append((score, neighbour_id))
+
+  pending = {
+    question_id for (question_id,) in db.session.query(Question.id).filter(
+      Question.deleted_at.is_(None), Question.neighbours_at.is_(None)
+    ).yield_per(WRITE_CHUNK)
+  }
+  new_rows = np.array([row for row, question_id in enumerate(ids) if int(question_id) in pending], dtype=np.int64)
+  changed = {}
+  for block, top, top_scores, scores in neighbour_blocks(matrix, new_rows, k, block_rows):
+    for position, row in enumerate(block):
+      new_id = int(ids[row])
+      changed[new_id] = [(float(value), int(ids[column])) for column, value in zip(top[position], top_scores[position]) if value > 0]
+      # offer the new question to every scored question it shares a term with, replacing an edited one's old score
+      for column in np.nonzero(scores[position])[0]:
+        question_id = int(ids[column])
+        if question_id in pending:
+          continue
+        entries = [entry for entry in changed.get(question_id, existing.get(question_id, [])) if entry[1] != new_id]
+        score = float(scores[position, column])
+        if len(entries) < k or score > entries[-1][0]:
+          changed[question_id] = sorted(entries + [(score, new_id)], key=lambda entry: -entry[0])[:k]
+
+  changed_ids = list(changed)
+  for start in range(0, len(changed_ids), WRITE_CHUNK):
+    db.session.execute(table.delete().where(table.c.question_id.in_(changed_ids[start:start + WRITE_CHUNK])))
+  write_neighbours(changed)
+  mark_scored([int(ids[row]) for row in new_rows])
+  db.session.commit()
+  return len(changed)
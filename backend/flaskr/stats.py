@@ -0,0 +1,113 @@
+import logging
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+
+from models import db, QuestionStats
+
+logger = logging.getLogger(__name__)
+
+
+def upsert_stats(rows):
+  # one multi-row INSERT ... ON CONFLICT per flush, the counters are added to whatever is stored
+  from sqlalchemy.dialects.postgresql import insert
+  table = QuestionStats.__table__
+  statement = insert(table).values(rows)
+  return statement.on_conflict_do_update(index_elements=[table.c.question_id], set_={
+    'served': table.c.served + statement.excluded.served,
+    'answered': table.c.answered + statement.excluded.answered,
+    'correct': table.c.correct + statement.excluded.correct,
+    'updated_at': statement.excluded.updated_at
+  })
+
+
+class StatsCounters(object):
+  '''Write-combining counters for the question_stats table.
+
+  Quiz draws bump the served deltas, and answers are counted as the answer
+  event buffer writes them, through record_answers(). A flusher thread
+  swaps the deltas out every flush_seconds and adds them to the stored
+  totals in one upsert, so a hot question costs one row update per interval
+  however often it is played. Deltas of a failed flush are merged back and
+  retried. served_totals() keeps each question's times served in memory,
+  read once from the table and then counted up locally, for quiz draws.
+  '''
+
+  def __init__(self, app, flush_seconds):
+    self._app = app
+    self._flush_seconds = flush_seconds
+    self._deltas = defaultdict(lambda: [0, 0, 0])
+    self._served = None
+    self._thread = None
+    self._closed = False
+    self._flush_lock = threading.Lock()
+    self._lock = threading.Lock()
+
+  def _start(self):
+    if self._thread is None and not self._closed:
+      self._thread = threading.Thread(target=self._run, name='stats-flush', daemon=True)
+      self._thread.start()
+
+  def record_served(self, question_ids):
+    with self._lock:
+      self._start()
+      for question_id in question_ids:
+        self._deltas[question_id][0] += 1
+        if self._served is not None:
+          self._served[question_id] = self._served.get(question_id, 0) + 1
+
+  def served_totals(self):
+    '''Times served per question id, stored totals plus what this worker has served since.'''
+    if self._served is None:
+      # no flush may move deltas into the table between the read and the merge
+      with self._flush_lock:
+        stored = dict(db.session.query(QuestionStats.question_id, QuestionStats.served).yield_per(5000))
+        with self._lock:
+          if self._served is None:
+            for question_id, delta in self._deltas.items():
+              stored[question_id] = stored.get(question_id, 0) + delta[0]
+            self._served = stored
+    return self._served
+
+  def record_answers(self, rows):
+    # rows of the answers table, as the event buffer has just written them
+    with self._lock:
+      self._start()
+      for row in rows:
+        delta = self._deltas[row['question_id']]
+        delta[1] += 1
+        if row['correct']:
+          delta[2] += 1
+
+  def _run(self):
+    while not self._closed:
+      time.sleep(self._flush_seconds)
+      self.flush()
+
+  def flush(self):
+    with self._flush_lock:
+      with self._lock:
+        deltas, self._deltas = self._deltas, defaultdict(lambda: [0, 0, 0])
+      if not deltas:
+        return
+      now = datetime.utcnow()
+      rows = [
+        {'question_id': question_id, 'served': served, 'answered': answered, 'correct': correct, 'updated_at': now}
+        for question_id, (served, answered, correct) in sorted(deltas.items())
+      ]
+      try:
+        with self._app.app_context():
+          db.session.execute(upsert_stats(rows))
+          db.session.commit()
+      except Exception:
+        logger.exception('could not flush stats for %d questions, will retry', len(rows))
+        with self._lock:
+          for question_id, delta in deltas.items():
+            pending = self._deltas[question_id]
+            for position in range(3):
+              pending[position] += delta[position]
+
+  def close(self):
+    self._closed = True
+    self.flush()
@@ -0,0 +1,75 @@
+from models import db, commit_questions, question_tags, Question, Tag
+
+MAX_TAG_LENGTH = 64
+# Postgres takes at most 65535 bind parameters per statement, two per question_tags row
+MAX_INSERT_ROWS = 30000
+
+
+def insert_ignoring_existing(table, rows):
+  # one multi-row INSERT ... VALUES (...), (...) ON CONFLICT DO NOTHING
+  from sqlalchemy.dialects.postgresql import insert
+  return insert(table).values(rows).on_conflict_do_nothing()
+
+
+def normalize_tags(names):
+  # lower case, trimmed, unique, in a stable order; None for anything that is not a list of strings
+  if not isinstance(names, list) or not all(isinstance(name, str) for name in names):
+    return None
+  tags = sorted(set(name.strip().lower() for name in names if name.strip()))
+  if any(len(name) > MAX_TAG_LENGTH for name in tags):
+    return None
+  return tags
+
+
+def ensure_tags(names):
+  '''Tag rows for the names, created where missing without racing other workers.'''
+  if not names:
+    return []
+  db.session.execute(insert_ignoring_existing(Tag.__table__, [{'name': name} for name in names]))
+  return Tag.query.filter(Tag.name.in_(names)).all()
+
+
+def tag_questions(question_ids, names, remove=False, batch_size=1000):
+  '''Adds the tags to, or removes them from, many questions in batches.
+
+  Each batch is one multi-row INSERT or one DELETE in its own transaction,
+  followed by one questions_changed('update', ...) for the questions whose
+  tags actually changed. Returns how many questions changed.
+  '''
+  tag_ids = [tag.id for tag in ensure_tags(names)]
+  db.session.commit()
+  if not tag_ids:
+    return 0
+  names = set(names)
+  changed = 0
+
+  for start in range(0, len(question_ids), batch_size):
+    batch = question_ids[start:start + batch_size]
+    # tags come with the questions through the selectin relationship, one extra query
+    questions = [question.format() for question in Question.query.filter(Question.id.in_(batch), Question.deleted_at.is_(None)).all()]
+    if not questions:
+      continue
+    batch = [question['id'] for question in questions]
+    if remove:
+      db.session.execute(question_tags.delete().where(
+        question_tags.c.question_id.in_(batch) & question_tags.c.tag_id.in_(tag_ids)
+      ))
+    else:
+      rows = [{'tag_id': tag_id, 'question_id': question['id']} for question in questions for tag_id in tag_ids]
+      # a single statement unless batch_size times the number of tags is very large
+      for start in range(0, len(rows), MAX_INSERT_ROWS):
+        db.session.execute(insert_ignoring_existing(question_tags, rows[start:start + MAX_INSERT_ROWS]))
+
+    changes = []
+    for question in questions:
+      previous = question['tags']
+      current = sorted(set(previous) - names) if remove else sorted(set(previous) | names)
+      if current != previous:
+        changes.append(dict(question, tags=current, previous={'tags': previous}))
+    if changes:
+      commit_questions('update', changes)
+    else:
+      db.session.commit()
+    changed += len(changes)
+
+  return changed
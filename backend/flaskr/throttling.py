@@ -0,0 +1,131 @@
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from flask import abort, g, request
+
+MAX_TRACKED_CLIENTS = 100000
+
+TOKEN_BUCKET_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(bucket[1]) or capacity
+local updated = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(now - updated, 0) * rate)
+local allowed = 0
+if tokens >= 1 then
+  tokens = tokens - 1
+  allowed = 1
+end
+redis.call('HMSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate))
+return {allowed, tostring(tokens)}
+"""
+
+
+class MemoryBucketStore(object):
+  '''Token buckets for one worker process, at most max_clients of them.
+
+  Buckets are kept in least recently used order, so when the store is full
+  the client seen longest ago loses its bucket, in constant time.
+  '''
+
+  def __init__(self, max_clients=MAX_TRACKED_CLIENTS):
+    self._buckets = OrderedDict()
+    self._max_clients = max_clients
+    self._lock = threading.Lock()
+
+  def take(self, key, capacity, rate):
+    now = time.monotonic()
+    with self._lock:
+      tokens, updated = self._buckets.get(key, (capacity, now))
+      tokens = min(capacity, tokens + (now - updated) * rate)
+      allowed = tokens >= 1
+      if allowed:
+        tokens -= 1
+      self._buckets[key] = (tokens, now)
+      self._buckets.move_to_end(key)
+      if len(self._buckets) > self._max_clients:
+        self._buckets.popitem(last=False)
+    return allowed, tokens
+
+
+class RedisBucketStore(object):
+  '''Token buckets shared by every worker through one atomic redis script.'''
+
+  def __init__(self, client):
+    self._script = client.register_script(TOKEN_BUCKET_SCRIPT)
+
+  def take(self, key, capacity, rate):
+    allowed, tokens = self._script(keys=['trivia:ratelimit:' + key], args=[capacity, rate, time.time()])
+    return bool(allowed), float(tokens)
+
+
+def create_bucket_store(redis_url):
+  if not redis_url:
+    return MemoryBucketStore()
+  # redis is only needed when a shared store is configured
+  import redis
+  return RedisBucketStore(redis.Redis.from_url(redis_url))
+
+
+class RateLimiter(object):
+  def __init__(self, store, limits, default):
+    self._store = store
+    self._limits = limits
+    self._default = default
+
+  def retry_after(self, endpoint, client):
+    # None when the request may go ahead, otherwise seconds until a token is free
+    requests, seconds = self._limits.get(endpoint, self._default)
+    rate = requests / float(seconds)
+    allowed, tokens = self._store.take('{}:{}'.format(endpoint, client), requests, rate)
+    if allowed:
+      return None
+    return max(1, int(math.ceil((1 - tokens) / rate)))
+
+
+class ConcurrencyLimiter(object):
+  '''Turns requests away once a worker is serving as many as its database pool can take.'''
+
+  def __init__(self, limit):
+    self._slots = threading.BoundedSemaphore(limit)
+
+  def try_acquire(self):
+    return self._slots.acquire(blocking=False)
+
+  def release(self):
+    self._slots.release()
+
+
+def client_key(api_keys):
+  # only a key we issued names a client, otherwise any new key would be a fresh bucket
+  key = request.headers.get('X-API-Key')
+  if key and key in api_keys:
+    return 'key:' + key
+  return request.remote_addr or 'unknown'
+
+
+def init_throttling(app, rate_limiter, concurrency_limiter, retry_after, api_keys=frozenset()):
+  @app.before_request
+  def admit_request():
+    if request.method == 'OPTIONS' or request.endpoint is None:
+      return
+
+    wait = rate_limiter.retry_after(request.endpoint, client_key(app.config.get('API_KEYS', api_keys)))
+    if wait is not None:
+      g.retry_after = wait
+      abort(429)
+
+    if not concurrency_limiter.try_acquire():
+      g.retry_after = retry_after
+      abort(503)
+    g.admitted = True
+
+  @app.teardown_request
+  def release_request(error=None):
+    if g.pop('admitted', False):
+      concurrency_limiter.release()
@@ -1,8 +1,11 @@
 import os
-from sqlalchemy import Column, String, Integer, create_engine
+from datetime import datetime
+from sqlalchemy import Column, String, Integer, SmallInteger, Float, Boolean, DateTime, ForeignKey, create_engine, inspect
+from flask import current_app
 from flask_sqlalchemy import SQLAlchemy
 import json
 from settings import DB_NAME, DB_USER, DB_PASSWORD
+from textutils import normalize_answer
 
 database_name = "trivia"
 database_path = "postgres://{}/{}".format('localhost:5432', database_name)
@@ -12,18 +15,140 @@ db = SQLAlchemy()
 '''
 setup_db(app)
     binds a flask application and a SQLAlchemy service
+    no connection is opened here, the engine is created on first use
 '''
 def setup_db(app, database_path=database_path):
     app.config["SQLALCHEMY_DATABASE_URI"] = database_path
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
     db.app = app
     db.init_app(app)
+
+'''
+MIGRATIONS
+    idempotent schema changes applied by upgrade_db after create_all
+'''
+MIGRATIONS = [
+    "ALTER TABLE questions ADD COLUMN IF NOT EXISTS normalized_answer text",
+    "ALTER TABLE questions ADD COLUMN IF NOT EXISTS rating double precision",
+    "ALTER TABLE categories ADD COLUMN IF NOT EXISTS parent_id integer REFERENCES categories (id)",
+    "CREATE INDEX IF NOT EXISTS ix_categories_parent_id ON categories (parent_id)",
+    "ALTER TABLE questions ADD COLUMN IF NOT EXISTS deleted_at timestamp",
+    # reads only ever want live questions, the purge job only deleted ones
+    "CREATE INDEX IF NOT EXISTS ix_questions_live_category ON questions (category) WHERE deleted_at IS NULL",
+    "CREATE INDEX IF NOT EXISTS ix_questions_deleted_at ON questions (deleted_at) WHERE deleted_at IS NOT NULL",
+    # `flask similar --incremental` works through the questions it has not seen since they were written
+    "ALTER TABLE questions ADD COLUMN IF NOT EXISTS neighbours_at timestamp",
+    "CREATE INDEX IF NOT EXISTS ix_questions_neighbours_pending ON questions (id) WHERE neighbours_at IS NULL AND deleted_at IS NULL",
+    # fill the closure table from the parent links, rows already there are kept
+    """WITH RECURSIVE paths (ancestor_id, descendant_id, depth) AS (
+      SELECT id, id, 0 FROM categories
+      UNION ALL
+      SELECT categories.parent_id, paths.descendant_id, paths.depth + 1
+      FROM paths JOIN categories ON categories.id = paths.ancestor_id
+      WHERE categories.parent_id IS NOT NULL
+    )
+    INSERT INTO category_paths (ancestor_id, descendant_id, depth)
+    SELECT ancestor_id, descendant_id, depth FROM paths
+    ON CONFLICT DO NOTHING""",
+]
+
+'''
+upgrade_db()
+    creates missing tables and applies the pending schema changes
+    run through `flask db upgrade`, never on app construction
+'''
+def upgrade_db():
     db.create_all()
+    for statement in MIGRATIONS:
+        db.session.execute(statement)
+    db.session.commit()
+
+    # backfill answers stored before normalization existed, and answers ending in an
+    # article, which normalization used to drop ("vitamin a" was stored as "vitamin")
+    ends_in_article = Question.answer.op('~*')(r'\m(a|an|the)\W*$')
+    for question in Question.query.filter(Question.normalized_answer.is_(None) | ends_in_article).yield_per(1000):
+        question.normalize()
+    db.session.commit()
 
 '''
-Question
+on_questions_changed(app, listener)
+    registers listener(action, questions) to run after questions are committed
+    action is 'insert', 'update' or 'delete' and questions is a list of
+    formatted questions, updates also carry the changed fields under 'previous'
+'''
+def on_questions_changed(app, listener):
+    app.extensions.setdefault('questions_changed', []).append(listener)
+
+def questions_changed(action, questions):
+    for listener in current_app.extensions.get('questions_changed', []):
+        listener(action, questions)
 
 '''
+on_questions_commit(app, listener)
+    registers listener(action, questions) to run inside the writing transaction,
+    just before it commits, so whatever the listener writes commits with it
+commit_questions(action, questions)
+    runs those listeners, commits, then notifies the questions_changed listeners
+'''
+def on_questions_commit(app, listener):
+    app.extensions.setdefault('questions_commit', []).append(listener)
+
+def commit_questions(action, questions):
+    for listener in current_app.extensions.get('questions_commit', []):
+        listener(action, questions)
+    db.session.commit()
+    questions_changed(action, questions)
+
+'''
+on_categories_changed(app, listener)
+    registers listener() to run after categories are added or moved
+'''
+def on_categories_changed(app, listener):
+    app.extensions.setdefault('categories_changed', []).append(listener)
+
+def categories_changed():
+    for listener in current_app.extensions.get('categories_changed', []):
+        listener()
+
+'''
+on_categories_commit(app, listener) and commit_categories()
+    the same as for questions, for listener() inside a category write
+'''
+def on_categories_commit(app, listener):
+    app.extensions.setdefault('categories_commit', []).append(listener)
+
+def commit_categories():
+    for listener in current_app.extensions.get('categories_commit', []):
+        listener()
+    db.session.commit()
+    categories_changed()
+
+'''
+rating_prior(difficulty)
+    starting rating on the logit scale for a 1 to 5 difficulty label,
+    used until calibration has fitted a rating from logged answers
+'''
+def rating_prior(difficulty):
+    return ((difficulty or 3) - 3) * 0.75
+
+'''
+question_tags
+    many-to-many between questions and tags, the primary key serves
+    lookups by tag and the extra index lookups by question
+'''
+question_tags = db.Table(
+  'question_tags',
+  Column('tag_id', Integer, ForeignKey('tags.id', ondelete='CASCADE'), primary_key=True),
+  Column('question_id', Integer, ForeignKey('questions.id', ondelete='CASCADE'), primary_key=True, index=True)
+)
+
+'''
+Question
+    delete() only sets deleted_at, the row stays for history and stats until
+    `flask purge-questions` removes it, so reads filter on deleted_at IS NULL
+    neighbours_at is when `flask similar` last scored the question, None
+    until then and again after its text is edited
+'''
 class Question(db.Model):  
   __tablename__ = 'questions'
 
@@ -32,6 +157,12 @@ class Question(db.Model):
   answer = Column(String)
   category = Column(String)
   difficulty = Column(Integer)
+  normalized_answer = Column(String)
+  rating = Column(Float)
+  deleted_at = Column(DateTime)
+  neighbours_at = Column(DateTime)
+  # loaded for a whole result set in one extra query
+  tags = db.relationship('Tag', secondary=question_tags, lazy='selectin')
 
   def __init__(self, question, answer, category, difficulty):
     self.question = question
@@ -39,16 +170,42 @@ class Question(db.Model):
     self.category = category
     self.difficulty = difficulty
 
+  def normalize(self):
+    self.normalized_answer = normalize_answer(self.answer or '')
+
+  def effective_rating(self):
+    return self.rating if self.rating is not None else rating_prior(self.difficulty)
+
   def insert(self):
+    self.normalize()
     db.session.add(self)
-    db.session.commit()
+    db.session.flush()
+    change = self.format()
+    commit_questions('insert', [change])
   
   def update(self):
-    db.session.commit()
+    self.normalize()
+    change = self.format()
+    change['previous'] = {}
+    for attr in inspect(self).attrs:
+      history = attr.history
+      if not history.has_changes():
+        continue
+      if attr.key == 'tags':
+        change['previous']['tags'] = sorted(tag.name for tag in list(history.unchanged) + list(history.deleted))
+      else:
+        change['previous'][attr.key] = history.deleted[0] if history.deleted else None
+    if 'question' in change['previous'] or 'answer' in change['previous']:
+      self.neighbours_at = None
+    if 'difficulty' in change['previous']:
+      # the calibrated rating belongs to the old difficulty, the rating index goes back to the prior too
+      self.rating = None
+    commit_questions('update', [change])
 
   def delete(self):
-    db.session.delete(self)
-    db.session.commit()
+    change = self.format()
+    self.deleted_at = datetime.utcnow()
+    commit_questions('delete', [change])
 
   def format(self):
     return {
@@ -56,24 +213,157 @@ class Question(db.Model):
       'question': self.question,
       'answer': self.answer,
       'category': self.category,
-      'difficulty': self.difficulty
+      'difficulty': self.difficulty,
+      'tags': sorted(tag.name for tag in self.tags)
     }
 
 '''
-Category
+Tag
+    free-form label, names are stored lower case
+'''
+class Tag(db.Model):
+  __tablename__ = 'tags'
+
+  id = Column(Integer, primary_key=True)
+  name = Column(String, nullable=False, unique=True)
+
+  def __init__(self, name):
+    self.name = name
+
+  def format(self):
+    return {
+      'id': self.id,
+      'name': self.name
+    }
 
 '''
+Category
+    categories nest through parent_id, null for a top-level category
+'''
 class Category(db.Model):  
   __tablename__ = 'categories'
 
   id = Column(Integer, primary_key=True)
   type = Column(String)
+  parent_id = Column(Integer, ForeignKey('categories.id'), index=True)
 
-  def __init__(self, type):
+  def __init__(self, type, parent_id=None):
     self.type = type
+    self.parent_id = parent_id
+
+  def format(self):
+    return {
+      'id': self.id,
+      'type': self.type,
+      'parent_id': self.parent_id
+    }
+
+'''
+CategoryPath
+    closure table of the category tree, one row per ancestor and descendant
+    including each category itself at depth 0, so a whole subtree is one
+    indexed lookup on ancestor_id
+'''
+class CategoryPath(db.Model):
+  __tablename__ = 'category_paths'
+
+  ancestor_id = Column(Integer, ForeignKey('categories.id', ondelete='CASCADE'), primary_key=True)
+  descendant_id = Column(Integer, ForeignKey('categories.id', ondelete='CASCADE'), primary_key=True, index=True)
+  depth = Column(SmallInteger, nullable=False)
+
+'''
+Score
+    one finished quiz, category is null for quizzes over all categories
+'''
+class Score(db.Model):
+  __tablename__ = 'scores'
+
+  id = Column(Integer, primary_key=True)
+  player = Column(String, nullable=False)
+  category = Column(Integer, index=True)
+  score = Column(Integer, nullable=False)
+  created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+  def __init__(self, player, score, category=None):
+    self.player = player
+    self.score = score
+    self.category = category
 
   def format(self):
     return {
       'id': self.id,
-      'type': self.type
-    }
\ No newline at end of file
+      'player': self.player,
+      'category': self.category,
+      'score': self.score
+    }
+
+'''
+Answer
+    one logged quiz answer, the input of rating calibration
+    answers sent without a player are logged under ANONYMOUS_PLAYER
+'''
+ANONYMOUS_PLAYER = 'anonymous'
+
+class Answer(db.Model):
+  __tablename__ = 'answers'
+
+  id = Column(Integer, primary_key=True)
+  question_id = Column(Integer, nullable=False, index=True)
+  player = Column(String, nullable=False, index=True)
+  correct = Column(Boolean, nullable=False)
+  created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+  def __init__(self, question_id, player, correct):
+    self.question_id = question_id
+    self.player = player
+    self.correct = correct
+
+  def format(self):
+    return {
+      'id': self.id,
+      'question_id': self.question_id,
+      'player': self.player,
+      'correct': self.correct
+    }
+
+'''
+QuestionStats
+    running totals per question, kept by the stats counters rather than
+    computed from the answers table
+'''
+class QuestionStats(db.Model):
+  __tablename__ = 'question_stats'
+
+  question_id = Column(Integer, primary_key=True)
+  served = Column(Integer, nullable=False, default=0)
+  answered = Column(Integer, nullable=False, default=0)
+  correct = Column(Integer, nullable=False, default=0)
+  updated_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+  def format(self):
+    return format_stats(self.served, self.answered, self.correct)
+
+'''
+QuestionNeighbour
+    one precomputed similar question, written in bulk by `flask similar`
+    rank 0 is the most similar
+'''
+class QuestionNeighbour(db.Model):
+  __tablename__ = 'question_neighbours'
+
+  question_id = Column(Integer, primary_key=True)
+  rank = Column(SmallInteger, primary_key=True)
+  neighbour_id = Column(Integer, nullable=False)
+  score = Column(Float, nullable=False)
+
+'''
+format_stats(served, answered, correct)
+    stats payload shared by the question and category endpoints
+'''
+def format_stats(served, answered, correct):
+  return {
+    'served': served,
+    'answered': answered,
+    'correct': correct,
+    'correct_rate': correct / float(answered) if answered else None
+  }
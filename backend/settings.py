@@ -4,4 +4,77 @@ import os
 load_dotenv()
 DB_NAME = os.environ.get("DB_NAME")
 DB_USER=os.environ.get("DB_USER")
-DB_PASSWORD = os.environ.get("DB_PASSWORD")
\ No newline at end of file
+DB_PASSWORD = os.environ.get("DB_PASSWORD")
+
+# Answers and scores are queued per worker and written in batches of up to
+# INGEST_BATCH_SIZE rows, at least every INGEST_FLUSH_SECONDS. With a full queue
+# a request waits INGEST_PUT_TIMEOUT seconds before it is turned away with a 503
+INGEST_QUEUE_SIZE = int(os.environ.get("INGEST_QUEUE_SIZE", 10000))
+INGEST_BATCH_SIZE = int(os.environ.get("INGEST_BATCH_SIZE", 500))
+INGEST_FLUSH_SECONDS = float(os.environ.get("INGEST_FLUSH_SECONDS", 1))
+INGEST_PUT_TIMEOUT = float(os.environ.get("INGEST_PUT_TIMEOUT", 0.05))
+
+# Per-question play and answer counts are combined in memory and added to question_stats this often
+STATS_FLUSH_SECONDS = float(os.environ.get("STATS_FLUSH_SECONDS", 5))
+
+# Hot questions and search terms: Count-Min width x depth, top-k size, HyperLogLog precision
+# (2^p registers) and how long one counting window lasts
+ANALYTICS_SKETCH_WIDTH = int(os.environ.get("ANALYTICS_SKETCH_WIDTH", 2048))
+ANALYTICS_SKETCH_DEPTH = int(os.environ.get("ANALYTICS_SKETCH_DEPTH", 4))
+ANALYTICS_TOP_K = int(os.environ.get("ANALYTICS_TOP_K", 100))
+ANALYTICS_HLL_PRECISION = int(os.environ.get("ANALYTICS_HLL_PRECISION", 12))
+ANALYTICS_WINDOW_SECONDS = float(os.environ.get("ANALYTICS_WINDOW_SECONDS", 3600))
+
+# New questions whose estimated similarity to an existing one reaches this are rejected as duplicates
+DEDUP_THRESHOLD = float(os.environ.get("DEDUP_THRESHOLD", 0.8))
+
+# Terms kept for search suggestions per worker, the least popular are dropped past this
+SUGGEST_MAX_TERMS = int(os.environ.get("SUGGEST_MAX_TERMS", 200000))
+
+# Questions tagged or untagged per transaction by bulk tagging
+TAG_BATCH_SIZE = int(os.environ.get("TAG_BATCH_SIZE", 1000))
+
+# Live quiz rooms: events buffered per player, keepalive interval, idle expiry
+ROOM_QUEUE_SIZE = int(os.environ.get("ROOM_QUEUE_SIZE", 64))
+ROOM_KEEPALIVE_SECONDS = float(os.environ.get("ROOM_KEEPALIVE_SECONDS", 15))
+ROOM_IDLE_SECONDS = float(os.environ.get("ROOM_IDLE_SECONDS", 3600))
+
+# Rate limits per client (API key or IP) as (requests, seconds), keyed by endpoint
+RATE_LIMITS = {
+  "create_question": (30, 60),
+  "get_quizzes": (60, 60),
+  "check_quiz_answer": (120, 60),
+  "create_score": (10, 60),
+}
+RATE_LIMIT_DEFAULT = (300, 60)
+# Comma separated API keys that get a bucket of their own, any other key is ignored
+API_KEYS = frozenset(key.strip() for key in os.environ.get("API_KEYS", "").split(",") if key.strip())
+
+# Optional shared store for workers on several processes or nodes, e.g. redis://localhost:6379/0
+REDIS_URL = os.environ.get("REDIS_URL")
+
+# Requests served at once per worker, keep it below the database pool size (5 + 10 overflow)
+MAX_CONCURRENT_REQUESTS = int(os.environ.get("MAX_CONCURRENT_REQUESTS", 10))
+RETRY_AFTER_SECONDS = int(os.environ.get("RETRY_AFTER_SECONDS", 1))
+
+# Rendered responses of list endpoints: "memory" per worker, or "redis" shared through REDIS_URL
+RESPONSE_CACHE_BACKEND = os.environ.get("RESPONSE_CACHE_BACKEND", "memory")
+RESPONSE_CACHE_ENTRIES = int(os.environ.get("RESPONSE_CACHE_ENTRIES", 1024))
+RESPONSE_CACHE_BYTES = int(os.environ.get("RESPONSE_CACHE_BYTES", 16 * 1024 * 1024))
+RESPONSE_CACHE_TTL = float(os.environ.get("RESPONSE_CACHE_TTL", 300))
+# Past the TTL a page is served stale while it is refreshed, and while the database is down, up to this age
+RESPONSE_CACHE_MAX_STALE = float(os.environ.get("RESPONSE_CACHE_MAX_STALE", 3600))
+
+# Broadcast writes to the other workers with Postgres NOTIFY so their in-process caches stay fresh
+INVALIDATION_BUS = os.environ.get("INVALIDATION_BUS", "1") == "1"
+
+# Adaptive quizzes: Elo step for a player's skill, and how long the rating index may go without a reload
+ADAPTIVE_K = float(os.environ.get("ADAPTIVE_K", 0.4))
+RATING_INDEX_MAX_AGE = float(os.environ.get("RATING_INDEX_MAX_AGE", 600))
+
+# Deleted questions are kept this long for history before `flask purge-questions` removes them, a batch at a time
+PURGE_AFTER_DAYS = int(os.environ.get("PURGE_AFTER_DAYS", 30))
+PURGE_BATCH_SIZE = int(os.environ.get("PURGE_BATCH_SIZE", 500))
+
+# Questions per transaction, and per change notification, for bulk updates and deletes
+BULK_BATCH_SIZE = int(os.environ.get("BULK_BATCH_SIZE", 1000))
@@ -1,11 +1,17 @@
+import itertools
 import os
 import unittest
+from unittest import mock
 import json
+from datetime import datetime
 from flask_sqlalchemy import SQLAlchemy
 
 # from settings import DB_NAME, DB_USER, DB_PASSWORD
 from flaskr import create_app
-from models import setup_db, Question, Category
+from flaskr.purge import purge_questions
+from flaskr.rooms import RoomRegistry
+from textutils import check_answer, normalize_answer
+from models import setup_db, upgrade_db, Question, Category, Score
 
 
 class TriviaTestCase(unittest.TestCase):
@@ -13,7 +19,8 @@ class TriviaTestCase(unittest.TestCase):
 
     def setUp(self):
         """Define test variables and initialize app."""
-        self.app = create_app()
+        # one listener connection per test app would exhaust the database
+        self.app = create_app({"INVALIDATION_BUS": False})
         self.client = self.app.test_client
         self.database_name = "trivia_test"
         self.database_path = "postgres://{}/{}".format('localhost:5432', self.database_name)
@@ -25,10 +32,8 @@ class TriviaTestCase(unittest.TestCase):
 
         # binds the app to the current context
         with self.app.app_context():
-            self.db = SQLAlchemy()
-            self.db.init_app(self.app)
-            # create all tables
-            self.db.create_all()
+            # create all tables, the factory no longer does it
+            upgrade_db()
     
     def tearDown(self):
         """Executed after reach test"""
@@ -39,6 +44,13 @@ class TriviaTestCase(unittest.TestCase):
     Write at least one test for each test for successful operation and for expected errors.
     """
 
+    #App factory must not connect to the database
+    def test_create_app_without_database(self):
+        app = create_app({"SQLALCHEMY_DATABASE_URI": "postgres://localhost:1/unreachable"})
+
+        self.assertIn("retrieve_categories", app.view_functions)
+        self.assertIn("db", app.cli.commands)
+
     #Paginated questions 
     def test_get_paginated_questions(self):
         res = self.client().get("/questions")
@@ -113,6 +125,7 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data["deleted"], 10)
         self.assertTrue(data["total_questions"])
         self.assertTrue(len(data["questions"]))
+        self.assertIsNotNone(question.deleted_at)
 
     #Delete Questions for failure
     def test_delete_question_failure(self):
@@ -123,6 +136,22 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data["success"], False)
         self.assertEqual(data['message'], 'resource not found')
 
+    #A deleted question cannot be deleted again, and the purge removes its row
+    def test_purge_deleted_question(self):
+        res = self.client().post('/questions', json=dict(self.new_question, allow_duplicate=True))
+        question_id = json.loads(res.data)['created']
+        self.client().delete('/questions/{}'.format(question_id))
+
+        res = self.client().delete('/questions/{}'.format(question_id))
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(data['success'], False)
+
+        with self.app.app_context():
+            purge_questions(0)
+            self.assertIsNone(Question.query.get(question_id))
+
 
 
     # Add Questions
@@ -178,6 +207,560 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['success'], True)
         self.assertTrue(data['question'])
 
+    # Batch of quiz questions in one request
+    def test_play_quiz_batch(self):
+        test_question = {'quiz_category': {'type': 'Art', 'id': 2}, 'previous_questions': [], 'count': 3}
+        res = self.client().post('/quizzes', json=test_question)
+        data = json.loads(res.data)
+        ids = [question['id'] for question in data['questions']]
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(len(ids), 3)
+        self.assertEqual(len(set(ids)), 3)
+
+    # Batch larger than the limit is rejected
+    def test_play_quiz_batch_failure(self):
+        test_question = {'quiz_category': {'type': 'Art', 'id': 2}, 'previous_questions': [], 'count': 1000}
+        res = self.client().post('/quizzes', json=test_question)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['message'], 'bad request')
+
+    # Check a misspelled guess on the server
+    def test_check_quiz_answer(self):
+        res = self.client().post('/quizzes/answer', json={'question_id': 12, 'answer': 'george washington carvr'})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(data['correct'], True)
+        self.assertEqual(data['answer'], 'George Washington Carver')
+
+    # Extra words, a different letter or a lone article do not get past the answer check
+    def test_check_answer_exact_words(self):
+        self.assertFalse(check_answer('brazil uruguay argentina chile', normalize_answer('Brazil')))
+        self.assertFalse(check_answer('vitamin c', normalize_answer('Vitamin A')))
+        self.assertTrue(check_answer('vitamin a', normalize_answer('Vitamin A')))
+        self.assertTrue(check_answer('A', normalize_answer('A')))
+        self.assertTrue(check_answer('washington carver george', normalize_answer('George Washington Carver')))
+
+    # Check a guess for a question that does not exist
+    def test_check_quiz_answer_failure(self):
+        res = self.client().post('/quizzes/answer', json={'question_id': 1000, 'answer': 'anything'})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 404)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['message'], 'resource not found')
+
+    # A reworded copy of an existing question is rejected
+    def test_create_duplicate_question_failure(self):
+        res = self.client().post('/questions', json={
+            'question': "WHOSE autobiography is entitled 'I know why the caged bird sings'",
+            'answer': 'Maya Angelou', 'category': 4, 'difficulty': 2})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 409)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['message'], 'duplicate question')
+        self.assertIn(5, [duplicate['id'] for duplicate in data['duplicates']])
+
+    # allow_duplicate inserts the copy anyway
+    def test_create_duplicate_question_allowed(self):
+        res = self.client().post('/questions', json={
+            'question': "WHOSE autobiography is entitled 'I know why the caged bird sings'",
+            'answer': 'Maya Angelou', 'category': 4, 'difficulty': 2, 'allow_duplicate': True})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertTrue(data['created'])
+
+    # Searches show up among the hot search terms
+    def test_hot_analytics(self):
+        self.client().post('/questions', json={'searchTerm': 'Title'})
+        res = self.client().get('/analytics/hot')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertIn('title', [entry['term'] for entry in data['search_terms']])
+        self.assertIn('unique_players', data)
+
+    # A limit past the top-k size is rejected
+    def test_hot_analytics_failure(self):
+        res = self.client().get('/analytics/hot?limit=100000')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['message'], 'bad request')
+
+    # Listing filtered by difficulty counts only the matches
+    def test_filter_questions(self):
+        everything = json.loads(self.client().get('/questions').data)
+        res = self.client().get('/questions?difficulty=1,2')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertTrue(all(question['difficulty'] in (1, 2) for question in data['questions']))
+        self.assertLess(data['total_questions'], everything['total_questions'])
+
+    # No question has this difficulty
+    def test_filter_questions_failure(self):
+        res = self.client().get('/questions?difficulty=9')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 404)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['message'], 'resource not found')
+
+    # Subcategories are listed with their parent
+    def test_create_subcategory(self):
+        res = self.client().post('/categories', json={'type': 'Optics', 'parent_id': 1})
+        data = json.loads(res.data)
+        subcategory = data['created']
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+
+        before = json.loads(self.client().get('/categories/1/questions').data)['total_questions']
+        self.client().post('/questions', json={'question': 'What does a prism split white light into?', 'answer': 'A spectrum', 'category': subcategory, 'difficulty': 2, 'allow_duplicate': True})
+        after = json.loads(self.client().get('/categories/1/questions').data)['total_questions']
+        parents = json.loads(self.client().get('/categories').data)['parents']
+
+        self.assertEqual(after, before + 1)
+        self.assertEqual(parents[str(subcategory)], 1)
+
+    # A category cannot move below its own subcategory
+    def test_move_category_failure(self):
+        subcategory = json.loads(self.client().post('/categories', json={'type': 'Lenses', 'parent_id': 1}).data)['created']
+        res = self.client().patch('/categories/1', json={'parent_id': subcategory})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['message'], 'unprocessable')
+
+    # One bulk update moves every question matching a filter
+    def test_bulk_update_questions(self):
+        ids = [json.loads(self.client().post('/questions', json=dict(self.new_question, allow_duplicate=True)).data)['created'] for _ in range(3)]
+        res = self.client().post('/questions/bulk-update', json={'question_ids': ids, 'set': {'category': 6, 'difficulty': 5}, 'progress': True})
+        lines = [json.loads(line) for line in res.data.decode().splitlines()]
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(lines[-1]['success'], True)
+        self.assertEqual(lines[-1]['changed'], 3)
+
+        res = self.client().post('/questions/bulk-delete', json={'question_ids': ids})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['changed'], 3)
+
+    # Bulk changes need ids or a filter naming at least one field
+    def test_bulk_delete_questions_failure(self):
+        res = self.client().post('/questions/bulk-delete', json={'filter': {}})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['message'], 'bad request')
+
+    # Bulk tagging, then listing by a tag intersection
+    def test_tag_questions(self):
+        res = self.client().post('/questions/tags', json={'question_ids': [16, 17, 18], 'tags': ['Painters', 'europe']})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(data['tags'], ['europe', 'painters'])
+
+        res = self.client().get('/questions?tags=painters,europe')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(sorted(question['id'] for question in data['questions']), [16, 17, 18])
+        self.assertTrue(all('painters' in question['tags'] for question in data['questions']))
+
+    # Bulk tagging needs at least one tag
+    def test_tag_questions_failure(self):
+        res = self.client().post('/questions/tags', json={'question_ids': [16], 'tags': []})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['message'], 'bad request')
+
+    # Search counts the matches and breaks them down by category and difficulty
+    def test_search_facets(self):
+        res = self.client().post('/questions', json={'searchTerm': 'title'})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(data['total_questions'], len(data['questions']))
+        self.assertEqual(sum(data['facets']['categories'].values()), data['total_questions'])
+        self.assertEqual(sum(data['facets']['difficulties'].values()), data['total_questions'])
+
+    # A misspelled search is corrected and retried
+    def test_search_with_typo(self):
+        res = self.client().post('/questions', json={'searchTerm': 'Peanut Buter'})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(data['corrected_search_term'], 'peanut butter')
+        self.assertIn(12, [question['id'] for question in data['questions']])
+
+    # Nothing close enough to correct to
+    def test_search_with_typo_failure(self):
+        res = self.client().post('/questions', json={'searchTerm': 'qqqqzzzz'})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['corrected_search_term'], None)
+        self.assertEqual(data['questions'], [])
+
+    # Suggestions include whole answers
+    def test_suggest_questions(self):
+        res = self.client().get('/questions/suggest?q=george wa')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertIn('george washington carver', [suggestion['term'] for suggestion in data['suggestions']])
+
+    # A suggestion needs a prefix
+    def test_suggest_questions_failure(self):
+        res = self.client().get('/questions/suggest?q=')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['message'], 'bad request')
+
+    # Neighbours come from the precomputed table
+    def test_similar_questions(self):
+        from flaskr.similarity import compute_neighbours
+        with self.app.app_context():
+            compute_neighbours(k=5)
+        res = self.client().get('/questions/5/similar')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertLessEqual(len(data['questions']), 5)
+
+    # An incremental run after a full one has nothing left to score
+    def test_similar_questions_incremental(self):
+        from flaskr.similarity import compute_neighbours
+        with self.app.app_context():
+            compute_neighbours(k=5)
+            pending = Question.query.filter(Question.deleted_at.is_(None), Question.neighbours_at.is_(None)).count()
+            changed = compute_neighbours(k=5, incremental=True)
+
+        self.assertEqual(pending, 0)
+        self.assertEqual(changed, 0)
+
+    # Similar questions of a question that does not exist
+    def test_similar_questions_failure(self):
+        res = self.client().get('/questions/1000/similar')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 404)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['message'], 'resource not found')
+
+    # Answers are counted once the stats counters flush
+    def test_question_stats(self):
+        self.client().post('/quizzes/answer', json={'question_id': 12, 'answer': 'george washington carver'})
+        self.client().post('/quizzes/answer', json={'question_id': 12, 'answer': 'thomas edison'})
+        # answers reach the stats through the answer event buffer
+        self.app.extensions['answer_events'].close()
+        self.app.extensions['question_stats'].flush()
+        res = self.client().get('/questions/12/stats')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertGreaterEqual(data['answered'], 2)
+        self.assertIsNotNone(data['correct_rate'])
+
+    # Stats of a category that does not exist
+    def test_category_stats_failure(self):
+        res = self.client().get('/categories/1000/stats')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 404)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['message'], 'resource not found')
+
+    # Record a score and find the player on the leaderboard
+    def test_create_score(self):
+        res = self.client().post('/scores', json={'player': 'tester', 'score': 4, 'category': 2})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertTrue(data['rank'])
+        self.assertTrue(data['category_rank'])
+        rank = data['rank']
+
+        res = self.client().get('/leaderboard?around=tester')
+        data = json.loads(res.data)
+        ranks = [entry['rank'] for entry in data['leaderboard']]
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIn(('tester', rank), [(entry['player'], entry['rank']) for entry in data['leaderboard']])
+        self.assertGreaterEqual(ranks[0], 1)
+        self.assertEqual(ranks, list(range(ranks[0], ranks[0] + len(ranks))))
+
+    # Scores are queued and counted by the ingestion pipeline
+    def test_ingestion_metrics(self):
+        self.client().post('/scores', json={'player': 'tester', 'score': 2})
+        res = self.client().get('/metrics/ingestion')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(data['scores']['published'], 1)
+        self.assertIn('queued', data['answers'])
+
+    # A row the database refuses is dropped, the rows queued with it are still written
+    def test_ingestion_drops_refused_rows(self):
+        events = self.app.extensions['score_events']
+        events.publish({'player': 'refused', 'score': 10 ** 12, 'category': None, 'created_at': datetime.utcnow()})
+        events.publish({'player': 'accepted', 'score': 3, 'category': None, 'created_at': datetime.utcnow()})
+        events.close()
+        metrics = events.metrics()
+
+        self.assertEqual(metrics['dropped'], 1)
+        self.assertEqual(metrics['written'], 1)
+        with self.app.app_context():
+            self.assertTrue(Score.query.filter(Score.player == 'accepted').count())
+            self.assertFalse(Score.query.filter(Score.player == 'refused').count())
+
+    # Score without a player is rejected
+    def test_create_score_failure(self):
+        res = self.client().post('/scores', json={'score': 4})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['message'], 'bad request')
+
+    # Scores that are not whole numbers the scores column can hold are rejected
+    def test_create_score_out_of_range(self):
+        for score in (10 ** 12, -1, True):
+            res = self.client().post('/scores', json={'player': 'tester', 'score': score})
+            data = json.loads(res.data)
+
+            self.assertEqual(res.status_code, 400)
+            self.assertEqual(data['success'], False)
+            self.assertEqual(data['message'], 'bad request')
+
+    # Leaderboard around an unknown player
+    def test_get_leaderboard_failure(self):
+        res = self.client().get('/leaderboard?around=nobody-has-this-name')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 404)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['message'], 'resource not found')
+
+    # A player's event stream ends when the room finishes or expires
+    def test_room_streams_end(self):
+        rooms = RoomRegistry(8, 0.01, 3600)
+        room = rooms.create(None)
+        stream = rooms.subscribe(room, 'player')
+        rooms.finish(room)
+        events = list(itertools.islice(stream, 50))
+
+        self.assertLess(len(events), 50)
+        self.assertIn(b'event: finished', events[-1])
+
+        rooms.idle_seconds = -1
+        room = rooms.create(None)
+        stream = rooms.subscribe(room, 'player')
+        rooms.create(None)
+
+        self.assertLess(len(list(itertools.islice(stream, 50))), 50)
+
+    # Host a room, ask a question and answer it
+    def test_play_room(self):
+        res = self.client().post('/rooms', json={'quiz_category': {'type': 'Art', 'id': 2}})
+        room = json.loads(res.data)
+
+        res = self.client().post('/rooms/{}/next'.format(room['code']), headers={'X-Host-Token': room['host_token']})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertNotIn('answer', data['question'])
+
+        res = self.client().post('/rooms/{}/answers'.format(room['code']), json={'player': 'tester', 'answer': 'no idea'})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['correct'], False)
+
+    # Only the host may move a room on
+    def test_play_room_failure(self):
+        res = self.client().post('/rooms', json={'quiz_category': {'type': 'Art', 'id': 2}})
+        room = json.loads(res.data)
+
+        res = self.client().post('/rooms/{}/next'.format(room['code']))
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 403)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['message'], 'forbidden')
+
+    # Clients over their rate limit are told when to retry
+    def test_rate_limit(self):
+        client = create_app({"INVALIDATION_BUS": False, "API_KEYS": {'rate-limit-test'}}).test_client()
+        for _ in range(10):
+            client.post('/scores', json={}, headers={'X-API-Key': 'rate-limit-test'})
+        res = client.post('/scores', json={}, headers={'X-API-Key': 'rate-limit-test'})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 429)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['message'], 'too many requests')
+        self.assertTrue(int(res.headers['Retry-After']))
+
+    # An unknown API key does not get a bucket of its own, the client address is limited
+    def test_rate_limit_unknown_api_keys(self):
+        client = self.client()
+        for attempt in range(10):
+            client.post('/scores', json={}, headers={'X-API-Key': 'made-up-{}'.format(attempt)})
+        res = client.post('/scores', json={}, headers={'X-API-Key': 'made-up-again'})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 429)
+        self.assertEqual(data['message'], 'too many requests')
+
+    # Repeated reads are served from the response cache
+    def test_cache_stats(self):
+        self.client().get('/categories')
+        self.client().get('/categories')
+        res = self.client().get('/cache/stats')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertTrue(data['hits'])
+        self.assertTrue(data['entries'])
+
+    # Writing a question drops the cached pages of its category
+    def test_cache_invalidated_on_insert(self):
+        before = json.loads(self.client().get('/categories/3/questions').data)
+        self.client().post('/questions', json={'question': 'cache test', 'answer': 'cache', 'category': 3, 'difficulty': 1})
+        after = json.loads(self.client().get('/categories/3/questions').data)
+
+        self.assertEqual(after['total_questions'], before['total_questions'] + 1)
+
+    # Expired pages are served stale while they are refreshed in the background
+    def test_stale_while_revalidate(self):
+        self.app.extensions['response_cache'].fresh_seconds = 0
+        self.client().get('/categories')
+        res = self.client().get('/categories')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertIn('110', res.headers['Warning'])
+        self.assertIn('Age', res.headers)
+
+    # Writes announced by other workers drop this worker's cached pages
+    def test_invalidation_bus_replays_remote_changes(self):
+        app = create_app({"SQLALCHEMY_DATABASE_URI": self.database_path})
+        app.test_client().get('/categories/3/questions')
+        cache = app.extensions['response_cache']
+        self.assertEqual(cache.stats()['entries'], 1)
+
+        message = {'origin': 'another-worker', 'entity': 'question', 'action': 'insert', 'questions': [{'id': 1000, 'category': 3}]}
+        app.extensions['invalidation_bus']._apply(json.dumps(message))
+
+        self.assertEqual(cache.stats()['entries'], 0)
+        self.assertEqual(cache.stats()['invalid_entries'], 1)
+
+    # Workers forked from one preloaded app do not take each other's changes for their own
+    def test_invalidation_bus_origin_per_process(self):
+        app = create_app({"SQLALCHEMY_DATABASE_URI": self.database_path})
+        bus = app.extensions['invalidation_bus']
+        with mock.patch('flaskr.invalidation.os.getpid', return_value=1):
+            sibling = bus._origin
+
+        self.assertNotEqual(sibling, bus._origin)
+
+    # Quiz following a difficulty curve across several categories
+    def test_play_quiz_difficulty_curve(self):
+        test_question = {'quiz_category': {'type': 'click', 'id': 0}, 'previous_questions': [], 'categories': [2, 4], 'difficulty_curve': [1, 2, 3]}
+        res = self.client().post('/quizzes', json=test_question)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(len(data['questions']), 3)
+        self.assertTrue(all(str(question['category']) in ('2', '4') for question in data['questions']))
+
+    # Quiz restricted to a difficulty range
+    def test_play_quiz_difficulty_range(self):
+        test_question = {'quiz_category': {'type': 'Art', 'id': 2}, 'previous_questions': [], 'difficulty': {'min': 1, 'max': 2}, 'count': 5}
+        res = self.client().post('/quizzes', json=test_question)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(all(question['difficulty'] <= 2 for question in data['questions']))
+
+    # Quiz across categories takes from each in turn
+    def test_play_quiz_stratified(self):
+        test_question = {'quiz_category': {'type': 'click', 'id': 0}, 'previous_questions': [], 'categories': [2, 6], 'count': 2}
+        res = self.client().post('/quizzes', json=test_question)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(sorted(str(question['category']) for question in data['questions']), ['2', '6'])
+
+    # A difficulty curve must be a list
+    def test_play_quiz_difficulty_curve_failure(self):
+        test_question = {'quiz_category': {'type': 'Art', 'id': 2}, 'previous_questions': [], 'difficulty_curve': 'easy'}
+        res = self.client().post('/quizzes', json=test_question)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+
+    # Adaptive quiz picks by rating and answers move the skill estimate
+    def test_play_quiz_adaptive(self):
+        test_question = {'quiz_category': {'type': 'Art', 'id': 2}, 'previous_questions': [], 'adaptive': True, 'skill': 0.0}
+        res = self.client().post('/quizzes', json=test_question)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIn('rating', data['question'])
+
+        res = self.client().post('/quizzes/answer', json={'question_id': data['question']['id'], 'answer': 'wrong', 'player': 'tester', 'skill': 0.0})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertLess(data['skill'], 0.0)
+
+    # Adaptive quiz needs a numeric skill
+    def test_play_quiz_adaptive_failure(self):
+        test_question = {'quiz_category': {'type': 'Art', 'id': 2}, 'previous_questions': [], 'adaptive': True, 'skill': 'expert'}
+        res = self.client().post('/quizzes', json=test_question)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+
     #Play Quiz failure
     def test_quiz_question_failure(self):
         test_question = {'quiz_category': {'type': 'Entertainment', 'id': 5},'previous_questions': ['1']}
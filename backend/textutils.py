@@ -0,0 +1,86 @@
+import re
+from functools import lru_cache
+
+ARTICLES = frozenset(['a', 'an', 'the'])
+PUNCTUATION = re.compile(r"[^\w\s]")
+NUMBERS = re.compile(r"\d+")
+# a single letter carries the whole answer in "vitamin a" or "plan b", like a number it is never a typo
+LETTER = re.compile(r"\b\w\b")
+
+# question words that would make every question look alike
+STOPWORDS = frozenset('''
+  what which who whom whose when where why how is was are were be been of in on to and or for by with as at
+  from this that these those it its did does do many much name named called known
+'''.split())
+
+'''
+normalize_answer(text)
+    case folds, strips punctuation and articles and collapses whitespace
+    the last word is always kept, "vitamin a" is not "vitamin" and "a" stays "a"
+    results are cached because the same guesses and answers repeat constantly
+'''
+@lru_cache(maxsize=8192)
+def normalize_answer(text):
+  words = PUNCTUATION.sub(' ', text.casefold()).split()
+  return ' '.join([word for word in words[:-1] if word not in ARTICLES] + words[-1:])
+
+'''
+typo_budget(answer)
+    number of edits tolerated for a normalized answer, one per five characters
+'''
+def typo_budget(answer):
+  return min(len(answer) // 5, 3)
+
+'''
+within_edit_distance(a, b, limit)
+    Levenshtein distance check restricted to a band of width 2 * limit + 1
+    gives up as soon as a whole row exceeds the limit
+'''
+def within_edit_distance(a, b, limit):
+  if abs(len(a) - len(b)) > limit:
+    return False
+  if a == b:
+    return True
+
+  over = limit + 1
+  previous = [j if j <= limit else over for j in range(len(b) + 1)]
+  for i in range(1, len(a) + 1):
+    current = [i if i <= limit else over] + [over] * len(b)
+    row_min = current[0]
+    char = a[i - 1]
+    for j in range(max(1, i - limit), min(len(b), i + limit) + 1):
+      value = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char != b[j - 1]))
+      if value > over:
+        value = over
+      current[j] = value
+      if value < row_min:
+        row_min = value
+    if row_min > limit:
+      return False
+    previous = current
+
+  return previous[len(b)] <= limit
+
+'''
+check_answer(guess, normalized_answer)
+    True for an exact match, the answer's words in another order,
+    or a guess within the answer's typo budget
+    extra words are wrong, "brazil uruguay" does not answer "brazil"
+    numbers and single letters are never treated as typos,
+    "apollo 12" is not "apollo 13" and "vitamin c" is not "vitamin a"
+'''
+def check_answer(guess, normalized_answer):
+  guess = normalize_answer(guess)
+  if not guess or not normalized_answer:
+    return False
+  if guess == normalized_answer:
+    return True
+  if sorted(guess.split()) == sorted(normalized_answer.split()):
+    return True
+
+  if NUMBERS.findall(guess) != NUMBERS.findall(normalized_answer):
+    return False
+  if LETTER.findall(guess) != LETTER.findall(normalized_answer):
+    return False
+
+  return within_edit_distance(guess, normalized_answer, typo_budget(normalized_answer))
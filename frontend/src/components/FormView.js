@@ -33,6 +33,10 @@ class FormView extends Component {
 
   submitQuestion = (event) => {
     event.preventDefault();
+    this.postQuestion(false);
+  }
+
+  postQuestion = (allowDuplicate) => {
     $.ajax({
       url: '/questions', //TODO: update request URL
       type: "POST",
@@ -42,7 +46,8 @@ class FormView extends Component {
         question: this.state.question,
         answer: this.state.answer,
         difficulty: this.state.difficulty,
-        category: this.state.category
+        category: this.state.category,
+        allow_duplicate: allowDuplicate
       }),
       xhrFields: {
         withCredentials: true
@@ -53,6 +58,13 @@ class FormView extends Component {
         return;
       },
       error: (error) => {
+        if (error.status === 409) {
+          const ids = error.responseJSON.duplicates.map((duplicate) => duplicate.id).join(', ')
+          if (window.confirm(`This looks like question ${ids}. Add it anyway?`)) {
+            this.postQuestion(true);
+          }
+          return;
+        }
         alert('Unable to add question. Please try your request again')
         return;
       }
@@ -14,7 +14,7 @@ class Question extends Component {
   }
 
   render() {
-    const { question, answer, category, difficulty } = this.props;
+    const { question, answer, category, difficulty, stats } = this.props;
     return (
       <div className="Question-holder">
         <div className="Question">{question}</div>
@@ -24,6 +24,11 @@ class Question extends Component {
           <img src="delete.png" className="delete" onClick={() => this.props.questionAction('DELETE')}/>
           
         </div>
+        {stats && (
+          <div className="Question-stats">
+            Played {stats.served}, {stats.correct_rate === null ? 'not answered yet' : `${Math.round(stats.correct_rate * 100)}% correct`}
+          </div>
+        )}
         <div className="show-answer button"
             onClick={() => this.flipVisibility()}>
             {this.state.visibleAnswer ? 'Hide' : 'Show'} Answer
@@ -143,6 +143,7 @@ class QuestionView extends Component {
               answer={q.answer}
               category={this.state.categories[q.category]} 
               difficulty={q.difficulty}
+              stats={q.stats}
               questionAction={this.questionAction(q.id)}
             />
           ))}
@@ -5,6 +5,16 @@ import '../stylesheets/QuizView.css';
 
 const questionsPerPlay = 5; 
 
+// answers are logged under a random id kept in this browser, so rating calibration can tell players apart
+const playerId = () => {
+  let id = window.localStorage.getItem('playerId')
+  if (!id) {
+    id = 'player-' + Math.random().toString(36).slice(2, 12)
+    window.localStorage.setItem('playerId', id)
+  }
+  return id
+}
+
 class QuizView extends Component {
   constructor(props){
     super();
@@ -15,7 +25,11 @@ class QuizView extends Component {
         categories: {},
         numCorrect: 0,
         currentQuestion: {},
+        upcomingQuestions: [],
         guess: '',
+        result: {},
+        player: '',
+        savedRank: null,
         forceEnd: false
     }
   }
@@ -47,6 +61,12 @@ class QuizView extends Component {
     const previousQuestions = [...this.state.previousQuestions]
     if(this.state.currentQuestion.id) { previousQuestions.push(this.state.currentQuestion.id) }
 
+    // questions are fetched in one batch up front, so moving on is instant
+    if(this.state.upcomingQuestions.length) {
+      this.showNextQuestion(previousQuestions)
+      return;
+    }
+
     $.ajax({
       url: '/quizzes', //TODO: update request URL
       type: "POST",
@@ -54,20 +74,15 @@ class QuizView extends Component {
       contentType: 'application/json',
       data: JSON.stringify({
         previous_questions: previousQuestions,
-        quiz_category: this.state.quizCategory
+        quiz_category: this.state.quizCategory,
+        count: Math.max(questionsPerPlay - previousQuestions.length, 1)
       }),
       xhrFields: {
         withCredentials: true
       },
       crossDomain: true,
       success: (result) => {
-        this.setState({
-          showAnswer: false,
-          previousQuestions: previousQuestions,
-          currentQuestion: result.question,
-          guess: '',
-          forceEnd: result.question ? false : true
-        })
+        this.setState({ upcomingQuestions: result.questions }, () => this.showNextQuestion(previousQuestions))
         return;
       },
       error: (error) => {
@@ -77,13 +92,46 @@ class QuizView extends Component {
     })
   }
 
+  showNextQuestion = (previousQuestions) => {
+    const [nextQuestion, ...upcomingQuestions] = this.state.upcomingQuestions
+    this.setState({
+      showAnswer: false,
+      previousQuestions: previousQuestions,
+      currentQuestion: nextQuestion || {},
+      upcomingQuestions: upcomingQuestions,
+      guess: '',
+      forceEnd: nextQuestion ? false : true
+    })
+  }
+
   submitGuess = (event) => {
     event.preventDefault();
-    const formatGuess = this.state.guess.replace(/[.,\/#!$%\^&\*;:{}=\-_`~()]/g,"").toLowerCase()
-    let evaluate =  this.evaluateAnswer()
-    this.setState({
-      numCorrect: !evaluate ? this.state.numCorrect : this.state.numCorrect + 1,
-      showAnswer: true,
+    $.ajax({
+      url: '/quizzes/answer',
+      type: "POST",
+      dataType: 'json',
+      contentType: 'application/json',
+      data: JSON.stringify({
+        question_id: this.state.currentQuestion.id,
+        answer: this.state.guess,
+        player: playerId()
+      }),
+      xhrFields: {
+        withCredentials: true
+      },
+      crossDomain: true,
+      success: (result) => {
+        this.setState({
+          numCorrect: !result.correct ? this.state.numCorrect : this.state.numCorrect + 1,
+          result: result,
+          showAnswer: true,
+        })
+        return;
+      },
+      error: (error) => {
+        alert('Unable to check your answer. Please try again')
+        return;
+      }
     })
   }
 
@@ -94,11 +142,41 @@ class QuizView extends Component {
       showAnswer: false,
       numCorrect: 0,
       currentQuestion: {},
+      upcomingQuestions: [],
       guess: '',
+      result: {},
+      savedRank: null,
       forceEnd: false
     })
   }
 
+  saveScore = (event) => {
+    event.preventDefault();
+    $.ajax({
+      url: '/scores',
+      type: "POST",
+      dataType: 'json',
+      contentType: 'application/json',
+      data: JSON.stringify({
+        player: this.state.player,
+        score: this.state.numCorrect,
+        category: parseInt(this.state.quizCategory.id, 10) || null
+      }),
+      xhrFields: {
+        withCredentials: true
+      },
+      crossDomain: true,
+      success: (result) => {
+        this.setState({ savedRank: result.rank })
+        return;
+      },
+      error: (error) => {
+        alert('Unable to save your score. Please try again')
+        return;
+      }
+    })
+  }
+
   renderPrePlay(){
       return (
           <div className="quiz-play-holder">
@@ -125,25 +203,26 @@ class QuizView extends Component {
     return(
       <div className="quiz-play-holder">
         <div className="final-header"> Your Final Score is {this.state.numCorrect}</div>
+        {this.state.savedRank
+          ? <div className="final-rank"> You are ranked #{this.state.savedRank} on the leaderboard</div>
+          : (
+            <form onSubmit={this.saveScore}>
+              <input type="text" name="player" placeholder="Your name" onChange={this.handleChange}/>
+              <input className="button" type="submit" value="Save Score" />
+            </form>
+          )}
         <div className="play-again button" onClick={this.restartGame}> Play Again? </div>
       </div>
     )
   }
 
-  evaluateAnswer = () => {
-    const formatGuess = this.state.guess.replace(/[.,\/#!$%\^&\*;:{}=\-_`~()]/g,"").toLowerCase()
-    const answerArray = this.state.currentQuestion.answer.toLowerCase().split(' ');
-    return answerArray.every(el => formatGuess.includes(el));
-  }
-
   renderCorrectAnswer(){
-    const formatGuess = this.state.guess.replace(/[.,\/#!$%\^&\*;:{}=\-_`~()]/g,"").toLowerCase()
-    let evaluate =  this.evaluateAnswer()
+    const evaluate = this.state.result.correct
     return(
       <div className="quiz-play-holder">
         <div className="quiz-question">{this.state.currentQuestion.question}</div>
         <div className={`${evaluate ? 'correct' : 'wrong'}`}>{evaluate ? "You were correct!" : "You were incorrect"}</div>
-        <div className="quiz-answer">{this.state.currentQuestion.answer}</div>
+        <div className="quiz-answer">{this.state.result.answer}</div>
         <div className="next-question button" onClick={this.getNextQuestion}> Next Question </div>
       </div>
     )
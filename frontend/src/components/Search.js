@@ -1,8 +1,17 @@
 import React, { Component } from 'react'
+import $ from 'jquery';
+
+// wait for a pause in typing before asking for suggestions
+const SUGGEST_DELAY_MS = 150
 
 class Search extends Component {
   state = {
     query: '',
+    suggestions: [],
+  }
+
+  componentWillUnmount() {
+    clearTimeout(this.suggestTimer)
   }
 
   getInfo = (event) => {
@@ -10,12 +19,36 @@ class Search extends Component {
     this.props.submitSearch(this.state.query)
   }
 
-  handleInputChange = () => {
-    this.setState({
-      query: this.search.value
+  getSuggestions = (query) => {
+    $.ajax({
+      url: `/questions/suggest?q=${encodeURIComponent(query)}`,
+      type: "GET",
+      success: (result) => {
+        // drop answers to a prefix the user has already typed past
+        if (query === this.state.query) {
+          this.setState({ suggestions: result.suggestions })
+        }
+        return;
+      },
+      error: (error) => {
+        this.setState({ suggestions: [] })
+        return;
+      }
     })
   }
 
+  handleInputChange = () => {
+    const query = this.search.value
+    this.setState({ query: query })
+
+    clearTimeout(this.suggestTimer)
+    if (query.trim()) {
+      this.suggestTimer = setTimeout(() => this.getSuggestions(query), SUGGEST_DELAY_MS)
+    } else {
+      this.setState({ suggestions: [] })
+    }
+  }
+
   render() {
     return (
       <form onSubmit={this.getInfo}>
@@ -23,7 +56,14 @@ class Search extends Component {
           placeholder="Search questions..."
           ref={input => this.search = input}
           onChange={this.handleInputChange}
+          list="search-suggestions"
+          autoComplete="off"
         />
+        <datalist id="search-suggestions">
+          {this.state.suggestions.map((suggestion) => (
+            <option key={suggestion.term} value={suggestion.term} />
+          ))}
+        </datalist>
         <input type="submit" value="Submit" className="button"/>
       </form>
     )